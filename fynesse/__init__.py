@@ -1,2 +1,9 @@
-from . import access
-from . import assess
+import importlib
+
+# The stage modules are imported on first use, so importing the package does not import their dependencies
+__all__ = ["access", "assess", "address"]
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,22 +1,119 @@
 from .config import *
-import requests
-import pymysql
-import osmnx as ox
-from functools import cache
+from . import instrument
+import numpy as np
+import pandas as pd
+import os
+import math
+import datetime
+import hashlib
+import sys
+import itertools
+import json
+import logging
+import time
+import warnings
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager
 
 # This file accesses the data
 
 """Place commands in this file to access the data electronically. Don't remove any missing values, or deal with outliers. Make sure you have legalities correct, both intellectual property and personal data privacy rights. Beyond the legal side also think about the ethical issues around this data. """
 
-def download_url(folder, filename, url):
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """
+    Get the HTTP session shared by downloads, creating it on first use
+    :return: requests.Session object
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            _session = requests.Session()
+        return _session
+
+def file_digest(path, algorithm="sha256", chunk_size=1 << 20):
+    """
+    Compute the digest of a file, reading it in chunks
+    :param path: The path of the file
+    :param algorithm: The hashlib algorithm (optional)
+    :param chunk_size: The number of bytes read at once (optional)
+    :return: hashlib hash object of the file contents
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest
+
+def _parse_checksum(checksum):
+    algorithm, _, expected = checksum.rpartition(":")
+    return (algorithm or "sha256"), expected.lower()
+
+def download_url(folder, filename, url, checksum=None, chunk_size=1 << 20, resume=True):
     """
     Save data from specified url to the filepath specified by folder and filename
+    The data is streamed to disk in chunks, so memory use does not grow with the size of the file. It is written to
+    filename.part and moved into place when complete, an existing .part file is resumed with a Range request
     : param folder: The folder to save the data to
     : param filename: The name of the file to be saved to
     : param url: The url the data should be downloaded from
+    : param checksum: Expected digest of the file as "algorithm:hex" or a sha256 hex digest, the download is skipped
+    if the file already matches it and fails if the downloaded file does not (optional)
+    : param chunk_size: The number of bytes written at once (optional)
+    : param resume: When False, restart downloads rather than resuming .part files (optional)
+    : return: The path of the downloaded file
     """
-    r = requests.get(url, allow_redirects=True)
-    open(f"{folder}/{filename}", "wb").write(r.content)
+    path = f"{folder}/{filename}"
+    part = path + ".part"
+    if checksum is not None:
+        algorithm, expected = _parse_checksum(checksum)
+        if os.path.exists(path) and file_digest(path, algorithm).hexdigest() == expected:
+            return path
+
+    offset = os.path.getsize(part) if resume and os.path.exists(part) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with get_session().get(url, allow_redirects=True, stream=True, headers=headers) as r:
+        # 416 means the part file is already complete
+        if r.status_code != 416:
+            r.raise_for_status()
+            mode = "ab" if offset and r.status_code == 206 else "wb"
+            with open(part, mode) as file:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    file.write(chunk)
+                    instrument.count("bytes_downloaded", len(chunk))
+
+    if checksum is not None and file_digest(part, algorithm).hexdigest() != expected:
+        os.remove(part)
+        raise ValueError(f"Checksum of {url} does not match {checksum}")
+    os.replace(part, path)
+    return path
+
+def download_urls(folder, downloads, workers=4, **kwargs):
+    """
+    Download a list of urls concurrently with a bounded pool of workers, see download_url
+    : param folder: The folder to save the data to
+    : param downloads: list of (filename, url) or (filename, url, checksum) tuples
+    : param workers: The maximum number of downloads at once (optional)
+    : param kwargs: Further arguments of download_url (optional)
+    : return: dict of filename to the path of the downloaded file, or None if its download failed
+    """
+    def download(item):
+        filename, url, *checksum = item
+        try:
+            return filename, download_url(folder, filename, url, *checksum, **kwargs)
+        except Exception as e:
+            print(f"Failed to download {url}: {e}")
+            return filename, None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(executor.map(download, downloads))
 
 def make_conn():
     """
@@ -24,8 +121,7 @@ def make_conn():
     : return: Connection object
     """
     if "username" in config and "password" in config and "host" in config and "database" in config:
-        if "port" not in config:
-            port = 3306
+        port = config.get("port", 3306)
         return create_connection(config["username"], config["password"], config["host"], config["database"], port)
     raise NotImplementedError("Specify connection details in access.config mapping")
 
@@ -39,6 +135,7 @@ def create_connection(user, password, host, database, port = 3306):
     :param port: port number
     :return: Connection object or None
     """
+    import pymysql
     conn = None
     try:
         conn = pymysql.connect(user=user,
@@ -52,6 +149,197 @@ def create_connection(user, password, host, database, port = 3306):
         print(f"Error connecting to the MariaDB Server: {e}")
     return conn
 
+# The SERVER_STATUS_IN_TRANS flag of pymysql.constants.SERVER_STATUS, by value so that pymysql is only imported on connecting
+SERVER_STATUS_IN_TRANS = 1
+
+class ConnectionPool:
+    """
+    Thread safe pool of database connections
+    Connections are created on demand up to size, and returned to the pool rather than closed when they are checked
+    in. A connection is pinged when it is checked out only if it has been idle for more than ping_after seconds,
+    and rolled back when it is checked in only if a transaction is open, so a pooled query costs no extra round trips
+    """
+    def __init__(self, connect, size=5, timeout=None, ping_after=30):
+        """
+        :param connect: Function with no arguments that creates a new Connection object, for example make_conn
+        :param size: The maximum number of connections open at once (optional)
+        :param timeout: Seconds to wait for a connection when all are checked out, None to wait forever (optional)
+        :param ping_after: Seconds a connection may be idle before it is checked for health on checkout (optional)
+        """
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._idle = [] # (connection, time.monotonic() when it was checked in)
+        # Guards _idle and _created, notified whenever a connection is checked in or a slot is freed
+        self._available = threading.Condition()
+        self._created = 0
+
+    def _create(self):
+        """
+        Open a new connection in a slot already counted in _created, freeing the slot if it cannot be opened
+        """
+        try:
+            conn = self._connect()
+        except Exception:
+            self._free_slot()
+            raise
+        if conn is None:
+            self._free_slot()
+            raise ConnectionError("Could not open a connection to the MariaDB Server")
+        return conn
+
+    def _free_slot(self):
+        with self._available:
+            self._created -= 1
+            self._available.notify()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._free_slot()
+
+    @staticmethod
+    def healthy(conn):
+        """
+        Check that a connection is still usable
+        :param conn: The Connection object
+        :return: True if the server answers a ping on the connection
+        """
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def in_transaction(conn):
+        """
+        Check whether a transaction is open on a connection, from the SERVER_STATUS_IN_TRANS flag of the server
+        status pymysql keeps from the last reply
+        :param conn: The Connection object
+        :return: True unless the connection reports that no transaction is open
+        """
+        status = getattr(conn, "server_status", None)
+        return status is None or bool(status & SERVER_STATUS_IN_TRANS)
+
+    def acquire(self):
+        """
+        Check out a connection, waiting for one to be released or discarded if size connections are checked out
+        :return: Connection object
+        """
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            with self._available:
+                while not self._idle and self._created >= self.size:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f"No connection was released within {self.timeout} seconds")
+                    self._available.wait(remaining)
+                if self._idle:
+                    conn, released = self._idle.pop()
+                else:
+                    conn = None
+                    self._created += 1
+            if conn is None:
+                return self._create()
+            if time.monotonic() - released <= self.ping_after or self.healthy(conn):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn):
+        """
+        Check in a connection so it can be reused
+        :param conn: The Connection object previously checked out with acquire
+        """
+        try:
+            if self.in_transaction(conn):
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        with self._available:
+            self._idle.append((conn, time.monotonic()))
+            self._available.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection for the duration of a with block
+        :return: Connection object
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """
+        Close every idle connection in the pool
+        """
+        with self._available:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Get the connection pool of the access.config mapping, creating it on first use
+    The pool size, checkout timeout and idle seconds before a ping are read from the "pool_size", "pool_timeout"
+    and "pool_ping_after" config keys
+    A process forked after the pool was created gets a pool of its own, connecting in the same way
+    :return: ConnectionPool object
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            connect = _pool._connect if _pool is not None else make_conn
+            _pool = ConnectionPool(connect, size=config.get("pool_size", 5), timeout=config.get("pool_timeout"),
+                ping_after=config.get("pool_ping_after", 30))
+            _pool_pid = os.getpid()
+        return _pool
+
+def use_pool(pool):
+    """
+    Replace the connection pool of the access.config mapping, for example with a pool of connections to a local
+    stand-in database (see synthetic.use_sqlite)
+    :param pool: ConnectionPool object
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        _pool = pool
+        _pool_pid = os.getpid()
+
+def close_pool():
+    """
+    Close the connections of the connection pool, a new pool is created on next use
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.close()
+        _pool = None
+
+@contextmanager
+def connection(conn = None):
+    """
+    Use the given connection, or check one out of the connection pool, for the duration of a with block
+    :param conn: the Connection object (optional)
+    :return: Connection object
+    """
+    if conn is not None:
+        yield conn
+    else:
+        with get_pool().connection() as conn:
+            yield conn
+
 def select_top(table, n, conn = None):
     """
     Query n first rows of the table
@@ -60,12 +348,11 @@ def select_top(table, n, conn = None):
     :param conn: the Connection object (optional)
     :return: tuple tuple of the first n rows of the table
     """
-    if conn is None:
-        conn = make_conn()
-    cur = conn.cursor()
-    cur.execute(f'SELECT * FROM {table} LIMIT {n}')
+    with connection(conn) as conn:
+        cur = conn.cursor()
+        cur.execute(f'SELECT * FROM {table} LIMIT {n}')
 
-    rows = cur.fetchall()
+        rows = cur.fetchall()
     return rows
 
 def head(table, n=5, conn = None):
@@ -74,8 +361,6 @@ def head(table, n=5, conn = None):
     :param table: The table to query
     :param conn: the Connection object (optional)
     """
-    if conn is None:
-        conn = make_conn()
     rows = select_top(table, n, conn = conn)
     for r in rows:
         print(r)
@@ -86,22 +371,164 @@ def upload_file(filename, table, conn = None):
     :param filename: The path to the file to be uploaded
     :param table: The table to be uploaded to
     :param conn: the Connection object (optional)
+    :return: The number of rows loaded
     """
-    if conn is None:
-        conn = make_conn()
-    cur = conn.cursor()
-    load_data = f"""LOAD DATA LOCAL INFILE '{filename}' INTO TABLE {table} FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' LINES STARTING BY '' TERMINATED BY '\n';"""
-    cur.execute(load_data)
-    conn.commit()
+    with connection(conn) as conn:
+        cur = conn.cursor()
+        load_data = f"""LOAD DATA LOCAL INFILE '{filename}' INTO TABLE {table} FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' LINES STARTING BY '' TERMINATED BY '\n';"""
+        rows = cur.execute(load_data)
+        conn.commit()
+    # The rows are committed, so a failure from here on is logged rather than raised: the caller, such as
+    # bulk_upload, would otherwise record the file as failed and load its rows again
+    for invalidate in (invalidate_rows_cache, invalidate_index):
+        try:
+            invalidate()
+        except Exception:
+            logger.exception(f"{invalidate.__name__} failed after uploading {filename} to {table}")
+    for listener in list(upload_listeners):
+        try:
+            listener(filename, table)
+        except Exception:
+            logger.exception(f"Upload listener {listener!r} failed after uploading {filename} to {table}")
+    return rows
+
+upload_listeners = []
 
-def local_features(latitude, longitude, width_km, height_km):
+def add_upload_listener(listener):
     """
-    Finds the features within the specified bounding box, returns dataframe with the number of each amenity
+    Register a function to be called after upload_file loads a file, for example to refresh models built on the table
+    :param listener: Function of the path of the uploaded file and the table it was uploaded to
+    """
+    upload_listeners.append(listener)
+
+def split_file(filename, chunk_bytes, directory=None):
+    """
+    Split a file into chunk files of about chunk_bytes each, at line boundaries
+    Chunk files that already exist are not written again, so a split can be resumed
+    :param filename: The path to the file to be split
+    :param chunk_bytes: The approximate size of each chunk in bytes
+    :param directory: The directory the chunks are written to (optional, default the directory of the file)
+    :return: list of the paths of the chunks, in order
+    """
+    directory = directory if directory is not None else os.path.dirname(os.path.abspath(filename))
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.basename(filename)
+    chunks = []
+    with open(filename, "rb") as file:
+        while True:
+            data = file.read(chunk_bytes)
+            if len(data) == 0:
+                break
+            data += file.readline()
+            path = os.path.join(directory, f"{base}.chunk{len(chunks)}")
+            if not os.path.exists(path) or os.path.getsize(path) != len(data):
+                with open(path + ".tmp", "wb") as chunk:
+                    chunk.write(data)
+                os.replace(path + ".tmp", path)
+            chunks.append(path)
+    return chunks
+
+class Manifest:
+    """
+    Thread safe record of the progress of a bulk upload, written to a JSON file after every change
+    """
+    def __init__(self, path=None):
+        """
+        :param path: The path of the JSON file, an existing manifest there is resumed (optional, default in memory)
+        """
+        self.path = path
+        self.records = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path) as file:
+                self.records = json.load(file)
+
+    def done(self, key):
+        """
+        :param key: The path of a loaded file
+        :return: True if the file has been loaded
+        """
+        with self._lock:
+            return self.records.get(key, {}).get("status") == "done"
+
+    def record(self, key, **record):
+        """
+        Record the progress of a file, replacing its previous record
+        :param key: The path of the file
+        :param record: The fields to be recorded, for example status, rows and seconds
+        """
+        with self._lock:
+            self.records[key] = record
+            if self.path is not None:
+                with open(self.path + ".tmp", "w") as file:
+                    json.dump(self.records, file, indent=1)
+                os.replace(self.path + ".tmp", self.path)
+
+def bulk_upload(filenames, table, manifest=None, workers=4, chunk_bytes=None, chunk_dir=None, defer_indexes=False):
+    """
+    Upload many files to a table concurrently over several connections, resuming an interrupted upload
+    Every file, or chunk of a file, is loaded and committed with upload_file on a connection of its own and its
+    progress recorded in the manifest, so files recorded as done are skipped when the upload is run again
+    :param filenames: The paths of the files to be uploaded, for example the pc-{year}-part{n}.csv files
+    :param table: The table to be uploaded to
+    :param manifest: The path of the JSON manifest recording progress (optional, default progress is not kept)
+    :param workers: The number of files loaded at once, the connection pool should be at least this size (optional)
+    :param chunk_bytes: When given, files larger than this are split into chunks of about this many bytes (optional)
+    :param chunk_dir: The directory chunks are written to (optional, default next to each file)
+    :param defer_indexes: When True, disable the non-unique keys of the table during the upload and rebuild them
+    once at the end, and skip unique and foreign key checks while loading (optional)
+    :return: dict of path to its manifest record (status, rows, seconds, rows_per_second or error)
+    """
+    manifest = Manifest(manifest)
+    paths = []
+    for filename in filenames:
+        if chunk_bytes is not None and os.path.getsize(filename) > chunk_bytes:
+            paths.extend(split_file(filename, chunk_bytes, chunk_dir))
+        else:
+            paths.append(filename)
+    pending = [path for path in paths if not manifest.done(path)]
+    print(f"Uploading {len(pending)} files to {table}, {len(paths) - len(pending)} already done")
+
+    def load(path):
+        t0 = time.perf_counter()
+        try:
+            with connection() as conn:
+                cur = conn.cursor()
+                if defer_indexes:
+                    cur.execute("SET unique_checks=0, foreign_key_checks=0")
+                try:
+                    rows = upload_file(path, table, conn=conn)
+                finally:
+                    if defer_indexes:
+                        cur.execute("SET unique_checks=1, foreign_key_checks=1")
+        except Exception as e:
+            manifest.record(path, status="failed", error=str(e))
+            print(f"Failed to upload {path}: {e}")
+            return
+        elapsed = time.perf_counter() - t0
+        manifest.record(path, status="done", rows=rows, seconds=elapsed, rows_per_second=rows / elapsed if elapsed else None)
+        print(f"Uploaded {path}: {rows} rows in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)")
+
+    if defer_indexes:
+        with connection() as conn:
+            conn.cursor().execute(f"ALTER TABLE {table} DISABLE KEYS")
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(load, pending))
+    finally:
+        if defer_indexes:
+            with connection() as conn:
+                conn.cursor().execute(f"ALTER TABLE {table} ENABLE KEYS")
+    return {path: manifest.records.get(path) for path in paths}
+
+def bounding_box(latitude, longitude, width_km, height_km):
+    """
+    Find the bounding box of the specified size around a location
     :param latitude: The latitude central to the bounding box
     :param longitude: The longitude central to the bounding box
     :param width_km: The width of the bounding box in km (approx)
     :param height_km: The height of the bounding box in km (approx)
-    :return: Dataframe object with the number of each amenity in the bounding box
+    :return: tuple of north, south, west and east bounds
     """
     box_width = width_km * (0.02/2.2)
     box_height = height_km * (0.02/2.2)
@@ -110,56 +537,384 @@ def local_features(latitude, longitude, width_km, height_km):
     south = latitude - (box_height/2)
     west = longitude - (box_width/2)
     east = longitude + (box_width/2)
+    return north, south, west, east
+
+_feature_store = None
+_feature_store_lock = threading.Lock()
 
-    tags = {
-        "amenity": True,
-        "buildings": ["religous"],
-        "leisure": True,
-        "shop": True,
-        "highway": ["roads"],
-        "railway": ["stations and stops"],
-        "sport": True
-        }
+def get_feature_store():
+    """
+    Get the local OpenStreetMap feature store of the extract at the "osm_file" config key, loading it on first use
+    :return: osm.FeatureStore object, or None if no extract is configured
+    """
+    global _feature_store
+    if config.get("osm_file") is None:
+        return None
+    with _feature_store_lock:
+        if _feature_store is None:
+            from .osm import FeatureStore
+            _feature_store = FeatureStore.from_file(config["osm_file"])
+        return _feature_store
 
-    pois = ox.geometries_from_bbox(north, south, east, west, tags)
+def local_features(latitude, longitude, width_km, height_km, store = None):
+    """
+    Finds the features within the specified bounding box, returns dataframe with the number of each amenity
+    The features are read from a local feature store when one is given or configured, otherwise from Overpass
+    :param latitude: The latitude central to the bounding box
+    :param longitude: The longitude central to the bounding box
+    :param width_km: The width of the bounding box in km (approx)
+    :param height_km: The height of the bounding box in km (approx)
+    :param store: osm.FeatureStore to read the features from (optional, default get_feature_store())
+    :return: Dataframe object with the number of each amenity in the bounding box
+    """
+    north, south, west, east = bounding_box(latitude, longitude, width_km, height_km)
+    store = store if store is not None else get_feature_store()
+    if store is not None:
+        pois = store.features(north, south, west, east)
+    else:
+        import osmnx as ox
+        from .osm import TAGS
+        pois = ox.geometries_from_bbox(north, south, east, west, TAGS)
 
-    return pois.groupby("amenity").apply(len).reset_index().set_index("amenity").rename(columns={0:"Count"})
+    if "amenity" not in pois:
+        return pd.DataFrame({"Count": []}, index=pd.Index([], name="amenity"), dtype=np.int64)
+    return pois["amenity"].value_counts().sort_index().rename_axis("amenity").to_frame("Count")
 
-def count_local_features(latitude, longitude, width_km, height_km):
+def count_local_features(latitude, longitude, width_km, height_km, store = None):
     """
     Finds the number of features within the specified bounding box
+    The features are read from a local feature store when one is given or configured, otherwise from Overpass
     :param latitude: The latitude central to the bounding box
     :param longitude: The longitude central to the bounding box
     :param width_km: The width of the bounding box in km (approx)
     :param height_km: The height of the bounding box in km (approx)
+    :param store: osm.FeatureStore to read the features from (optional, default get_feature_store())
     :return: Number of features within the bounding box
     """
-    box_width = width_km * (0.02/2.2)
-    box_height = height_km * (0.02/2.2)
+    north, south, west, east = bounding_box(latitude, longitude, width_km, height_km)
+    store = store if store is not None else get_feature_store()
+    if store is not None:
+        return len(store.select(north, south, west, east))
+    import osmnx as ox
+    from .osm import TAGS
+    pois = ox.geometries_from_bbox(north, south, east, west, TAGS)
 
-    north = latitude + (box_height/2)
-    south = latitude - (box_height/2)
-    west = longitude - (box_width/2)
-    east = longitude + (box_width/2)
+    return len(pois)
 
-    tags = {
-        "amenity": True,
-        "buildings": ["religous"],
-        "leisure": True,
-        "shop": True,
-        "highway": ["roads"],
-        "railway": ["stations and stops"],
-        "sport": True
-        }
+def _require_store(store):
+    store = store if store is not None else get_feature_store()
+    if store is None:
+        raise NotImplementedError("Specify an OpenStreetMap extract at the access.config 'osm_file' key, or pass a feature store")
+    return store
 
-    pois = ox.geometries_from_bbox(north, south, east, west, tags)
+def _neighbours(store, latitudes, longitudes, radius_km=None, width_km=None, height_km=None, workers=1):
+    """
+    Find the features of a store near each location with a single KD-tree query
+    :return: tuple of the location of each match, the feature position of each match and the number of matches per location
+    """
+    from scipy.spatial import cKDTree
+    lats = np.asarray(latitudes, dtype=np.float64)
+    lons = np.asarray(longitudes, dtype=np.float64)
+    if radius_km is not None:
+        # Equirectangular projection to km around the mean latitude of the features
+        kx = 111.320 * np.cos(np.radians(store.latitudes.mean() if len(store) else lats.mean()))
+        ky = 110.574
+        features = np.column_stack((store.longitudes * kx, store.latitudes * ky))
+        points = np.column_stack((lons * kx, lats * ky))
+        r, p = radius_km, 2
+    elif width_km is not None and height_km is not None:
+        # Scaled so that the bounding box of bounding_box is the unit ball of the max norm
+        half_width, half_height = width_km * (0.02/2.2) / 2, height_km * (0.02/2.2) / 2
+        features = np.column_stack((store.longitudes / half_width, store.latitudes / half_height))
+        points = np.column_stack((lons / half_width, lats / half_height))
+        r, p = 1, np.inf
+    else:
+        raise ValueError("Specify either radius_km or both width_km and height_km")
+    if len(store) == 0 or len(points) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.zeros(len(points), dtype=np.int64)
+    matches = cKDTree(features).query_ball_point(points, r, p=p, return_sorted=False, workers=workers)
+    lengths = np.fromiter((len(m) for m in matches), dtype=np.int64, count=len(matches))
+    positions = np.fromiter(itertools.chain.from_iterable(matches), dtype=np.int64, count=lengths.sum())
+    return np.repeat(np.arange(len(matches)), lengths), positions, lengths
 
-    return len(pois)
+def feature_matrix(latitudes, longitudes, radius_km=None, width_km=None, height_km=None, keys=("amenity", "shop", "leisure"), store=None, workers=1):
+    """
+    Count the features of each category near each of many locations, in one pass over the feature store
+    Features are counted within radius_km of each location, or within the bounding box of width_km by height_km
+    around it (see bounding_box)
+    :param latitudes: Sequence of the latitudes of the locations
+    :param longitudes: Sequence of the longitudes of the locations
+    :param radius_km: The radius in km around each location (optional)
+    :param width_km: The width of the bounding boxes in km (approx) (optional)
+    :param height_km: The height of the bounding boxes in km (approx) (optional)
+    :param keys: The tag keys whose values are counted (optional)
+    :param store: osm.FeatureStore to read the features from (optional, default get_feature_store())
+    :param workers: The number of threads of the KD-tree query, -1 for every core (optional)
+    :return: Dataframe with one row per location and one "key:value" column per category of the counts
+    """
+    store = _require_store(store)
+    rows, positions, _ = _neighbours(store, latitudes, longitudes, radius_km, width_km, height_km, workers)
+    n = len(latitudes)
+    blocks, columns = [], []
+    for key in keys:
+        codes, categories = store.codes(key)
+        found = codes[positions]
+        selected = found >= 0
+        counts = np.bincount(rows[selected] * len(categories) + found[selected], minlength=n * len(categories))
+        blocks.append(counts.reshape(n, len(categories)))
+        columns.extend(f"{key}:{category}" for category in categories)
+    return pd.DataFrame(np.concatenate(blocks, axis=1) if blocks else np.zeros((n, 0), dtype=np.int64), columns=columns)
+
+def local_features_batch(latitudes, longitudes, width_km, height_km, store = None):
+    """
+    Finds the number of each amenity within the bounding box around each of many locations, from a local feature store
+    :param latitudes: Sequence of the latitudes central to the bounding boxes
+    :param longitudes: Sequence of the longitudes central to the bounding boxes
+    :param width_km: The width of the bounding boxes in km (approx)
+    :param height_km: The height of the bounding boxes in km (approx)
+    :param store: osm.FeatureStore to read the features from (optional, default get_feature_store())
+    :return: Dataframe with one row per location and one column per amenity of the counts
+    """
+    df = feature_matrix(latitudes, longitudes, width_km=width_km, height_km=height_km, keys=("amenity",), store=store)
+    df.columns = pd.Index([column[len("amenity:"):] for column in df.columns], name="amenity")
+    return df
+
+def count_local_features_batch(latitudes, longitudes, width_km, height_km, store = None):
+    """
+    Finds the number of features within the bounding box around each of many locations, from a local feature store
+    :param latitudes: Sequence of the latitudes central to the bounding boxes
+    :param longitudes: Sequence of the longitudes central to the bounding boxes
+    :param width_km: The width of the bounding boxes in km (approx)
+    :param height_km: The height of the bounding boxes in km (approx)
+    :param store: osm.FeatureStore to read the features from (optional, default get_feature_store())
+    :return: int64 numpy array of the number of features around each location
+    """
+    return _neighbours(_require_store(store), latitudes, longitudes, width_km=width_km, height_km=height_km)[2]
+
+class RowsCache:
+    """
+    Bounded least recently used cache of the rows of prices_coordinates_data within snapped bounds
+    Entries are evicted when there are more than max_entries of them or they take more than max_bytes between them,
+    when directory is given every entry is also written there as a Parquet file so that it survives restarts
+    Every invalidate bumps a generation counter, and an entry fetched in an earlier generation is not cached
+    """
+    def __init__(self, max_entries=256, max_bytes=512 * 2**20, directory=None):
+        """
+        :param max_entries: The maximum number of entries held in memory (optional)
+        :param max_bytes: The approximate maximum number of bytes held in memory across all entries (optional)
+        :param directory: The directory entries are persisted to (optional, default entries are not persisted)
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._rows = self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.disk_hits = self.misses = self.evictions = self.stale = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + ".parquet")
+
+    @staticmethod
+    def _entry(rows, columns):
+        columns = list(columns)
+        if len(rows) == 0:
+            return (), columns, (np.empty(0), np.empty(0), np.empty(0, dtype=np.int64))
+        lat_i, lon_i, date_i = columns.index("latitude"), columns.index("longitude"), columns.index("date_of_transfer")
+        return tuple(rows), columns, (
+            np.array([r[lat_i] for r in rows], dtype=np.float64),
+            np.array([r[lon_i] for r in rows], dtype=np.float64),
+            np.array([r[date_i].toordinal() for r in rows], dtype=np.int64)
+        )
+
+    @staticmethod
+    def nbytes(entry):
+        """
+        Estimate the memory taken by an entry, from the size of its first row and its arrays
+        Every row holds its own tuple and values, so this counts them all once per row
+        :param entry: tuple of the rows, their column names and their latitude, longitude and date ordinal arrays
+        :return: The approximate number of bytes
+        """
+        rows, _, arrays = entry
+        row_bytes = sys.getsizeof(rows[0]) + sum(sys.getsizeof(v) for v in rows[0]) if len(rows) else 0
+        return sys.getsizeof(rows) + len(rows) * row_bytes + sum(a.nbytes for a in arrays)
+
+    def get(self, key):
+        """
+        Get the entry of a key, from memory or from disk
+        :param key: The snapped bounds
+        :return: tuple of the rows, their column names and their latitude, longitude and date ordinal arrays,
+        or None if the key is not cached
+        """
+        with self._lock:
+            generation = self.generation
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        if self.directory is not None and os.path.exists(self._path(key)):
+            try:
+                df = pd.read_parquet(self._path(key))
+            except FileNotFoundError:
+                # Removed by a concurrent invalidate
+                df = None
+            if df is not None:
+                entry = self._entry(tuple(df.itertuples(index=False, name=None)), df.columns)
+                with self._lock:
+                    self.disk_hits += 1
+                self._insert(key, entry, generation)
+                return entry
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, rows, columns, generation=None):
+        """
+        Cache the rows of a key
+        :param key: The snapped bounds
+        :param rows: tuple tuple of the rows within the snapped bounds
+        :param columns: The column names of the rows
+        :param generation: The generation read before the rows were fetched (optional, default the current one),
+        if the cache has been invalidated since the rows are returned but not cached
+        :return: The entry of the key, see get
+        """
+        entry = self._entry(rows, columns)
+        self._insert(key, entry, generation, persist=self.directory is not None)
+        return entry
+
+    def _insert(self, key, entry, generation=None, persist=False):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                self.stale += 1
+                return
+            if persist:
+                pd.DataFrame.from_records(list(entry[0]), columns=entry[1]).to_parquet(self._path(key))
+            if key in self._entries:
+                self._rows -= len(self._entries.pop(key)[0])
+                self._bytes -= self._sizes.pop(key)
+            self._entries[key] = entry
+            self._sizes[key] = self.nbytes(entry)
+            self._rows += len(entry[0])
+            self._bytes += self._sizes[key]
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                evicted, (rows, _, _) = self._entries.popitem(last=False)
+                self._rows -= len(rows)
+                self._bytes -= self._sizes.pop(evicted)
+                self.evictions += 1
+
+    def invalidate(self):
+        """
+        Remove every entry, from memory and from disk, for example after new data is uploaded
+        Rows fetched before this call and put afterwards are not cached
+        """
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._sizes.clear()
+            self._rows = self._bytes = 0
+            if self.directory is not None:
+                for filename in os.listdir(self.directory):
+                    if filename.endswith(".parquet"):
+                        os.remove(os.path.join(self.directory, filename))
 
-@cache
-def get_rows_in_bounds(north, south, west, east, latest_date, earliest_date, conn = None):
+    def stats(self):
+        """
+        Get the hit and miss statistics of the cache
+        :return: dict of hits, disk hits, misses, evictions, stale puts, hit rate, entries, rows and bytes in memory
+        """
+        with self._lock:
+            requests = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "evictions": self.evictions,
+                "stale": self.stale, "hit_rate": (self.hits + self.disk_hits) / requests if requests else 0.0,
+                "entries": len(self._entries), "rows": self._rows, "bytes": self._bytes
+            }
+
+_rows_cache = None
+_rows_cache_lock = threading.Lock()
+
+def get_rows_cache():
+    """
+    Get the rows cache of the access.config mapping, creating it on first use
+    Its size and persistence are read from the "cache_entries", "cache_bytes" and "cache_dir" config keys
+    :return: RowsCache object
+    """
+    global _rows_cache
+    with _rows_cache_lock:
+        if _rows_cache is None:
+            _rows_cache = RowsCache(config.get("cache_entries", 256), config.get("cache_bytes", 512 * 2**20), config.get("cache_dir"))
+        return _rows_cache
+
+def invalidate_rows_cache():
+    """
+    Remove every entry of the rows cache, called by upload_file when new data is loaded
     """
-    Get rows from the database according to the specified bounds, limit cursor fetch to 50000
+    get_rows_cache().invalidate()
+
+def snap_bounds(north, south, west, east, latest_date, earliest_date):
+    """
+    Grow bounds outwards to a grid, so that nearby bounds share a cache entry
+    The grid is read from the "cache_grid" (degrees) and "cache_days" config keys
+    :return: tuple of the snapped north, south, west, east, latest date and earliest date
+    """
+    grid = config.get("cache_grid", 0.01)
+    days = config.get("cache_days", 30)
+    latest = math.ceil((latest_date.toordinal() + 1) / days) * days
+    earliest = math.floor((earliest_date.toordinal() - 1) / days) * days
+    return (
+        round(math.ceil(north / grid) * grid, 9), round(math.floor(south / grid) * grid, 9),
+        round(math.floor(west / grid) * grid, 9), round(math.ceil(east / grid) * grid, 9),
+        datetime.date.fromordinal(latest), datetime.date.fromordinal(max(earliest, 1))
+    )
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index():
+    """
+    Get the local spatio-temporal index at the "index_dir" config key, loading it on first use
+    An index marked stale by an upload (see invalidate_index) is not used until it is rebuilt
+    :return: index.SpatialIndex object, or None if no index is configured or it is stale
+    """
+    global _index
+    if config.get("index_dir") is None:
+        return None
+    from .index import SpatialIndex, is_stale
+    with _index_lock:
+        if is_stale(config["index_dir"]):
+            _index = None
+            return None
+        if _index is None or _index.directory != config["index_dir"]:
+            _index = SpatialIndex(config["index_dir"])
+        return _index
+
+def invalidate_index():
+    """
+    Mark the local index stale, so that rows are read from the database until the index is rebuilt
+    The mark is kept in the index directory, so it holds for every process using the index
+    """
+    global _index
+    if config.get("index_dir") is None:
+        return
+    from .index import mark_stale
+    with _index_lock:
+        mark_stale(config["index_dir"])
+        _index = None
+
+BOUNDS_LIMIT = 50000 # The most rows get_rows_in_bounds returns
+
+@instrument.timed("access.get_rows_in_bounds")
+def get_rows_in_bounds(north, south, west, east, latest_date, earliest_date, conn = None, cache = True):
+    """
+    Get rows from the database according to the specified bounds, at most BOUNDS_LIMIT of them
+    When a local index is configured (see get_index) the rows are read from it without a query. Otherwise
+    the rows within the bounds snapped outwards to a grid are cached (see RowsCache), and the rows within the
+    bounds themselves are selected from them, so nearby bounds are answered without a query. The snapped bounds
+    are fetched without a limit, so the limit applies to the rows within the bounds as it does without the cache
     :param north: Maximum latitude
     :param south: Minimum latitude
     :param west: Minimum longitude
@@ -167,31 +922,202 @@ def get_rows_in_bounds(north, south, west, east, latest_date, earliest_date, con
     :param latest_date: Maximum date
     :param earliest_date: Minimum date
     :param conn: The connection object (optional)
+    :param cache: When False, query the database directly without the cache (optional)
     :return: tuple tuple of the rows that satisfy the given bounds
     """
+    index = get_index()
+    if index is not None:
+        rows = index.rows(north, south, west, east, latest_date, earliest_date, limit=BOUNDS_LIMIT)
+        instrument.count("index_rows", len(rows))
+        return rows
+    if not cache:
+        with connection(conn) as conn, instrument.span("access.db_round_trip"):
+            cur = conn.cursor()
+            cur.execute(bounds_query(north, south, west, east, latest_date, earliest_date) + f" LIMIT {BOUNDS_LIMIT}")
+            rows = cur.fetchall()
+        instrument.fetched(rows)
+        return rows
+
+    key = snap_bounds(north, south, west, east, latest_date, earliest_date)
+    rows_cache = get_rows_cache()
+    generation = rows_cache.generation
+    entry = rows_cache.get(key)
+    if entry is None:
+        instrument.count("cache_misses")
+        with connection(conn) as conn, instrument.span("access.db_round_trip"):
+            cur = conn.cursor()
+            cur.execute(bounds_query(*key))
+            rows = cur.fetchall()
+            columns = [d[0] for d in cur.description]
+        instrument.fetched(rows)
+        entry = rows_cache.put(key, rows, columns, generation)
+    else:
+        instrument.count("cache_hits")
+    rows, _, (lats, lons, ords) = entry
+    mask = in_bounds(lats, lons, ords, north, south, west, east, latest_date, earliest_date)
+    return tuple(rows[i] for i in np.flatnonzero(mask)[:BOUNDS_LIMIT])
+
+def bounds_query(north, south, west, east, latest_date, earliest_date):
+    """
+    Build the query selecting the rows of prices_coordinates_data within the specified bounds
+    :param north: Maximum latitude
+    :param south: Minimum latitude
+    :param west: Minimum longitude
+    :param east: Maximum longitude
+    :param latest_date: Maximum date
+    :param earliest_date: Minimum date
+    :return: The sql query
+    """
     # Would usually be parameterized to prevent injection
     # but because there are no user input strings here don't need to worry
-    if conn is None:
-        conn = make_conn()
-    cur = conn.cursor()
-    cur.execute(f"""
+    return f"""
                 SELECT * FROM prices_coordinates_data 
                 WHERE {south} < latitude AND latitude < {north}
-                AND {east} < longitude AND longitude > {west}
+                AND {west} < longitude AND longitude < {east}
                 AND CAST('{earliest_date}' as date) < date_of_transfer AND date_of_transfer < CAST('{latest_date}' as date)
-                LIMIT 50000
-                """)
-    return cur.fetchall()
+                """
 
-def get_rows_from_query(query, conn = None):
+def in_bounds(lats, lons, ords, north, south, west, east, latest_date, earliest_date):
     """
-    Get rows from the database according to query, limit cursor fetch to 50000
+    Find the rows strictly within the specified bounds, as bounds_query selects them
+    :param lats: numpy array of the latitudes of the rows
+    :param lons: numpy array of the longitudes of the rows
+    :param ords: numpy array of the date ordinals of the rows
+    :param north: Maximum latitude
+    :param south: Minimum latitude
+    :param west: Minimum longitude
+    :param east: Maximum longitude
+    :param latest_date: Maximum date, a date or its ordinal
+    :param earliest_date: Minimum date, a date or its ordinal
+    :return: Boolean numpy array, True for the rows within the bounds
+    """
+    latest = latest_date if isinstance(latest_date, (int, np.integer)) else latest_date.toordinal()
+    earliest = earliest_date if isinstance(earliest_date, (int, np.integer)) else earliest_date.toordinal()
+    return ((south < lats) & (lats < north) & (west < lons) & (lons < east)
+        & (earliest < ords) & (ords < latest))
+
+QUERY_LIMIT = 50000 # The most rows get_rows_from_query returns
+
+def get_rows_from_query(query, conn = None, description = False):
+    """
+    Get rows from the database according to query, limit cursor fetch to QUERY_LIMIT
+    Warns when the query selects more rows than that, use stream_query to fetch them all
     :param query: The sql query to be executed
     :param conn: The connection object (optional)
-    :return: tuple tuple of the rows fetched from the query
+    :param description: When True, also return the cursor description of the query columns (optional)
+    :return: tuple tuple of the rows fetched from the query, and the cursor description when requested
+    """
+    with connection(conn) as conn:
+        with instrument.span("access.db_round_trip"):
+            cur = conn.cursor()
+            cur.execute(query)
+            rows = cur.fetchmany(QUERY_LIMIT + 1)
+        if len(rows) > QUERY_LIMIT:
+            rows = rows[:QUERY_LIMIT]
+            warnings.warn(f"Query results truncated to their first {QUERY_LIMIT} rows, stream them to fetch them all", stacklevel=2)
+        instrument.fetched(rows)
+        if description:
+            return rows, cur.description
+        return rows
+
+# The MySQL column type codes of pymysql.constants.FIELD_TYPE, by value so that pymysql is only imported on connecting
+DESCRIPTION_DTYPES = {
+    1: "int64", 2: "int64", 3: "int64", 9: "int64", 8: "int64", 13: "int64", # TINY, SHORT, LONG, INT24, LONGLONG, YEAR
+    4: "float64", 5: "float64", 0: "float64", 246: "float64", # FLOAT, DOUBLE, DECIMAL, NEWDECIMAL
+    10: "datetime64[ns]", 14: "datetime64[ns]", 12: "datetime64[ns]", 7: "datetime64[ns]", # DATE, NEWDATE, DATETIME, TIMESTAMP
+}
+
+def description_dtypes(description):
+    """
+    Find the dtype each column of a query result should be converted to from its cursor description
+    :param description: The cursor description of the query columns
+    :return: list of dtype names, None for columns whose dtype should be inferred
+    """
+    return [DESCRIPTION_DTYPES.get(d[1]) for d in description]
+
+def typed_column(values, dtype=None):
+    """
+    Convert the values of a column directly to an array of the given dtype
+    Integer columns with missing values become float64, as they do in pandas
+    :param values: Sequence of the values of the column
+    :param dtype: One of "int64", "float64", "datetime64[ns]", "category", or None to infer the dtype (optional)
+    :return: Array or Series of the column
+    """
+    if dtype == "int64":
+        try:
+            return np.array(values, dtype=np.int64)
+        except (TypeError, ValueError):
+            return np.array(values, dtype=np.float64)
+    if dtype == "float64":
+        return np.array(values, dtype=np.float64)
+    if dtype == "datetime64[ns]":
+        return np.asarray(pd.to_datetime(list(values)), dtype="datetime64[ns]")
+    if dtype == "category":
+        return pd.Categorical(np.array(values, dtype=object))
+    return pd.Series(np.array(values, dtype=object)).infer_objects()
+
+def typed_frame(rows, columns, dtypes = None):
+    """
+    Build a dataframe from rows, converting each column directly to its dtype rather than through an object array
+    :param rows: tuple tuple of the rows
+    :param columns: list of column names
+    :param dtypes: list of the dtype of each column, see typed_column (optional, default infer every dtype)
+    :return: Dataframe of the rows
+    """
+    if len(rows) > 0 and len(columns) != len(rows[0]):
+        raise ValueError(f"Number of columns in the dataframe({len(columns)}) must match number of columns selected in the query({len(rows[0])})")
+    if dtypes is None:
+        dtypes = [None] * len(columns)
+    values = list(zip(*rows)) if len(rows) > 0 else [()] * len(columns)
+    return pd.DataFrame({
+        column: typed_column(v, dtype) for column, v, dtype in zip(columns, values, dtypes)
+    })
+
+def stream_query(query, columns = None, chunk_size = 10000, conn = None, schema = None):
+    """
+    Stream the rows of a query in chunks, using an unbuffered server side cursor so that at most chunk_size rows
+    are held in memory at once and the result is not capped
+    The connection is held until the generator is exhausted or closed
+    :param query: The sql query to be executed
+    :param columns: The column names of the chunks (optional, default the column names of the query)
+    :param chunk_size: The number of rows in each chunk (optional)
+    :param conn: The connection object (optional)
+    :param schema: Mapping of column name to dtype, overriding the dtypes found from the cursor description (optional)
+    :return: generator of typed Dataframes of at most chunk_size rows
+    """
+    import pymysql.cursors
+    with connection(conn) as conn:
+        cur = conn.cursor(pymysql.cursors.SSCursor)
+        try:
+            cur.execute(query)
+            if columns is None:
+                columns = [d[0] for d in cur.description]
+            if len(columns) != len(cur.description):
+                raise ValueError(f"Number of columns in the dataframe({len(columns)}) must match number of columns selected in the query({len(cur.description)})")
+            schema = schema if schema is not None else {}
+            dtypes = [schema.get(c, dtype) for c, dtype in zip(columns, description_dtypes(cur.description))]
+            while True:
+                with instrument.span("access.db_round_trip"):
+                    rows = cur.fetchmany(chunk_size)
+                if len(rows) == 0:
+                    return
+                instrument.fetched(rows)
+                yield typed_frame(rows, columns, dtypes)
+        finally:
+            cur.close()
+
+def stream_rows_in_bounds(north, south, west, east, latest_date, earliest_date, columns = None, chunk_size = 10000, conn = None):
+    """
+    Stream every row from the database within the specified bounds in chunks, see stream_query
+    :param north: Maximum latitude
+    :param south: Minimum latitude
+    :param west: Minimum longitude
+    :param east: Maximum longitude
+    :param latest_date: Maximum date
+    :param earliest_date: Minimum date
+    :param columns: The column names of the chunks (optional)
+    :param chunk_size: The number of rows in each chunk (optional)
+    :param conn: The connection object (optional)
+    :return: generator of Dataframes of at most chunk_size rows
     """
-    if conn is None:
-        conn = make_conn()
-    cur = conn.cursor()
-    cur.execute(query)
-    return cur.fetchmany(50000)
\ No newline at end of file
+    return stream_query(bounds_query(north, south, west, east, latest_date, earliest_date), columns = columns, chunk_size = chunk_size, conn = conn)
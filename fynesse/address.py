@@ -6,11 +6,269 @@ import pandas as pd
 import pygeohash as gh
 import numpy as np
 import datetime
-import statsmodels.api as sm
-from fynesse import access, assess
+import logging
+import time
+import os
+import pickle
+import threading
+from fynesse import access, assess, design, instrument
 from itertools import product
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def predict_price_parameterized(args, latitude, longitude, date, property_type):
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("Postcode", "Price", "Date", "Property Type", "New Build Flag", "Tenure Type",
+    "Locality", "Town/City", "District", "County", "Positional Quality Indicator",
+    "Country", "Latitude", "Longitude", "ID")
+PROPERTY_TYPES = ("F", "S", "D", "T", "O")
+DEFAULT_ARGS = (50, 365, 5)
+SEARCH_SPACE = ((10, 25, 50), (730, 365, 180), (3, 4, 5, 6, 7))
+ID = COLUMNS.index("ID")
+
+def box(latitude, longitude, d):
+    """
+    Find the bounding box used to select training data around a property
+    :param latitude: The latitude central to the bounding box
+    :param longitude: The longitude central to the bounding box
+    :param d: The length in km of the bounding box square
+    :return: tuple of north, south, west and east bounds
+    """
+    d = d * (0.02/2.2)
+    box_width = d * (0.02/2.2)
+    box_height = d * (0.02/2.2)
+    north = latitude + (box_height/2)
+    south = latitude - (box_height/2)
+    west = longitude - (box_width/2)
+    east = longitude + (box_width/2)
+    return north, south, west, east
+
+def window(date, t):
+    """
+    Find the date range used to select training data around a sale
+    :param date: The date central to the range (datetime object)
+    :param t: The amount of days around the date to bound the search by
+    :return: tuple of latest and earliest date
+    """
+    return date + datetime.timedelta(days=t), date + datetime.timedelta(days=-t)
+
+def design_matrix(df, encodings):
+    """
+    Build the design matrix of date, property type and geohash for a dataframe of sales
+    :param df: Dataframe with columns "Date", "Property Type" and "Geohash"
+    :param encodings: The geohashes that make up the geohash one-hot block
+    :return: numpy array design matrix
+    """
+    return design.design_matrix(df["Date"], df["Property Type"], df["Geohash"], encodings, PROPERTY_TYPES)
+
+def rsquared(rss, tss, n, k):
+    """
+    The r squared of a fitted model, -inf where it is undefined, as statsmodels gives for a constant price
+    :param rss: The residual sum of squares, clamped at zero against floating point cancellation
+    :param tss: The total sum of squares
+    :param n: The number of sales the model was fitted on
+    :param k: The number of columns of the design matrix
+    :return: The r squared, -inf when tss is not positive or there are no more sales than columns
+    """
+    if tss <= 0 or n <= k:
+        return -float('inf')
+    return 1 - max(rss, 0.0) / tss
+
+class RidgeResults:
+    """
+    A fitted ridge regression, with the same predict interface as statsmodels results
+    """
+    def __init__(self, params, rsquared, nobs):
+        self.params = params
+        self.rsquared = rsquared
+        self.nobs = nobs
+
+    def predict(self, exog):
+        """
+        Predict prices from a design matrix
+        :param exog: The design matrix of the sales to be predicted
+        :return: numpy array of predicted prices
+        """
+        return np.asarray(exog, dtype=np.float64) @ self.params
+
+class RidgeStatistics:
+    """
+    Sufficient statistics (X^T X, X^T y) of the ridge regression of price on date, property type and geohash
+    Sales can be added and removed, so that the statistics of one neighbourhood can be reused for a nearby one,
+    the geohash block grows as sales with new geohashes are added
+    """
+    def __init__(self):
+        self.encodings = []
+        self._index = {}
+        self.xtx = np.zeros((1 + len(PROPERTY_TYPES), 1 + len(PROPERTY_TYPES)))
+        self.xty = np.zeros(1 + len(PROPERTY_TYPES))
+        self.yty = 0.0
+        self.y_sum = 0.0
+        self.n = 0
+
+    def _grow(self, geohashes):
+        new = [g for g in pd.unique(np.asarray(geohashes)) if g not in self._index]
+        if len(new) == 0:
+            return
+        for g in new:
+            self._index[g] = len(self.encodings)
+            self.encodings.append(g)
+        k = len(self.xty) + len(new)
+        xtx = np.zeros((k, k))
+        xtx[:len(self.xty), :len(self.xty)] = self.xtx
+        self.xtx = xtx
+        self.xty = np.concatenate((self.xty, np.zeros(len(new))))
+
+    def _update(self, df, sign):
+        X = design_matrix(df, self.encodings)
+        y = np.asarray(df["Price"], dtype=np.float64)
+        self.xtx += sign * (X.T @ X)
+        self.xty += sign * (X.T @ y)
+        self.yty += sign * (y @ y)
+        self.y_sum += sign * y.sum()
+        self.n += sign * len(y)
+
+    def add(self, df):
+        """
+        Add sales to the statistics
+        :param df: Dataframe of sales with columns "Price", "Date", "Property Type" and "Geohash"
+        """
+        self._grow(df["Geohash"])
+        self._update(df, 1)
+
+    def remove(self, df):
+        """
+        Remove sales that were previously added from the statistics
+        :param df: Dataframe of sales with columns "Price", "Date", "Property Type" and "Geohash"
+        """
+        if not set(pd.unique(np.asarray(df["Geohash"]))) <= self._index.keys():
+            raise ValueError("Only sales that were added to the statistics can be removed")
+        self._update(df, -1)
+
+    def fit(self, alpha=0.1):
+        """
+        Solve the normal equations (X^T X + alpha n I) b = X^T y, the same problem statsmodels solves with
+        fit_regularized(alpha=alpha, L1_wt=0)
+        :param alpha: The ridge penalty (optional)
+        :return: RidgeResults of the fitted model
+        """
+        if self.n <= 0:
+            raise ValueError("Insufficient data to form model: 0 datapoints in statistics")
+        a = self.xtx + alpha * self.n * np.eye(len(self.xty))
+        try:
+            params = np.linalg.solve(a, self.xty)
+        except np.linalg.LinAlgError:
+            params = np.linalg.lstsq(a, self.xty, rcond=None)[0]
+        rss = self.yty - 2 * (params @ self.xty) + params @ self.xtx @ params
+        tss = self.yty - self.y_sum ** 2 / self.n
+        return RidgeResults(params, rsquared(rss, tss, self.n, len(self.xty)), self.n)
+
+BACKENDS = ("statsmodels", "ridge")
+
+# Work done by the predictions of this process, the seconds spent fetching rows and fitting models, the number of
+# fetches and fits, the fetches answered by the rows cache, and the queries and fits saved by batch predictions.
+# Reset with reset_counters
+counters = {
+    "db_seconds": 0.0, "fit_seconds": 0.0, "fetches": 0, "fits": 0, "cache_hits": 0, "cache_misses": 0,
+    "queries_saved": 0, "fits_saved": 0
+}
+
+def reset_counters():
+    """
+    Set every counter of address.counters back to zero
+    """
+    for key in counters:
+        counters[key] = type(counters[key])(0)
+
+def rows_in_bounds(north, south, west, east, latest_date, earliest_date, holdout=None):
+    """
+    access.get_rows_in_bounds, counting the time taken and whether the rows cache answered it in address.counters
+    :param holdout: tuple of the first date of a held-out period and the IDs of its sales, for backtests: the
+    latest date is capped before the period, so no sale from it or after it is returned, and the held-out sales
+    are removed (optional)
+    :return: tuple tuple of the rows that satisfy the given bounds
+    """
+    if holdout is not None:
+        latest_date = min(latest_date, holdout[0])
+    rows_cache = access.get_rows_cache()
+    hits, misses = rows_cache.hits + rows_cache.disk_hits, rows_cache.misses
+    t0 = time.perf_counter()
+    try:
+        rows = access.get_rows_in_bounds(north, south, west, east, latest_date, earliest_date)
+        if holdout is not None and holdout[1]:
+            ids = holdout[1]
+            rows = tuple(row for row in rows if row[ID] not in ids)
+        return rows
+    finally:
+        counters["db_seconds"] += time.perf_counter() - t0
+        counters["fetches"] += 1
+        counters["cache_hits"] += rows_cache.hits + rows_cache.disk_hits - hits
+        counters["cache_misses"] += rows_cache.misses - misses
+
+@instrument.timed("address.fit_model")
+def fit_model(df, backend="statsmodels"):
+    """
+    Fit the ridge regression of price on date, property type and geohash
+    :param df: Dataframe of sales with columns "Price", "Date", "Property Type" and "Geohash"
+    :param backend: "statsmodels" to fit with OLS.fit_regularized, or "ridge" to solve the normal equations
+    from sufficient statistics (optional)
+    :return: tuple of model results, r squared, and the geohash encodings used by the model
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend must be one of {BACKENDS}, not {backend}")
+    t0 = time.perf_counter()
+    try:
+        return _fit_model(df, backend)
+    finally:
+        counters["fit_seconds"] += time.perf_counter() - t0
+        counters["fits"] += 1
+
+def _fit_model(df, backend):
+    if backend == "ridge":
+        stats = RidgeStatistics()
+        stats.add(df)
+        m_results = stats.fit(alpha=0.1)
+        return m_results, m_results.rsquared, stats.encodings
+    import statsmodels.api as sm
+    encodings = df["Geohash"].unique()
+    p_array = np.asarray(df["Price"], dtype=np.float64)
+    X = design_matrix(df, encodings)
+    m = sm.OLS(p_array.reshape(-1, 1), X)
+    m_results = m.fit_regularized(alpha=0.1, L1_wt=0)
+    rss = np.sum(np.square(m_results.fittedvalues - p_array))
+    tss = np.sum(np.square(p_array - np.mean(p_array)))
+    return m_results, rsquared(rss, tss, len(p_array), X.shape[1]), encodings
+
+def training_data(north, south, west, east, latest_date, earliest_date, h, holdout=None):
+    """
+    Get the labelled training data within the specified bounds, geohashed at precision h
+    :param north: Maximum latitude
+    :param south: Minimum latitude
+    :param west: Minimum longitude
+    :param east: Maximum longitude
+    :param latest_date: Maximum date
+    :param earliest_date: Minimum date
+    :param h: The precision of the geohash to be used
+    :param holdout: tuple of the first date of a held-out period and the IDs of its sales, kept out of the
+    training data, see rows_in_bounds (optional)
+    :return: Dataframe of the sales within the bounds, or None if there are none
+    """
+    return training_frame(rows_in_bounds(north, south, west, east, latest_date, earliest_date, holdout), h)
+
+def training_frame(rows, h):
+    """
+    Label rows fetched from prices_coordinates_data as training data, geohashed at precision h
+    :param rows: tuple tuple of the rows, as access.get_rows_in_bounds returns them
+    :param h: The precision of the geohash to be used
+    :return: Dataframe of the sales, or None if there are none
+    """
+    if len(rows) == 0:
+        return None
+    df = assess.labelled(rows, COLUMNS)
+    df["Geohash"] = design.geohashes(df["Latitude"], df["Longitude"], h)
+    return df
+
+@instrument.traced("address.predict_price_parameterized")
+def predict_price_parameterized(args, latitude, longitude, date, property_type, backend="statsmodels", holdout=None):
     """
     Price prediction for UK housing with parameters
     This may be used for the prediction of the sale price of an atypical sale, for example a sale far into the future
@@ -21,74 +279,97 @@ def predict_price_parameterized(args, latitude, longitude, date, property_type):
     :param longitude: The longitude of the property
     :param date: The date of the property sale (datetime object)
     :param property_type: The property type enum of the property (F, S, D, T, O)
+    :param backend: The fitting backend to be used, one of BACKENDS (optional)
+    :param holdout: tuple of the first date of a held-out period and the IDs of its sales, kept out of the
+    training data, see rows_in_bounds (optional)
     :return: tuple of predicted price, r squared, and model results
     """
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend must be one of {BACKENDS}, not {backend}")
 
     d, t, h = args
-    d = d * (0.02/2.2)
-    pt = {"days": t}
-    mt = {"days": -t}
 
-    #Finding bounds for latitude and longitude
-    box_width = d * (0.02/2.2)
-    box_height = d * (0.02/2.2)
-    north = latitude + (box_height/2)
-    south = latitude - (box_height/2)
-    west = longitude - (box_width/2)
-    east = longitude + (box_width/2)
+    #Getting data according to bounds
+    north, south, west, east = box(latitude, longitude, d)
+    latest_date, earliest_date = window(date, t)
+    df = training_data(north, south, west, east, latest_date, earliest_date, h, holdout)
+    return predict_from_data(h, df, latitude, longitude, date, property_type, backend=backend)
 
-    #Finding bounds for date
-    latest_date = date + datetime.timedelta(**pt)
-    earliest_date = date + datetime.timedelta(**mt)
+def predict_from_data(h, df, latitude, longitude, date, property_type, backend="statsmodels"):
+    """
+    Price prediction for UK housing from training data that has already been fetched
+    :param h: The precision of the geohash to be used
+    :param df: Dataframe of the training sales geohashed at precision h, or None if there are none
+    :param latitude: The latitude of the property
+    :param longitude: The longitude of the property
+    :param date: The date of the property sale (datetime object)
+    :param property_type: The property type enum of the property (F, S, D, T, O)
+    :param backend: The fitting backend to be used, one of BACKENDS (optional)
+    :return: tuple of predicted price, r squared, and model results
+    """
+    if df is None or len(df) == 0:
+        return np.nan, -float('inf'), "Insufficient data to form model: 0 datapoints in bounding area"
 
-    #Getting data according to bounds
-    rows = access.get_rows_in_bounds(north, south, west, east, latest_date, earliest_date)
-    if len(rows) == 0:
-        return np.nan, -float('inf'), f"Insufficient data to form model: {len(rows)} datapoints in bounding area"
-    df = assess.labelled(rows, ("Postcode", "Price", "Date", "Property Type", "New Build Flag", "Tenure Type", 
-        "Locality", "Town/City", "District", "County", "Positional Quality Indicator",
-        "Country", "Latitude", "Longitude", "ID"))
-    df["Geohash"] = df.apply(lambda x: gh.encode(x["Latitude"], x["Longitude"], precision=h), axis=1)
-
-    property_type_oh = np.array([np.array([
-        1 if p == "F" else 0,
-        1 if p == "S" else 0,
-        1 if p == "D" else 0,
-        1 if p == "T" else 0,
-        1 if p == "O" else 0
-        ]) for p in df["Property Type"]])
-    geohash_oh = np.array([np.array([
-        1 if g == encoding else 0 for encoding in df["Geohash"].unique()
-    ]) for g in df["Geohash"]])
-    np_ord = np.vectorize(lambda x: x.toordinal())
-
-    design = np.concatenate((np_ord(df["Date"]).reshape(-1, 1), property_type_oh, geohash_oh), axis=1)
-
-    m = sm.OLS(np.array(df["Price"]).reshape(-1, 1), design)
     try:
-        m_results = m.fit_regularized(alpha=0.1, L1_wt=0)
+        m_results, r2, encodings = fit_model(df, backend=backend)
     except:
         return np.nan, np.nan, "SVD could not fit the model on given data" 
-    property_oh_pred = np.array([np.array([
-        1 if property_type == "F" else 0,
-        1 if property_type == "S" else 0,
-        1 if property_type == "D" else 0,
-        1 if property_type == "T" else 0,
-        1 if property_type == "O" else 0
-    ])])
-    geohash = gh.encode(latitude, longitude, precision=h)
-    geohash_oh = np.array([np.array([
-        1 if geohash == encoding else 0 for encoding in df["Geohash"].unique()
-    ])])
-    design_pred = np.concatenate(
-        (np.array([date.toordinal()]).reshape(-1, 1), property_oh_pred, geohash_oh), axis=1
-    )
-    p_array = np.array(df["Price"])
-    rss = np.sum(np.square(m_results.fittedvalues - p_array))
-    tss = np.sum(np.square(p_array - np.mean(p_array)))
-    return m_results.predict(design_pred)[0], (1-(rss/tss)), m_results
+    target = pd.DataFrame({
+        "Date": [date], "Property Type": [property_type], "Geohash": [design.geohash(latitude, longitude, h)]
+    })
+    return m_results.predict(design_matrix(target, encodings))[0], r2, m_results
 
-def predict_price(latitude, longitude, date, property_type, optimize=False):
+@instrument.traced("address.predict_price_search")
+def predict_price_search(latitude, longitude, date, property_type, search_space=SEARCH_SPACE, backend="statsmodels", executor=None,
+        holdout=None):
+    """
+    Price prediction for UK housing with the combination of parameters that provides the model with the highest r squared
+    The data for the widest bounds is fetched with one query, the data for every other combination of parameters is
+    a subset of it selected in memory, and geohashes are computed once at the highest precision and truncated
+    :param latitude: Latitude of the property
+    :param longitude: Longitude of the property
+    :param date: The date of the property sale (datetime object)
+    :param property_type: The property type enum of the property (F, S, D, T, O)
+    :param search_space: tuple of the box lengths, day ranges and geohash precisions to be searched (optional)
+    :param backend: The fitting backend to be used, one of BACKENDS (optional)
+    :param executor: concurrent.futures Executor used to fit the combinations in parallel, for example a
+    ProcessPoolExecutor (optional, default fit sequentially)
+    :param holdout: tuple of the first date of a held-out period and the IDs of its sales, kept out of the
+    training data, see rows_in_bounds (optional)
+    :return: tuple of predicted price, r squared, and model results
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend must be one of {BACKENDS}, not {backend}")
+    ds, ts, hs = search_space
+    north, south, west, east = box(latitude, longitude, max(ds))
+    latest_date, earliest_date = window(date, max(ts))
+    rows = rows_in_bounds(north, south, west, east, latest_date, earliest_date, holdout)
+    if len(rows) == 0:
+        return np.nan, -float('inf'), "Insufficient data to form model: 0 datapoints in bounding area"
+    df = assess.labelled(rows, COLUMNS)
+    lats = np.asarray(df["Latitude"], dtype=np.float64)
+    lons = np.asarray(df["Longitude"], dtype=np.float64)
+    ords = design.ordinals(df["Date"])
+    geohashes = design.geohashes(lats, lons, max(hs))
+
+    tasks = []
+    for d, t, h in product(ds, ts, hs):
+        north, south, west, east = box(latitude, longitude, d)
+        latest_date, earliest_date = window(date, t)
+        mask = access.in_bounds(lats, lons, ords, north, south, west, east, latest_date, earliest_date)
+        train = df[mask].copy()
+        train["Geohash"] = geohashes[mask].astype(f"U{h}")
+        tasks.append((h, train, latitude, longitude, date, property_type, backend))
+
+    if executor is None:
+        results = [predict_from_data(*task) for task in tasks]
+    else:
+        results = [f.result() for f in [executor.submit(predict_from_data, *task) for task in tasks]]
+    return max(results, key = lambda x: -float('inf') if isinstance(x[2], str) else x[1])
+
+@instrument.traced("address.predict_price")
+def predict_price(latitude, longitude, date, property_type, optimize=False, backend="statsmodels", executor=None,
+        holdout=None):
     """
     Price prediction for UK housing.
     :param latitude: Latitude of the property
@@ -96,93 +377,617 @@ def predict_price(latitude, longitude, date, property_type, optimize=False):
     :param date: The date of the property sale (datetime object)
     :param property_type: The property type enum of the property (F, S, D, T, O)
     :param optimize: When true, find the combination of parameters that provide the model with the highest r squared (optional)
+    :param backend: The fitting backend to be used, one of BACKENDS (optional)
+    :param executor: concurrent.futures Executor used to fit the combinations in parallel when optimizing (optional)
+    :param holdout: tuple of the first date of a held-out period and the IDs of its sales, kept out of the
+    training data, see rows_in_bounds (optional)
     :return: tuple of predicted price, r squared, and model results
     """
     
     if optimize:
-        return max(
-        (predict_price_parameterized(a, latitude, longitude, date, property_type) for a in product((10, 25, 50), (730, 365, 180), (3, 4, 5, 6, 7))), 
-        key = lambda x: -float('inf') if isinstance(x[2], str) else x[1]
-               )
+        return predict_price_search(latitude, longitude, date, property_type, backend=backend, executor=executor,
+            holdout=holdout)
     else:
-        d, t, h = (50, 365, 5)
-    d = d * (0.02/2.2)
-    pt = {"days": t}
-    mt = {"days": -t}
+        d, t, h = DEFAULT_ARGS
 
-    #Finding bounds for latitude and longitude
-    box_width = d * (0.02/2.2)
-    box_height = d * (0.02/2.2)
+    north, south, west, east = box(latitude, longitude, d)
+    latest_date, earliest_date = window(date, t)
+    df = training_data(north, south, west, east, latest_date, earliest_date, h, holdout)
+    if df is None:
+        return np.nan, -float('inf'), "Insufficient data to form model: 0 datapoints in bounding area"
 
-    north = latitude + (box_height/2)
-    south = latitude - (box_height/2)
-    west = longitude - (box_width/2)
-    east = longitude + (box_width/2)
+    m_results, r2, encodings = fit_model(df, backend=backend)
+    target = pd.DataFrame({
+        "Date": [date], "Property Type": [property_type], "Geohash": [design.geohash(latitude, longitude, h)]
+    })
+    return m_results.predict(design_matrix(target, encodings))[0], r2, m_results
 
-    #Finding bounds for date
-    latest_date = date + datetime.timedelta(**pt)
-    earliest_date = date + datetime.timedelta(**mt)
+def cell_bounds(cell, w, args, window_days):
+    """
+    Find the bounds of the training data of a cell, the union of the bounds of a prediction at every point of the
+    cell and every day of the window
+    :param cell: The geohash of the cell
+    :param w: The index of the date window, the ordinal of its first day divided by window_days
+    :param args: tuple of the length in km of the bounding box square, the amount of days around the date to bound
+    the search by, and the precision of the geohash to be used
+    :param window_days: The length in days of the date windows
+    :return: tuple of north, south, west, east, latest date and earliest date
+    """
+    d, t, _ = args
+    c_lat, c_lon, lat_err, lon_err = gh.decode_exactly(cell)
+    north, south, west, east = box(c_lat, c_lon, d)
+    latest_date, _ = window(datetime.date.fromordinal(int((w + 1) * window_days - 1)), t)
+    _, earliest_date = window(datetime.date.fromordinal(int(max(w * window_days, 1))), t)
+    return north + lat_err, south - lat_err, west - lon_err, east + lon_err, latest_date, earliest_date
 
-    rows = access.get_rows_in_bounds(north, south, west, east, latest_date, earliest_date)
-    if len(rows) == 0:
-        return np.nan, -float('inf'), f"Insufficient data to form model: {len(rows)} datapoints in bounding area"
-    df = assess.labelled(rows, ("Postcode", "Price", "Date", "Property Type", "New Build Flag", "Tenure Type", 
-        "Locality", "Town/City", "District", "County", "Positional Quality Indicator",
-        "Country", "Latitude", "Longitude", "ID"))
-    df["Geohash"] = df.apply(lambda x: gh.encode(x["Latitude"], x["Longitude"], precision=h), axis=1)
-
-    property_type_oh = np.array([np.array([
-        1 if p == "F" else 0,
-        1 if p == "S" else 0,
-        1 if p == "D" else 0,
-        1 if p == "T" else 0,
-        1 if p == "O" else 0
-        ]) for p in df["Property Type"]])
-    geohash_oh = np.array([np.array([
-        1 if g == encoding else 0 for encoding in df["Geohash"].unique()
-    ]) for g in df["Geohash"]])
-    np_ord = np.vectorize(lambda x: x.toordinal())
-
-    design = np.concatenate((np_ord(df["Date"]).reshape(-1, 1), property_type_oh, geohash_oh), axis=1)
-
-    m = sm.OLS(np.array(df["Price"]).reshape(-1, 1), design)
-    m_results = m.fit_regularized(alpha=0.1, L1_wt=0)
-    property_oh_pred = np.array([np.array([
-        1 if property_type == "F" else 0,
-        1 if property_type == "S" else 0,
-        1 if property_type == "D" else 0,
-        1 if property_type == "T" else 0,
-        1 if property_type == "O" else 0
-    ])])
-    geohash = gh.encode(latitude, longitude, precision=h)
-    geohash_oh = np.array([np.array([
-        1 if geohash == encoding else 0 for encoding in df["Geohash"].unique()
-    ])])
-    design_pred = np.concatenate(
-        (np.array([date.toordinal()]).reshape(-1, 1), property_oh_pred, geohash_oh), axis=1
-    )
-    p_array = np.array(df["Price"])
-    rss = np.sum(np.square(m_results.fittedvalues - p_array))
-    tss = np.sum(np.square(p_array - np.mean(p_array)))
-    return m_results.predict(design_pred)[0], (1-(rss/tss)), m_results
+@instrument.traced("address.price_predictions_batch")
+def price_predictions_batch(df, args=None, cell_precision=6, window_days=30, backend="statsmodels", holdout=None):
+    """
+    Returns list of price predictions, and r squared values for a dataframe of property sales, sharing one query
+    and one model between neighbouring sales
+    Sales are grouped into cells by the geohash of their coordinates and by a window of days around their date,
+    each cell is modelled on the data within the union of the bounds of its sales, so that one query and one fit
+    serve every sale in the cell
+    :param df: The dataframe containing the property sale data ("Longitude", "Latitude", "Date", "Property Type")
+    :param args: The parameters to be used for price predictions (optional)
+    :param cell_precision: The precision of the geohash used to group sales into cells (optional)
+    :param window_days: The length in days of the date windows used to group sales into cells (optional)
+    :param backend: The fitting backend to be used, one of BACKENDS (optional)
+    :param holdout: tuple of the first date of a held-out period and the IDs of its sales, kept out of the
+    training data, see rows_in_bounds (optional)
+    :return: tuple of list of price predictions and list of r squared values, in the order of df, the queries and
+    fits saved are added to address.counters
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend must be one of {BACKENDS}, not {backend}")
+    d, t, h = args if args is not None else DEFAULT_ARGS
+    n = len(df)
+    cells = pd.DataFrame({
+        "Cell": design.geohashes(df["Latitude"], df["Longitude"], cell_precision),
+        "Window": design.ordinals(df["Date"]) // window_days
+    }).groupby(["Cell", "Window"]).indices
+
+    price_preds = np.full(n, np.nan)
+    rs = np.full(n, -float('inf'))
+    queries = fits = 0
+    for (cell, w), idx in cells.items():
+        queries += 1
+        train = training_data(*cell_bounds(cell, w, (d, t, h), window_days), h, holdout)
+        if train is None:
+            continue
+        fits += 1
+        try:
+            m_results, r2, encodings = fit_model(train, backend=backend)
+        except:
+            rs[idx] = np.nan
+            continue
+        target = df.iloc[idx]
+        target = pd.DataFrame({
+            "Date": target["Date"].values,
+            "Property Type": target["Property Type"].values,
+            "Geohash": design.geohashes(target["Latitude"], target["Longitude"], h)
+        })
+        price_preds[idx] = np.asarray(m_results.predict(design_matrix(target, encodings))).ravel()
+        rs[idx] = r2
+    counters["queries_saved"] += n - queries
+    counters["fits_saved"] += n - fits
+    logger.info(f"Batch predictions: {n} sales served by {queries} queries and {fits} fits "
+        f"({n - queries} queries and {n - fits} fits saved)")
+    return list(price_preds), list(rs)
 
-def price_predictions(df, args=None, optimize=False):
+def predict_rows(args, optimize, backend, rows, holdout=None):
+    """
+    Price predictions for a chunk of the sales of price_predictions, run in a worker when predicting in parallel
+    Failures are returned rather than raised, so one sale cannot abort the predictions of the others
+    :param rows: list of tuples of latitude, longitude, date and property type
+    :param holdout: tuple of the first date of a held-out period and the IDs of its sales, kept out of the
+    training data, see rows_in_bounds (optional)
+    :return: tuple of list of tuples of predicted price, r squared and an error message or None, and dict of the
+    change in the counters of the worker (see address.counters)
+    """
+    before = dict(counters)
+    results = []
+    for latitude, longitude, date, property_type in rows:
+        try:
+            if args is not None:
+                p, r, _ = predict_price_parameterized(args, latitude, longitude, date, property_type, backend=backend,
+                    holdout=holdout)
+            else:
+                p, r, _ = predict_price(latitude, longitude, date, property_type, optimize=optimize, backend=backend,
+                    holdout=holdout)
+            error = None
+        except Exception as e:
+            p, r, error = np.nan, np.nan, f"{type(e).__name__}: {e}"
+        results.append((p, r, error))
+    return results, {key: counters[key] - before[key] for key in counters}
+
+def price_predictions(df, args=None, optimize=False, batch=False, backend="statsmodels", workers=None, executor=None, progress=False,
+        chunksize=None, holdout=None):
     """
     Returns list of price predictions, and r squared values for a dataframe of property sales
     :param df: The dataframe containing the property sale data ("Longitude", "Latitude", "Date", "Property Type")
     :param args: The parameters to be used for price predictions (optional)
     :param optimize: When True, find the combination of parameters that provide the model with the highest r squared (optional)
+    :param batch: When True, share one query and one model between neighbouring sales, see price_predictions_batch (optional)
+    :param backend: The fitting backend to be used, one of BACKENDS (optional)
+    :param workers: The number of processes the sales are spread across, each holding its own connection pool
+    (optional, default predict sequentially)
+    :param executor: concurrent.futures Executor the sales are spread across, instead of a pool of worker processes (optional)
+    :param progress: When True, print the number of sales predicted as the predictions complete (optional)
+    :param chunksize: The number of sales submitted to the executor per task (optional, default spread the sales
+    over four tasks per worker)
+    :param holdout: tuple of the first date of a held-out period and the IDs of its sales, kept out of the
+    training data, see rows_in_bounds (optional)
     :return: List of price predictions
     """
     if not ("Latitude" in df and "Longitude" in df and "Date" in df and "Property Type" in df):
         raise ValueError(f"df must contain columns 'Latitude', 'Longitude', 'Date', and 'Property Type', {df.columns} is not sufficient")
-    price_preds = []
-    rs = []
-    for latitude, longitude, date, pt in zip(df["Latitude"], df["Longitude"], df["Date"], df["Property Type"]):
-        if args is not None:
-            p, r, _ = predict_price_parameterized(args, latitude, longitude, date, pt)
-        else:
-            p, r, _ = predict_price(latitude, longitude, date, pt, optimize=optimize)
-        price_preds.append(p)
-        rs.append(r)
-    return price_preds, rs
\ No newline at end of file
+    if batch:
+        if optimize:
+            raise ValueError("Batch predictions share one model per cell, they cannot be optimized per sale")
+        if workers is not None or executor is not None:
+            raise ValueError("Batch predictions run in this process, they cannot be spread across workers")
+        return price_predictions_batch(df, args=args, backend=backend, holdout=holdout)
+    rows = list(zip(df["Latitude"], df["Longitude"], df["Date"], df["Property Type"]))
+    if workers is None and executor is None:
+        price_preds = []
+        rs = []
+        for i, (latitude, longitude, date, pt) in enumerate(rows):
+            if args is not None:
+                p, r, _ = predict_price_parameterized(args, latitude, longitude, date, pt, backend=backend, holdout=holdout)
+            else:
+                p, r, _ = predict_price(latitude, longitude, date, pt, optimize=optimize, backend=backend, holdout=holdout)
+            price_preds.append(p)
+            rs.append(r)
+            if progress:
+                _print_progress(i + 1, len(rows))
+        return price_preds, rs
+
+    #Spread the sales across the executor in chunks, each worker process creates its own connection pool on first use
+    if chunksize is None:
+        chunksize = max(-(-len(rows) // (4 * (workers or os.cpu_count() or 1))), 1)
+    elif chunksize < 1:
+        raise ValueError(f"chunksize must be at least 1, not {chunksize}")
+    owned = executor is None
+    if owned:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        chunks = [rows[i:i + chunksize] for i in range(0, len(rows), chunksize)]
+        futures = {executor.submit(predict_rows, args, optimize, backend, chunk, holdout): len(chunk) for chunk in chunks}
+        done = 0
+        for future in as_completed(futures):
+            if progress:
+                _print_progress(done + futures[future], len(rows), done)
+            done += futures[future]
+        predicted = [future.result() for future in futures]
+    finally:
+        if owned:
+            executor.shutdown()
+    results = []
+    for chunk, delta in predicted:
+        results.extend(chunk)
+        #Worker processes count in their own copy of the counters
+        if isinstance(executor, ProcessPoolExecutor):
+            for key in counters:
+                counters[key] += delta[key]
+    for i, (_, _, error) in enumerate(results):
+        if error is not None:
+            print(f"Prediction of row {i} failed: {error}")
+    return [p for p, _, _ in results], [r for _, r, _ in results]
+
+def _print_progress(done, total, previous=None):
+    """
+    Print the number of sales predicted, at every 10% of the total
+    :param previous: The number of sales predicted at the last call, when sales complete in chunks (optional)
+    """
+    step = max(total // 10, 1)
+    if previous is None:
+        previous = done - 1
+    if done == total or done // step > previous // step:
+        print(f"Predicted {done}/{total} sales")
+
+def compare_backends(df, args=None):
+    """
+    Compare the accuracy and latency of the fitting backends on a dataframe of property sales
+    :param df: The dataframe containing the property sale data ("Longitude", "Latitude", "Date", "Property Type", "Price")
+    :param args: The parameters to be used for price predictions (optional)
+    :return: Dataframe indexed by backend of the mean absolute error, mean r squared and seconds taken
+    """
+    results = {}
+    for backend in BACKENDS:
+        t0 = time.perf_counter()
+        price_preds, rs = price_predictions(df, args=args if args is not None else DEFAULT_ARGS, backend=backend)
+        elapsed = time.perf_counter() - t0
+        results[backend] = {
+            "MAE": np.nanmean(np.abs(np.asarray(price_preds) - np.asarray(df["Price"], dtype=np.float64))),
+            "Mean R2": np.nanmean(np.where(np.isfinite(rs), rs, np.nan)),
+            "Seconds": elapsed
+        }
+    return pd.DataFrame(results).T
+
+class CellAggregates:
+    """
+    Price aggregates per geohash cell, month and property type, at every geohash precision in PRECISIONS
+    Each group holds a histogram of log10 Price with BINS bins, from which the median is estimated, stored sparsely
+    as one row per occupied bin with the count, sum and sum of squares of Price of its sales. Every aggregate is a
+    sum, so new sales are added incrementally and neighbourhood statistics are read without scanning raw
+    transactions
+    The rows are kept sorted by a packed int64 key of precision, geohash integer, month, property type and bin, so
+    added sales are merged into the rows they touch by binary search, and the months of a cell are one slice
+    """
+    PRECISIONS = (3, 4, 5, 6, 7)
+    BINS = 100
+    LOG_RANGE = (3.0, 8.0) # log10 of the prices covered by the histogram, others fall in the end bins
+    FIRST_YEAR = 1900 # Months are counted from January of this year, in MONTH_BITS bits
+    CELL_BITS, MONTH_BITS, TYPE_BITS, BIN_BITS = 35, 12, 3, 7
+
+    def __init__(self, table=None):
+        """
+        :param table: Dataframe of aggregates as saved by save, indexed by key (optional, default empty)
+        """
+        if table is None:
+            table = pd.DataFrame({"count": [], "sum": [], "sumsq": []}, index=pd.Index([], name="key"))
+        self.keys = np.array(table.index, dtype=np.int64)
+        self.counts = np.array(table["count"], dtype=np.int32)
+        self.sums = np.array(table["sum"], dtype=np.float64)
+        self.sumsqs = np.array(table["sumsq"], dtype=np.float64)
+
+    @property
+    def table(self):
+        """
+        Dataframe of the aggregates indexed by key, with columns "count", "sum" and "sumsq"
+        """
+        return pd.DataFrame({"count": self.counts, "sum": self.sums, "sumsq": self.sumsqs},
+            index=pd.Index(self.keys, name="key"))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load aggregates saved with save
+        :param path: The path of the .parquet file
+        :return: CellAggregates object
+        """
+        return cls(pd.read_parquet(path))
+
+    def save(self, path):
+        """
+        Save the aggregates as a Parquet file
+        :param path: The path of the .parquet file
+        """
+        self.table.to_parquet(path)
+
+    def key(self, precision, cells, months, types, bins):
+        """
+        Pack groups and bins into sortable int64 keys
+        :param precision: The geohash precision
+        :param cells: The geohash integers of the cells at that precision, see design.geohash_codes
+        :param months: The months, counted from January of FIRST_YEAR
+        :param types: The indices of the property types in PROPERTY_TYPES
+        :param bins: The histogram bins
+        :return: int64 numpy array of keys
+        """
+        key = np.int64(precision) << np.int64(self.CELL_BITS) | np.asarray(cells, dtype=np.int64)
+        key = key << np.int64(self.MONTH_BITS) | np.asarray(months, dtype=np.int64)
+        key = key << np.int64(self.TYPE_BITS) | np.asarray(types, dtype=np.int64)
+        return key << np.int64(self.BIN_BITS) | np.asarray(bins, dtype=np.int64)
+
+    def _months(self, dates):
+        months = np.asarray(pd.to_datetime(pd.Series(dates)).values, dtype="datetime64[M]").astype(np.int64)
+        months = months + (1970 - self.FIRST_YEAR) * 12
+        if len(months) and (months.min() < 0 or months.max() >= 1 << self.MONTH_BITS):
+            raise ValueError(f"Dates must be within {1 << self.MONTH_BITS} months of January {self.FIRST_YEAR}")
+        return months
+
+    def add(self, df):
+        """
+        Add sales to the aggregates, computing every precision from one encoding of the coordinates
+        :param df: Dataframe of sales with columns "Price", "Date", "Property Type", "Latitude" and "Longitude",
+        for example a chunk of assess.query_chunks or a year of assess.df_from_year
+        """
+        if len(df) == 0:
+            return
+        price = np.asarray(df["Price"], dtype=np.float64)
+        low, high = self.LOG_RANGE
+        bins = np.clip(((np.log10(np.maximum(price, 1)) - low) / (high - low) * self.BINS).astype(np.int64), 0, self.BINS - 1)
+        types = pd.Categorical(np.asarray(df["Property Type"], dtype=str), categories=PROPERTY_TYPES).codes
+        if (types < 0).any():
+            raise ValueError(f"Property types must be one of {PROPERTY_TYPES}")
+        months = self._months(df["Date"])
+        codes = design.geohash_codes(df["Latitude"], df["Longitude"], max(self.PRECISIONS)).astype(np.int64)
+        keys = np.concatenate([
+            self.key(precision, codes >> np.int64(5 * (max(self.PRECISIONS) - precision)), months, types, bins)
+            for precision in self.PRECISIONS
+        ])
+        price = np.tile(price, len(self.PRECISIONS))
+
+        # Aggregate the sales by key, then merge them into the rows they touch and insert the new rows
+        keys, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(keys)).astype(np.int32)
+        sums = np.bincount(inverse, weights=price, minlength=len(keys))
+        sumsqs = np.bincount(inverse, weights=price ** 2, minlength=len(keys))
+        positions = np.searchsorted(self.keys, keys)
+        found = positions < len(self.keys)
+        found[found] = self.keys[positions[found]] == keys[found]
+        self.counts[positions[found]] += counts[found]
+        self.sums[positions[found]] += sums[found]
+        self.sumsqs[positions[found]] += sumsqs[found]
+        new = ~found
+        self.keys = np.insert(self.keys, positions[new], keys[new])
+        self.counts = np.insert(self.counts, positions[new], counts[new])
+        self.sums = np.insert(self.sums, positions[new], sums[new])
+        self.sumsqs = np.insert(self.sumsqs, positions[new], sumsqs[new])
+
+    def stats(self, latitude, longitude, date, property_type=None, precision=5, months=12):
+        """
+        Neighbourhood statistics of Price in the geohash cell of a location over the months up to a date
+        :param latitude: The latitude of the location
+        :param longitude: The longitude of the location
+        :param date: The last date of the period (datetime object)
+        :param property_type: The property type enum to be selected (optional, default every property type)
+        :param precision: The precision of the geohash cell, one of PRECISIONS (optional)
+        :param months: The number of months in the period (optional)
+        :return: dict of count, mean, standard deviation and estimated median of Price
+        """
+        if precision not in self.PRECISIONS:
+            raise ValueError(f"Precision must be one of {self.PRECISIONS}, not {precision}")
+        cell = design.geohash_codes([latitude], [longitude], precision).astype(np.int64)[0]
+        last = int(self._months([date])[0])
+        first = max(last - months + 1, 0)
+        start, stop = np.searchsorted(self.keys, [
+            self.key(precision, cell, first, 0, 0), self.key(precision, cell, last + 1, 0, 0)
+        ])
+        keys = self.keys[start:stop]
+        counts = self.counts[start:stop]
+        selected = slice(None)
+        if property_type is not None:
+            selected = (keys >> np.int64(self.BIN_BITS)) & np.int64((1 << self.TYPE_BITS) - 1) == PROPERTY_TYPES.index(property_type)
+            keys, counts = keys[selected], counts[selected]
+        count = int(counts.sum())
+        if count == 0:
+            return {"count": 0, "mean": np.nan, "std": np.nan, "median": np.nan}
+        mean = self.sums[start:stop][selected].sum() / count
+        hist = np.bincount(keys & np.int64((1 << self.BIN_BITS) - 1), weights=counts, minlength=self.BINS)
+        cumulative = np.cumsum(hist)
+        i = int(np.searchsorted(cumulative, count / 2))
+        below = cumulative[i - 1] if i > 0 else 0
+        fraction = (count / 2 - below) / hist[i] if hist[i] else 0.5
+        low, high = self.LOG_RANGE
+        median = 10 ** (low + (i + fraction) * (high - low) / self.BINS)
+        return {
+            "count": count, "mean": mean,
+            "std": np.sqrt(max(self.sumsqs[start:stop][selected].sum() / count - mean ** 2, 0)), "median": median
+        }
+
+class ModelRegistry:
+    """
+    Persistent registry of ridge models, stored as their sufficient statistics (see RidgeStatistics), per geohash
+    cell and date window
+    Predictions in a registered cell are served from its stored statistics without touching the database. When new
+    sales are added with update, only the cells whose training bounds contain them are updated, incrementally
+    The registry may be shared by threads, for example predictions served while bulk_upload threads add sales. Each
+    cell keeps the highest ID of the sales it includes, so sales with an ID that a cell fetched when it was built
+    are not added to it again
+    """
+    def __init__(self, args=None, cell_precision=6, window_days=30):
+        """
+        :param args: The parameters of the models, see predict_price_parameterized (optional)
+        :param cell_precision: The precision of the geohash of the cells (optional)
+        :param window_days: The length in days of the date windows (optional)
+        """
+        self.args = args if args is not None else DEFAULT_ARGS
+        self.cell_precision = cell_precision
+        self.window_days = window_days
+        self.entries = {}
+        self.synced_ids = {}
+        self.refreshed_at = None
+        self.refresh_seconds = None
+        self.refreshed_cells = 0
+        self._lock = threading.RLock()
+        self._building = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"], state["_building"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+        self._building = {}
+
+    def key(self, latitude, longitude, date):
+        """
+        :return: tuple of the geohash cell and date window index of a sale
+        """
+        return design.geohash(latitude, longitude, self.cell_precision), date.toordinal() // self.window_days
+
+    def get(self, key):
+        """
+        Get the entry of a cell, fetching its training data and storing its statistics if it is not registered
+        The training data is fetched without holding the registry lock, so registered cells are served meanwhile,
+        and a cell requested by several threads at once is fetched once
+        :param key: tuple of geohash cell and date window index
+        :return: dict of the statistics, training bounds, highest sale ID, build and update times of the cell
+        """
+        while True:
+            with self._lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    return entry
+                building = self._building.get(key)
+                if building is None:
+                    # Updates made while the cell is fetched are kept, and applied once it is registered
+                    building = self._building[key] = {"done": threading.Event(), "pending": []}
+                    break
+            building["done"].wait()
+        try:
+            bounds = cell_bounds(*key, self.args, self.window_days)
+            stats = RidgeStatistics()
+            df = training_data(*bounds, self.args[2])
+            high_water = -1
+            if df is not None:
+                stats.add(df)
+                high_water = int(df["ID"].max())
+            now = time.time()
+            entry = {"stats": stats, "bounds": bounds, "high_water": high_water, "built_at": now, "updated_at": now,
+                "results": None}
+            with self._lock:
+                for sales in building["pending"]:
+                    self._add(entry, *sales)
+                self.entries[key] = entry
+            return entry
+        finally:
+            with self._lock:
+                del self._building[key]
+            building["done"].set()
+
+    def predict(self, latitude, longitude, date, property_type):
+        """
+        Price prediction for UK housing from the registered model of the cell of the sale
+        :param latitude: The latitude of the property
+        :param longitude: The longitude of the property
+        :param date: The date of the property sale (datetime object)
+        :param property_type: The property type enum of the property (F, S, D, T, O)
+        :return: tuple of predicted price, r squared, and model results
+        """
+        entry = self.get(self.key(latitude, longitude, date))
+        with self._lock:
+            stats = entry["stats"]
+            if stats.n == 0:
+                return np.nan, -float('inf'), "Insufficient data to form model: 0 datapoints in bounding area"
+            if entry["results"] is None:
+                entry["results"] = stats.fit(alpha=0.1)
+            m_results = entry["results"]
+            encodings = stats.encodings
+        target = pd.DataFrame({
+            "Date": [date], "Property Type": [property_type],
+            "Geohash": [design.geohash(latitude, longitude, self.args[2])]
+        })
+        return m_results.predict(design_matrix(target, encodings))[0], m_results.rsquared, m_results
+
+    def _add(self, entry, lats, lons, ords, ids, df):
+        """
+        Add the sales within the training bounds of a cell, that it does not include yet, to its statistics
+        :return: True if the cell was updated
+        """
+        mask = access.in_bounds(lats, lons, ords, *entry["bounds"])
+        if ids is not None:
+            mask &= ids > entry["high_water"]
+        if not mask.any():
+            return False
+        entry["stats"].add(df[mask])
+        if ids is not None:
+            entry["high_water"] = max(entry["high_water"], int(ids[mask].max()))
+        entry["results"] = None
+        entry["updated_at"] = time.time()
+        return True
+
+    def update(self, df):
+        """
+        Add new sales to the statistics of every registered cell whose training bounds contain them
+        :param df: Dataframe of sales with columns "Price", "Date", "Property Type", "Latitude" and "Longitude", and
+        "ID" for sales loaded into the database, which are only added to the cells that do not include them yet
+        (without it, every sale within the bounds of a cell is added)
+        :return: The number of cells updated
+        """
+        t0 = time.perf_counter()
+        lats = np.asarray(df["Latitude"], dtype=np.float64)
+        lons = np.asarray(df["Longitude"], dtype=np.float64)
+        ords = design.ordinals(df["Date"])
+        ids = np.asarray(df["ID"], dtype=np.int64) if "ID" in df else None
+        df = pd.DataFrame({
+            "Price": np.asarray(df["Price"], dtype=np.float64), "Date": np.asarray(df["Date"]),
+            "Property Type": np.asarray(df["Property Type"]), "Geohash": design.geohashes(lats, lons, self.args[2])
+        })
+        sales = (lats, lons, ords, ids, df)
+        updated = 0
+        with self._lock:
+            for building in self._building.values():
+                building["pending"].append(sales)
+            for entry in self.entries.values():
+                updated += self._add(entry, *sales)
+            self.refresh_seconds = time.perf_counter() - t0
+            self.refreshed_at = time.time()
+            self.refreshed_cells = updated
+        return updated
+
+    def update_from_csv(self, filename):
+        """
+        Add the sales of a price-coordinates CSV (see assess.df_from_year for its columns)
+        The file has no sale IDs, so its sales are added to every cell whose bounds contain them, including cells
+        built after the file was loaded into the database, see update_from_table
+        :param filename: The path of the CSV file
+        :return: The number of cells updated
+        """
+        df = pd.read_csv(filename, names=assess.YEAR_COLUMNS, parse_dates=["Date"])
+        return self.update(df)
+
+    def latest_id(self, table="prices_coordinates_data"):
+        """
+        :param table: The table holding the sales (optional)
+        :return: The highest sale ID in the table, 0 when it is empty
+        """
+        return access.get_rows_from_query(f"SELECT MAX(db_id) FROM {table}")[0][0] or 0
+
+    def update_from_table(self, table="prices_coordinates_data", chunk_size=100000):
+        """
+        Add the sales loaded into a table since the last update from it, or since watch was called
+        Sales that a cell already fetched when it was built are skipped, by their ID
+        :param table: The table holding the sales (optional)
+        :param chunk_size: The number of sales read at once (optional)
+        :return: The number of cells updated
+        """
+        with self._lock:
+            since = self.synced_ids.get(table)
+            if since is None:
+                raise ValueError(f"The registry does not follow {table}, call watch first")
+        chunks = list(assess.query_chunks(f"SELECT * FROM {table} WHERE db_id > {since}", COLUMNS, chunk_size))
+        if len(chunks) == 0:
+            return 0
+        df = assess.concat_chunks(chunks)
+        updated = self.update(df)
+        with self._lock:
+            self.synced_ids[table] = max(self.synced_ids[table], int(df["ID"].max()))
+        return updated
+
+    def watch(self, table="prices_coordinates_data"):
+        """
+        Update the registry with the sales of every file access.upload_file loads into the table from now on
+        :param table: The table whose uploads are followed (optional)
+        """
+        self.synced_ids[table] = self.latest_id(table)
+        def on_upload(filename, uploaded_table):
+            if uploaded_table == table:
+                self.update_from_table(table)
+        access.add_upload_listener(on_upload)
+
+    def staleness(self):
+        """
+        Describe how up to date every registered cell is
+        :return: Dataframe indexed by cell and window of the number of sales and the seconds since each cell was
+        built and last updated
+        """
+        now = time.time()
+        return pd.DataFrame([
+            {"cell": cell, "window": w, "rows": entry["stats"].n,
+            "built_seconds_ago": now - entry["built_at"], "updated_seconds_ago": now - entry["updated_at"]}
+            for (cell, w), entry in self.entries.items()
+        ], columns=["cell", "window", "rows", "built_seconds_ago", "updated_seconds_ago"]).set_index(["cell", "window"])
+
+    def save(self, path):
+        """
+        Save the registry
+        :param path: The path of the file
+        """
+        with open(path, "wb") as file:
+            pickle.dump(self, file)
+
+    @staticmethod
+    def load(path):
+        """
+        Load a registry saved with save
+        :param path: The path of the file
+        :return: ModelRegistry object
+        """
+        with open(path, "rb") as file:
+            return pickle.load(file)
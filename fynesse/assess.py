@@ -1,31 +1,88 @@
 from .config import *
 
-from . import access, address
+from . import access, address, instrument
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
-import geopandas as gpd
 
 """Place commands in this file to assess the data you have downloaded. How are missing values encoded, how are outliers encoded? What do columns represent, makes rure they are correctly labeled. How is the data indexed. Crete visualisation routines to assess the data (e.g. in bokeh). Ensure that date formats are correct and correctly timezoned."""
 
-def query(query, columns):
+# dtypes of the price-coordinates columns, columns not in the schema take their dtype from the cursor description
+SCHEMA = {
+    "Postcode": "category", "Price": "int64", "Date": "datetime64[ns]", "Property Type": "category",
+    "New Build Flag": "category", "Tenure Type": "category", "Locality": "category", "Town/City": "category",
+    "District": "category", "County": "category", "Country": "category",
+    "Latitude": "float64", "Longitude": "float64", "ID": "int64"
+}
+
+def schema_dtypes(columns, description=None):
+    """
+    Find the dtype of each column, from SCHEMA by column name and otherwise from the cursor description
+    :param columns: list of column names
+    :param description: The cursor description of the query columns (optional)
+    :return: list of dtype names, None for columns whose dtype should be inferred
+    """
+    described = access.description_dtypes(description) if description is not None else [None] * len(columns)
+    return [SCHEMA.get(column, dtype) for column, dtype in zip(columns, described)]
+
+@instrument.timed("assess.query")
+def query(query, columns, chunk_size=None):
     """
     Request user input for some aspect of the data.
     :param query: The database query to be performed to select the data
     :param columns: The columns to be selected in the query
+    :param chunk_size: When given, build the dataframe incrementally from chunks of this many rows streamed from
+    the database, rather than from the first access.QUERY_LIMIT rows, which warns when it truncates the results (optional)
     :return: Dataframe containing the data selected from the database
     """
-    data = access.get_rows_from_query(query)
-    data = np.vstack(data)
-    if len(data) == 0:
-        raise ValueError("No data matches the query")
-    if len(columns) != len(data[0]):
-        raise ValueError(f"Number of columns in the dataframe({len(columns)}) must match number of columns selected in the query({len(data[0])})")
-    df = pd.DataFrame({
-        column: data[:,i] for i, column in enumerate(columns)
-        })
+    if chunk_size is not None:
+        chunks = list(query_chunks(query, columns, chunk_size))
+        if len(chunks) == 0:
+            raise ValueError("No data matches the query")
+        return concat_chunks(chunks)
+    data, description = access.get_rows_from_query(query, description=True)
+    return labelled(data, columns, description)
+
+def query_chunks(query, columns, chunk_size=10000):
+    """
+    Stream the data selected by a query as dataframes of at most chunk_size rows
+    :param query: The database query to be performed to select the data
+    :param columns: The columns to be selected in the query
+    :param chunk_size: The number of rows in each chunk (optional)
+    :return: generator of Dataframes containing the data selected from the database
+    """
+    schema = {column: dtype for column, dtype in zip(columns, schema_dtypes(columns)) if dtype is not None}
+    yield from access.stream_query(query, columns=list(columns), chunk_size=chunk_size, schema=schema)
+
+def concat_chunks(chunks):
+    """
+    Concatenate dataframe chunks, keeping categorical columns categorical when the chunks have different categories
+    :param chunks: list of Dataframes with the same columns
+    :return: Dataframe of every chunk
+    """
+    df = pd.concat(chunks, ignore_index=True)
+    for column in chunks[0].columns:
+        if isinstance(chunks[0][column].dtype, pd.CategoricalDtype) and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = pd.api.types.union_categoricals([chunk[column] for chunk in chunks])
     return df
 
+def aggregate_query(query, columns, func, initial=None, chunk_size=10000):
+    """
+    Aggregate over all the data selected by a query in bounded memory, one chunk at a time
+    :param query: The database query to be performed to select the data
+    :param columns: The columns to be selected in the query
+    :param func: Function of the aggregate so far and a chunk dataframe, returning the new aggregate
+    :param initial: The initial aggregate (optional)
+    :param chunk_size: The number of rows in each chunk (optional)
+    :return: The aggregate over every chunk
+    """
+    aggregate = initial
+    for chunk in query_chunks(query, columns, chunk_size):
+        aggregate = func(aggregate, chunk)
+    return aggregate
+
 def view(df, x_col, y_cols, scatter=False):
     """
     Provide a view of the data that allows the user to verify some aspect of its quality.
@@ -34,6 +91,7 @@ def view(df, x_col, y_cols, scatter=False):
     :param y_col: List of column names to be visualized as the y_axis
     :param scatter: Bool, set to true to plot a scatter graph (optional)
     """
+    import matplotlib.pyplot as plt
     if x_col not in df:
         raise ValueError(f"Column {x_col} is not in the dataframe provided")
     for y_col in y_cols:
@@ -49,69 +107,490 @@ def view(df, x_col, y_cols, scatter=False):
     plt.legend()
     plt.show()
 
-def labelled(data, columns):
+@instrument.timed("assess.labelled")
+def labelled(data, columns, description=None):
     """
     Provide a labelled set of data ready for supervised learning.
-    Provide a dataframe from a set of rows of data
+    Provide a dataframe from a set of rows of data, each column is built directly with its dtype from SCHEMA
+    or the cursor description
     :param data: tuple tuple of datapoints
     :param columns: list of column names for the dataframe
+    :param description: The cursor description of the query that selected the data (optional)
     :return: Dataframe containining the labelled data
     """
     if len(data) == 0:
         raise ValueError("No data matches the query")
     if len(columns) != len(data[0]):
         raise ValueError(f"Number of columns in the dataframe({len(columns)}) must match number of columns selected in the query({len(data[0])})")
-    data = np.vstack(data)
-    df = pd.DataFrame({
-        column: data[:, i] for i, column in enumerate(columns)
-    })
-    return df
+    return access.typed_frame(data, columns, schema_dtypes(columns, description))
 
-def df_from_year(year):
+def benchmark_labelled(n=50000, seed=0):
+    """
+    Compare the memory and latency of labelled against the object-dtype np.vstack conversion it replaces
+    on synthetic price-coordinates rows
+    :param n: The number of rows (optional)
+    :param seed: Seed of the random generator (optional)
+    :return: Dataframe indexed by conversion of the seconds taken and bytes used by the dataframe
+    """
+    import datetime
+    rng = np.random.default_rng(seed)
+    towns = [f"TOWN {i}" for i in range(300)]
+    rows = tuple(
+        (f"AB{i % 90} {i % 9}CD", int(p), datetime.date(2020, 1, 1) + datetime.timedelta(days=int(day)), pt, "N", "F",
+        "", towns[i % 300], towns[i % 300], "COUNTY", 1, "England", float(la), float(lo), i)
+        for i, (p, day, pt, la, lo) in enumerate(zip(
+            rng.lognormal(12.5, 0.5, n), rng.integers(0, 365, n), rng.choice(list("FSDTO"), n),
+            rng.normal(52, 1, n), rng.normal(-1, 1, n)))
+    )
+    columns = address.COLUMNS
+    results = {}
+
+    t0 = time.perf_counter()
+    data = np.vstack(rows)
+    df = pd.DataFrame({column: data[:, i] for i, column in enumerate(columns)})
+    results["vstack"] = {"Seconds": time.perf_counter() - t0, "Bytes": df.memory_usage(deep=True).sum()}
+
+    t0 = time.perf_counter()
+    df = labelled(rows, columns)
+    results["labelled"] = {"Seconds": time.perf_counter() - t0, "Bytes": df.memory_usage(deep=True).sum()}
+    return pd.DataFrame(results).T
+
+YEAR_COLUMNS = ("Postcode", "Price", "Date", "Property Type", "New Build Flag", "Tenure Type", 
+    "Locality", "Town/City", "District", "County", "Positional Quality Indicator",
+    "Country", "Latitude", "Longitude")
+
+def read_year_csv(year):
+    """
+    Parse the CSVs of a year of price-coordinates data with explicit dtypes, reading both parts in parallel
+    :param year: The year of data to be read
+    :return: Dataframe containing the labelled data
+    """
+    dtypes = {column: SCHEMA[column] for column in YEAR_COLUMNS if column in SCHEMA and column != "Date"}
+    def read(part):
+        return pd.read_csv(f"pcd/pc-{year}-part{part}.csv", names = YEAR_COLUMNS, dtype = dtypes, parse_dates = ["Date"])
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        parts = list(executor.map(read, (1, 2)))
+    return concat_chunks(parts)
+
+def year_csv_chunks(year, chunk_size=100000):
+    """
+    Parse the CSVs of a year of price-coordinates data in chunks, so a year need not be held in memory at once
+    :param year: The year of data to be read
+    :param chunk_size: The number of rows in each chunk (optional)
+    :return: generator of Dataframes containing the labelled data
+    """
+    dtypes = {column: SCHEMA[column] for column in YEAR_COLUMNS if column in SCHEMA and column != "Date"}
+    for part in (1, 2):
+        with pd.read_csv(f"pcd/pc-{year}-part{part}.csv", names = YEAR_COLUMNS, dtype = dtypes, parse_dates = ["Date"], chunksize = chunk_size) as reader:
+            yield from reader
+
+def year_cache_path(year):
+    """
+    Find the path of the Parquet cache of a year of price-coordinates data, in the "pcd_cache_dir" config directory
+    :param year: The year of data
+    :return: The path of the cache file
+    """
+    return os.path.join(config.get("pcd_cache_dir", "pcd"), f"pc-{year}.parquet")
+
+def cache_year(year):
+    """
+    Write the Parquet cache of a year of price-coordinates data, unless it is newer than the CSVs it is built from
+    :param year: The year of data to be cached
+    :return: The path of the cache file
+    """
+    path = year_cache_path(year)
+    sources = [f"pcd/pc-{year}-part{part}.csv" for part in (1, 2)]
+    if os.path.exists(path) and all(not os.path.exists(source) or os.path.getmtime(source) <= os.path.getmtime(path) for source in sources):
+        return path
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    read_year_csv(year).to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+    return path
+
+def df_from_year(year, columns=None, filters=None, cache=True):
     """
     Provide a dataframe of price-coordinates data from a specified year
+    The CSVs are parsed once and cached as Parquet (see cache_year), later reads memory-map the cache
     :param year: The year of data to be selected
+    :param columns: The columns to be loaded (optional, default every column)
+    :param filters: pyarrow filters on the rows to be loaded, for example [("Price", ">", 100000)] (optional)
+    :param cache: When False, parse the CSVs without reading or writing the cache (optional)
+    :return: Dataframe containing the labelled data
+    """
+    if not cache:
+        if filters is not None:
+            raise ValueError("Filters can only be pushed down into the Parquet cache")
+        df = read_year_csv(year)
+        return df if columns is None else df[list(columns)]
+    return pd.read_parquet(cache_year(year), columns=columns, filters=filters, memory_map=True)
+
+def df_from_years(years, columns=None, filters=None):
+    """
+    Provide a dataframe of price-coordinates data from several years, loading only the columns and rows requested
+    :param years: The years of data to be selected, for example range(1995, 2025)
+    :param columns: The columns to be loaded (optional, default every column)
+    :param filters: pyarrow filters on the rows to be loaded, for example [("County", "=", "CAMBRIDGESHIRE")] (optional)
     :return: Dataframe containing the labelled data
     """
-    cols = ("Postcode", "Price", "Date", "Property Type", "New Build Flag", "Tenure Type", 
-        "Locality", "Town/City", "District", "County", "Positional Quality Indicator",
-        "Country", "Latitude", "Longitude")
-    pcdf1, pcdf2 = pd.read_csv(f"pcd/pc-{year}-part1.csv", names = cols), pd.read_csv(f"pcd/pc-{year}-part2.csv", names = cols)
-    pcdf = pd.concat((pcdf1, pcdf2))
-    return pcdf
+    years = list(years)
+    with ThreadPoolExecutor(max_workers=min(4, max(len(years), 1))) as executor:
+        paths = list(executor.map(cache_year, years))
+    dfs = [pd.read_parquet(path, columns=columns, filters=filters, memory_map=True) for path in paths]
+    if len(dfs) == 0:
+        raise ValueError("No years selected")
+    return concat_chunks(dfs)
+
+# Statistics computed by group_statistics and aggregate, "pNN" is the NNth percentile, for example "p90"
+STATISTICS = ("count", "sum", "mean", "std", "min", "max", "median")
+
+def _quantile(statistic):
+    """
+    The quantile of a "median" or "pNN" statistic, None for other statistics
+    """
+    if statistic == "median":
+        return 0.5
+    if statistic.startswith("p"):
+        try:
+            q = float(statistic[1:]) / 100
+        except ValueError:
+            q = None
+        if q is not None and 0 <= q <= 1:
+            return q
+    if statistic not in STATISTICS:
+        raise ValueError(f"Statistic must be one of {STATISTICS} or a percentile such as 'p90', not {statistic}")
+    return None
 
-def plot_gdf_col_heatmap(df, col, alpha=0.05):
+def group_statistics(codes, values, statistics=("count", "mean"), n_groups=None):
+    """
+    Compute statistics of values per group in one pass, with np.bincount for the moments and one sort for the
+    order statistics (min, max, median and percentiles, linearly interpolated as in pandas)
+    :param codes: Sequence of the non-negative integer group code of each value
+    :param values: Sequence of the values
+    :param statistics: The statistics to be computed, see STATISTICS (optional)
+    :param n_groups: The number of group codes, when codes are already dense (optional, default compact the codes)
+    :return: tuple of int64 numpy array of the codes of the non-empty groups, and dict of statistic to numpy array
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    quantiles = {statistic: _quantile(statistic) for statistic in statistics}
+    if n_groups is None:
+        groups, codes = np.unique(codes, return_inverse=True)
+        n_groups = len(groups)
+    else:
+        groups = np.arange(n_groups)
+    counts = np.bincount(codes, minlength=n_groups)
+    occupied = counts > 0
+    safe_counts = np.maximum(counts, 1)
+    results = {}
+    if any(statistic in ("sum", "mean", "std") for statistic in statistics):
+        sums = np.bincount(codes, weights=values, minlength=n_groups)
+        means = sums / safe_counts
+    if "std" in statistics:
+        squares = np.bincount(codes, weights=(values - means[codes]) ** 2, minlength=n_groups)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            results["std"] = np.sqrt(squares / (counts - 1))
+    if any(q is not None for q in quantiles.values()) or "min" in statistics or "max" in statistics:
+        # Sort by value, then stably by group, narrow codes are sorted by numpy in linear time
+        order = np.argsort(values)
+        sorted_codes = codes[order]
+        if n_groups <= np.iinfo(np.int16).max:
+            sorted_codes = sorted_codes.astype(np.int16)
+        ordered = values[order[np.argsort(sorted_codes, kind="stable")]]
+        if len(ordered) == 0:
+            # With no values every group is empty, its order statistics are NaN
+            ordered = np.full(1, np.nan)
+        starts = np.cumsum(counts) - counts
+        last = len(ordered) - 1
+    for statistic in statistics:
+        if statistic == "count":
+            results[statistic] = counts
+        elif statistic == "sum":
+            results[statistic] = sums
+        elif statistic == "mean":
+            results[statistic] = means
+        elif statistic == "min":
+            results[statistic] = ordered[np.minimum(starts, last)]
+        elif statistic == "max":
+            results[statistic] = ordered[np.minimum(starts + counts - 1, last)]
+        elif quantiles[statistic] is not None:
+            position = quantiles[statistic] * (safe_counts - 1)
+            low = np.floor(position).astype(np.int64)
+            high = np.ceil(position).astype(np.int64)
+            below, above = ordered[np.minimum(starts + low, last)], ordered[np.minimum(starts + high, last)]
+            results[statistic] = below + (above - below) * (position - low)
+    return groups[occupied], {statistic: results[statistic][occupied] for statistic in statistics}
+
+def aggregate(df, group_col, measured_col, statistics=("count", "mean", "median")):
+    """
+    Compute statistics of a column per group of another column in one pass, rows missing either are ignored
+    :param df: The dataframe containing the columns
+    :param group_col: The column to group by
+    :param measured_col: The column the statistics are computed over
+    :param statistics: The statistics to be computed, see STATISTICS (optional)
+    :return: Dataframe indexed by group with a column per statistic, groups in order of appearance, or in the
+    order of the categories of a categorical column
+    """
+    if group_col not in df:
+        raise ValueError(f"{group_col} must be in the dataframe passed")
+    if measured_col not in df:
+        raise ValueError(f"{measured_col} must be in the dataframe passed")
+    groups = df[group_col]
+    if isinstance(groups.dtype, pd.CategoricalDtype):
+        codes, labels = groups.cat.codes.to_numpy(), groups.cat.categories
+    else:
+        codes, labels = pd.factorize(groups)
+    values = np.asarray(df[measured_col], dtype=np.float64)
+    keep = (codes >= 0) & ~np.isnan(values)
+    occupied, results = group_statistics(codes[keep], values[keep], statistics, n_groups=len(labels))
+    return pd.DataFrame(results, index=pd.Index(np.asarray(labels)[occupied], name=group_col))
+
+# Database column of each labelled column of prices_coordinates_data
+DB_COLUMNS = {
+    "Postcode": "postcode", "Price": "price", "Date": "date_of_transfer", "Property Type": "property_type",
+    "New Build Flag": "new_build_flag", "Tenure Type": "tenure_type", "Locality": "locality",
+    "Town/City": "town_city", "District": "district", "County": "county",
+    "Positional Quality Indicator": "positional_quality_indicator", "Country": "country",
+    "Latitude": "latitude", "Longitude": "longitude", "ID": "db_id"
+}
+SQL_STATISTICS = {"count": "COUNT({})", "sum": "SUM({})", "mean": "AVG({})", "std": "STDDEV_SAMP({})",
+    "min": "MIN({})", "max": "MAX({})"}
+
+def aggregate_db(group_col, measured_col, statistics=("count", "mean", "median"), table="prices_coordinates_data", where=None):
+    """
+    Compute statistics of a column per group of another column in the database, without fetching the rows
+    Moments are computed with GROUP BY, the median and percentiles with PERCENTILE_CONT (MariaDB 10.3.3 or later)
+    :param group_col: The column to group by, a labelled column (see DB_COLUMNS) or a database column
+    :param measured_col: The column the statistics are computed over, a labelled column or a database column
+    :param statistics: The statistics to be computed, see STATISTICS (optional)
+    :param table: The table holding the data (optional)
+    :param where: SQL condition selecting the rows to be aggregated, for example "county = 'CAMBRIDGESHIRE'" (optional)
+    :return: Dataframe indexed by group with a column per statistic, as aggregate returns
+    """
+    group, measured = DB_COLUMNS.get(group_col, group_col), DB_COLUMNS.get(measured_col, measured_col)
+    quantiles = {statistic: _quantile(statistic) for statistic in statistics}
+    condition = f"WHERE {measured} IS NOT NULL AND {group} IS NOT NULL" + (f" AND ({where})" if where else "")
+    moments = [statistic for statistic in statistics if quantiles[statistic] is None]
+    order = [statistic for statistic in statistics if quantiles[statistic] is not None]
+    selects = [f"SELECT {group}, " + ", ".join(SQL_STATISTICS[statistic].format(measured) for statistic in moments)
+        + f" FROM {table} {condition} GROUP BY {group}"] if moments else []
+    if order or not moments:
+        selects.append(f"SELECT DISTINCT {group}" + "".join(
+            f", PERCENTILE_CONT({quantiles[statistic]}) WITHIN GROUP (ORDER BY {measured}) OVER (PARTITION BY {group})"
+            for statistic in order) + f" FROM {table} {condition}")
+    frames = []
+    for sql, names in zip(selects, (moments, order) if moments else (order,)):
+        rows = access.get_rows_from_query(sql)
+        frame = pd.DataFrame(list(rows), columns=[group_col, *names]).set_index(group_col)
+        frames.append(frame.astype(np.float64).astype({"count": np.int64} if "count" in names else {}))
+    return pd.concat(frames, axis=1)[list(statistics)].sort_index()
+
+def summary_table(df, group_col, measured_cols=("Price",), statistics=("count", "mean", "median", "p10", "p90")):
+    """
+    Summarise several columns per group, one aggregate pass per column
+    :param df: The dataframe containing the columns
+    :param group_col: The column to group by
+    :param measured_cols: The columns to be summarised (optional)
+    :param statistics: The statistics to be computed, see STATISTICS (optional)
+    :return: Dataframe indexed by group with a (column, statistic) column for each statistic of each column
+    """
+    return pd.concat({col: aggregate(df, group_col, col, statistics) for col in measured_cols}, axis=1)
+
+def price_summary(df, group_col="Property Type"):
+    """
+    Summarise sale prices per group, for example per property type, district or year
+    :param df: The dataframe of sales, must have a "Price" column
+    :param group_col: The column to group by, or "Year" to group by the year of "Date" (optional)
+    :return: Dataframe of the count, mean, median, 10th and 90th percentile price per group
+    """
+    if group_col == "Year" and "Year" not in df:
+        df = pd.DataFrame({"Year": pd.to_datetime(df["Date"]).dt.year, "Price": df["Price"]})
+        return aggregate(df, group_col, "Price", ("count", "mean", "median", "p10", "p90")).sort_index()
+    return aggregate(df, group_col, "Price", ("count", "mean", "median", "p10", "p90"))
+
+UK_EXTENT = (-8.7, 1.9, 49.8, 60.9) # west, east, south, north
+HEATMAP_MODES = ("points", "raster", "hexbin")
+HEATMAP_STATISTICS = ("mean", "median", "count")
+
+_uk_boundary = None
+
+def uk_boundary():
+    """
+    Get the boundary of the United Kingdom, read once and kept in memory
+    It is read from the file of the "uk_boundary_file" config key, or from the naturalearth_lowres dataset of
+    geopandas versions that still ship it
+    :return: GeoDataFrame of the boundary
+    """
+    global _uk_boundary
+    if _uk_boundary is None:
+        import geopandas as gpd
+        if "uk_boundary_file" in config:
+            boundary = gpd.read_file(config["uk_boundary_file"])
+        else:
+            try:
+                path = gpd.datasets.get_path('naturalearth_lowres')
+            except AttributeError:
+                raise ValueError("This geopandas has no naturalearth_lowres dataset, set 'uk_boundary_file' in the config")
+            world_gdf = gpd.read_file(path)
+            boundary = world_gdf[(world_gdf["name"] == "United Kingdom")]
+        if boundary.crs is None:
+            boundary = boundary.set_crs("EPSG:4326")
+        _uk_boundary = boundary
+    return _uk_boundary
+
+def heatmap_grid(df, col, mode="raster", cell_size=0.05, statistic="mean", extent=UK_EXTENT):
+    """
+    Bin coordinates into a raster or hexagonal grid and reduce the values of a column in each cell
+    :param df: DataFrame object, must have columns latitude and longitude
+    :param col: Name of the column to be reduced
+    :param mode: "raster" for square cells, or "hexbin" for hexagonal cells (optional)
+    :param cell_size: The width in degrees of a cell (optional)
+    :param statistic: The statistic of each cell, one of "mean", "median" or "count" (optional)
+    :param extent: tuple of the west, east, south and north edges of the grid, points outside are dropped (optional)
+    :return: dict of the grid, the centres, statistic and count of each occupied cell with its settings
+    """
+    if mode not in ("raster", "hexbin"):
+        raise ValueError(f"Grid mode must be 'raster' or 'hexbin', not {mode}")
+    if statistic not in HEATMAP_STATISTICS:
+        raise ValueError(f"Statistic must be one of {HEATMAP_STATISTICS}, not {statistic}")
+    west, east, south, north = extent
+    lons = np.asarray(df["Longitude"], dtype=np.float64)
+    lats = np.asarray(df["Latitude"], dtype=np.float64)
+    values = np.asarray(df[col], dtype=np.float64) if statistic != "count" else np.zeros(len(lons))
+    keep = (west <= lons) & (lons < east) & (south <= lats) & (lats < north) & np.isfinite(values)
+    lons, lats, values = lons[keep] - west, lats[keep] - south, values[keep]
+
+    n_cols = int(np.ceil((east - west) / cell_size)) + 1
+    if mode == "raster":
+        i, j = np.floor(lons / cell_size).astype(np.int64), np.floor(lats / cell_size).astype(np.int64)
+        codes = j * n_cols + i
+        cells, stat = group_statistics(codes, values, (statistic, "count"))
+        x = (cells % n_cols + 0.5) * cell_size + west
+        y = (cells // n_cols + 0.5) * cell_size + south
+    else:
+        # Hexagon centres form two offset rectangular lattices, a point falls in the nearer of the nearest centres
+        row_height = cell_size * np.sqrt(3)
+        i1, j1 = np.round(lons / cell_size), np.round(lats / row_height)
+        i2, j2 = np.floor(lons / cell_size), np.floor(lats / row_height)
+        d1 = (lons - i1 * cell_size) ** 2 + (lats - j1 * row_height) ** 2
+        d2 = (lons - (i2 + 0.5) * cell_size) ** 2 + (lats - (j2 + 0.5) * row_height) ** 2
+        second = d2 < d1
+        i = np.where(second, i2, i1).astype(np.int64)
+        j = np.where(second, j2, j1).astype(np.int64)
+        codes = (2 * j + second) * n_cols + i
+        cells, stat = group_statistics(codes, values, (statistic, "count"))
+        rows, offset = cells // n_cols // 2, (cells // n_cols) % 2
+        x = (cells % n_cols + 0.5 * offset) * cell_size + west
+        y = (rows + 0.5 * offset) * row_height + south
+    return {"mode": mode, "col": col, "statistic": statistic, "cell_size": cell_size, "extent": tuple(extent),
+        "x": x, "y": y, "value": stat[statistic].astype(np.float64), "count": stat["count"]}
+
+def save_heatmap_grid(grid, path):
+    """
+    Write a grid built by heatmap_grid to disk for reuse
+    :param grid: dict of the grid
+    :param path: The path of the .npz file
+    """
+    np.savez_compressed(path, **{key: np.asarray(value) for key, value in grid.items()})
+
+def load_heatmap_grid(path):
+    """
+    Read a grid written by save_heatmap_grid
+    :param path: The path of the .npz file
+    :return: dict of the grid
+    """
+    with np.load(path) as data:
+        grid = {key: data[key] for key in data.files}
+    for key in ("mode", "col", "statistic"):
+        grid[key] = str(grid[key])
+    grid["cell_size"] = float(grid["cell_size"])
+    grid["extent"] = tuple(float(edge) for edge in grid["extent"])
+    return grid
+
+def plot_heatmap_grid(grid, ax=None, alpha=1.0):
+    """
+    Plot a grid built by heatmap_grid over the boundary of the UK
+    :param grid: dict of the grid
+    :param ax: The axes to plot on (optional, default a new figure)
+    :param alpha: Transparency of the cells (optional)
+    :return: The axes of the plot
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import PolyCollection
+    base = uk_boundary().plot(color='white', edgecolor='black', alpha=1, figsize=(11,11), ax=ax)
+    size = grid["cell_size"]
+    if grid["mode"] == "raster":
+        west, east, south, north = grid["extent"]
+        i = np.round((grid["x"] - west) / size - 0.5).astype(np.int64)
+        j = np.round((grid["y"] - south) / size - 0.5).astype(np.int64)
+        image = np.full((j.max() + 1 if len(j) else 1, i.max() + 1 if len(i) else 1), np.nan)
+        image[j, i] = grid["value"]
+        mappable = base.imshow(image, origin="lower", alpha=alpha, interpolation="nearest",
+            extent=(west, west + image.shape[1] * size, south, south + image.shape[0] * size))
+    else:
+        angles = np.radians(np.arange(30, 390, 60))
+        hexagon = np.column_stack((np.cos(angles), np.sin(angles))) * size / np.sqrt(3)
+        verts = np.stack((grid["x"], grid["y"]), axis=1)[:, None, :] + hexagon[None, :, :]
+        mappable = PolyCollection(verts, array=grid["value"], alpha=alpha, edgecolors="none")
+        base.add_collection(mappable)
+    plt.colorbar(mappable, ax=base, label=f"{grid['statistic']} of {grid['col']}")
+    return base
+
+def plot_gdf_col_heatmap(df, col, alpha=0.05, mode="points", cell_size=0.05, statistic="mean", output=None):
     """
     Plot a heatmap of specified column value across the uk using latitude and longitude data in dataframe
+    In "raster" and "hexbin" modes the points are binned into cells and the value of each cell is plotted, which
+    scales to years of sales, rather than every point being plotted
     :param df: DataFrame object, must have columns latitude and longitude
     :param col: Name of the column value to be used to plot the heatmap
-    :param alpha: Transparency of points on the plot
+    :param alpha: Transparency of points on the plot, in "points" mode
+    :param mode: One of "points", "raster" or "hexbin" (optional)
+    :param cell_size: The width in degrees of a cell in "raster" and "hexbin" modes (optional)
+    :param statistic: The statistic of each cell in "raster" and "hexbin" modes, "mean", "median" or "count" (optional)
+    :param output: The path the grid is written to for reuse with load_heatmap_grid (optional)
     """
     if not ("Latitude" in df and "Longitude" in df and col in df):
         raise ValueError(f"Dataframe must have columns 'Latitude', 'Longitude' and '{col}'")
-    geometry = gpd.points_from_xy(df["Longitude"], df["Latitude"])
-    gdf = gpd.GeoDataFrame(df, geometry=geometry)
-    world_gdf = gpd.read_file(gpd.datasets.get_path('naturalearth_lowres'))
-    world_gdf.crs = "EPSG:4326"
-    uk_gdf = world_gdf[(world_gdf["name"] == "United Kingdom")]
-    base = uk_gdf.plot(color='white', edgecolor='black', alpha=1, figsize=(11,11), label=col)
-    gdf.plot(ax=base, column=col, alpha=alpha, legend=True)
+    if mode not in HEATMAP_MODES:
+        raise ValueError(f"Mode must be one of {HEATMAP_MODES}, not {mode}")
+    if mode == "points":
+        if output is not None:
+            raise ValueError("Only 'raster' and 'hexbin' grids can be written to disk")
+        import matplotlib.pyplot as plt
+        base = uk_boundary().plot(color='white', edgecolor='black', alpha=1, figsize=(11,11), label=col)
+        if not pd.api.types.is_numeric_dtype(df[col]) or pd.api.types.is_bool_dtype(df[col]):
+            # Categories, such as "Property Type", are plotted by geopandas with a legend of the categories
+            import geopandas as gpd
+            gdf = gpd.GeoDataFrame(df[[col]], geometry=gpd.points_from_xy(df["Longitude"], df["Latitude"]))
+            gdf.plot(ax=base, column=col, alpha=alpha, legend=True, categorical=True)
+            return
+        points = base.scatter(df["Longitude"], df["Latitude"], c=df[col], alpha=alpha, s=4)
+        plt.colorbar(points, ax=base)
+        return
+    grid = heatmap_grid(df, col, mode=mode, cell_size=cell_size, statistic=statistic)
+    if output is not None:
+        save_heatmap_grid(grid, output)
+    plot_heatmap_grid(grid)
 
-def plot_barchart(df, group_col, measured_col):
+def plot_barchart(df, group_col, measured_col, statistic="mean"):
     """
     Plot a barchart of specified columns from a dataframe
     :param df: The Dataframe to be used to plot the barchart
     :param group_col: The column to be used to group the bars
     :param measured_col: The y-axis column
+    :param statistic: The statistic of measured_col plotted for each group, see STATISTICS (optional)
     """
-    if group_col not in df:
-        raise ValueError(f"{group_col} must be in the dataframe passed")
-    if measured_col not in df:
-        raise ValueError(f"{measured_col} must be in the dataframe passed")
-    
-    bars = df[group_col].unique()
-    means = [np.mean(df[df[group_col] == col][measured_col]) for col in bars]
-    plt.bar(bars, means)
+    plot_aggregate(aggregate(df, group_col, measured_col, (statistic,)), measured_col)
+
+def plot_aggregate(table, measured_col, statistic=None):
+    """
+    Plot a barchart of a statistic per group, as computed by aggregate or aggregate_db
+    :param table: Dataframe indexed by group with a column per statistic
+    :param measured_col: The name of the column the statistics were computed over, for the y-axis label
+    :param statistic: The statistic to be plotted (optional, default the first column of table)
+    """
+    import matplotlib.pyplot as plt
+    statistic = statistic if statistic is not None else table.columns[0]
+    plt.bar([str(group) for group in table.index], table[statistic])
 
-    plt.ylabel(f"Mean value of {measured_col}")
-    plt.show()
\ No newline at end of file
+    plt.ylabel(f"{statistic.capitalize()} value of {measured_col}")
+    plt.show()
@@ -0,0 +1,216 @@
+# This file contains a backtesting harness for the accuracy and throughput of address.price_predictions
+
+"""Predict the prices of a held-out period of sales with address.price_predictions under a chosen configuration,
+and report the error of the predictions, the distribution of the r squared of their models, the rows predicted per
+second, the time spent fetching rows against fitting models, and the rate at which the rows cache answered fetches.
+The models are trained only on sales before the held-out period, without the held-out sales themselves.
+Reports are JSON, so they can be compared between releases.
+
+Run a backtest from the command line:
+    python -m fynesse.backtest --year 2021 --start 2021-06-01 --end 2021-07-01 --sample 1000 --output report.json
+    python -m fynesse.backtest --db --start 2021-06-01 --end 2021-07-01 --sample 1000 --batch --backend ridge"""
+
+import argparse
+import datetime
+import json
+import platform
+from importlib import metadata
+import time
+import numpy as np
+import pandas as pd
+from . import access, address, assess
+
+try:
+    VERSION = metadata.version("fynesse")
+except metadata.PackageNotFoundError:
+    VERSION = None
+R2_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+def held_out(start, end, year=None, sample=None, seed=0):
+    """
+    Select the sales of a held-out period, from the df_from_year data of a year or from the database
+    :param start: The first date of the period
+    :param end: The date after the last date of the period
+    :param year: The year of df_from_year data to select from (optional, default query prices_coordinates_data)
+    :param sample: The number of sales sampled from the period (optional, default every sale)
+    :param seed: Seed of the sampling (optional)
+    :return: Dataframe of the sales of the period ("Price", "Date", "Property Type", "Latitude", "Longitude", ...)
+    """
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    if year is not None:
+        df = assess.df_from_year(year, filters=[("Date", ">=", start), ("Date", "<", end)])
+    else:
+        df = assess.query(
+            "SELECT * FROM prices_coordinates_data WHERE "
+            f"date_of_transfer >= CAST('{start.date()}' as date) AND date_of_transfer < CAST('{end.date()}' as date)",
+            address.COLUMNS, chunk_size=100000
+        )
+    if len(df) == 0:
+        raise ValueError(f"No sales between {start.date()} and {end.date()}")
+    if sample is not None and sample < len(df):
+        df = df.sample(n=sample, random_state=seed)
+    df = df.sort_values("Date", kind="stable").reset_index(drop=True)
+    df["Date"] = pd.to_datetime(df["Date"]).dt.date
+    return df
+
+def metrics(prices, price_preds, rs):
+    """
+    Error metrics of price predictions
+    :param prices: Sequence of the actual prices
+    :param price_preds: Sequence of the predicted prices, nan where no prediction could be made
+    :param rs: Sequence of the r squared of the models of the predictions
+    :return: dict of the coverage, MAE, MAPE, median absolute percentage error, and the r squared distribution
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    price_preds = np.asarray(price_preds, dtype=np.float64)
+    rs = np.asarray(rs, dtype=np.float64)
+    predicted = np.isfinite(price_preds)
+    errors = np.abs(price_preds[predicted] - prices[predicted])
+    ape = errors / prices[predicted]
+    finite_rs = rs[np.isfinite(rs)]
+    return {
+        "rows": int(len(prices)),
+        "predicted": int(predicted.sum()),
+        "coverage": float(predicted.mean()) if len(prices) else 0.0,
+        "mae": float(errors.mean()) if len(errors) else None,
+        "mape": float(ape.mean()) if len(ape) else None,
+        "median_ape": float(np.median(ape)) if len(ape) else None,
+        "r2": {
+            "mean": float(finite_rs.mean()) if len(finite_rs) else None,
+            **{f"p{int(q * 100)}": float(np.quantile(finite_rs, q)) if len(finite_rs) else None for q in R2_QUANTILES},
+            "undefined": int(len(rs) - len(finite_rs))
+        }
+    }
+
+def run(df, args=None, optimize=False, batch=False, backend="statsmodels", workers=None, executor=None, name=None,
+        start=None):
+    """
+    Backtest address.price_predictions on sales with known prices
+    :param df: The dataframe of sales ("Price", "Latitude", "Longitude", "Date", "Property Type"), see held_out
+    :param args: The parameters to be used for price predictions (optional)
+    :param optimize: When True, optimize the parameters of every prediction (optional)
+    :param batch: When True, share one query and one model between neighbouring sales (optional)
+    :param backend: The fitting backend to be used, one of address.BACKENDS (optional)
+    :param workers: The number of processes the sales are spread across (optional)
+    :param executor: concurrent.futures Executor the sales are spread across (optional)
+    :param name: A name for the configuration, recorded in the report (optional)
+    :param start: The first date of the held-out period, training data is limited to sales before it (optional,
+    default the date of the earliest sale of df)
+    :return: dict of the report
+    """
+    earliest = pd.Timestamp(min(df["Date"])).date() if len(df) else None
+    start = pd.Timestamp(start).date() if start is not None else earliest
+    if earliest is not None and start > earliest:
+        raise ValueError(f"The held-out period starts on {start}, after its earliest sale on {earliest}")
+    ids = frozenset(df["ID"]) if "ID" in df else frozenset()
+    address.reset_counters()
+    rows_cache = access.get_rows_cache()
+    cache_before = rows_cache.stats()
+    t0 = time.perf_counter()
+    price_preds, rs = address.price_predictions(
+        df, args=args, optimize=optimize, batch=batch, backend=backend, workers=workers, executor=executor,
+        holdout=(start, ids) if start is not None else None
+    )
+    elapsed = time.perf_counter() - t0
+    cache_after = rows_cache.stats()
+    counters = dict(address.counters)
+    fetches = counters["cache_hits"] + counters["cache_misses"]
+    return {
+        "name": name,
+        "version": VERSION,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": {
+            "args": list(args) if args is not None else None, "optimize": optimize, "batch": batch,
+            "backend": backend, "workers": workers
+        },
+        "period": {"start": str(min(df["Date"])), "end": str(max(df["Date"]))} if len(df) else None,
+        "training": {"before": str(start), "held_out_ids": len(ids)} if start is not None else None,
+        "accuracy": metrics(df["Price"], price_preds, rs),
+        "throughput": {
+            "seconds": elapsed,
+            "rows_per_second": len(df) / elapsed if elapsed > 0 else None,
+            "db_seconds": counters["db_seconds"],
+            "fit_seconds": counters["fit_seconds"],
+            "fetches": counters["fetches"],
+            "fits": counters["fits"],
+            "queries_saved": counters["queries_saved"],
+            "fits_saved": counters["fits_saved"]
+        },
+        "cache": {
+            "hits": counters["cache_hits"], "misses": counters["cache_misses"],
+            "hit_rate": counters["cache_hits"] / fetches if fetches else None,
+            "evictions": cache_after["evictions"] - cache_before["evictions"],
+            "entries": cache_after["entries"]
+        }
+    }
+
+def write(report, path):
+    """
+    Write a report as JSON
+    :param report: dict of the report, or list of reports
+    :param path: The path of the JSON file
+    """
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2)
+
+def compare(report, baseline, tolerance=0.05):
+    """
+    Compare a report against a baseline report, for example the report of the previous release
+    :param report: dict of the report
+    :param baseline: dict of the baseline report
+    :param tolerance: The relative worsening of a metric that counts as a regression (optional)
+    :return: dict of metric to (baseline, current) for the metrics that regressed
+    """
+    regressions = {}
+    for section, key, lower_is_better in (
+        ("accuracy", "mae", True), ("accuracy", "mape", True), ("accuracy", "coverage", False),
+        ("throughput", "rows_per_second", False)
+    ):
+        old, new = baseline[section][key], report[section][key]
+        if old is None or new is None:
+            continue
+        if (new > old * (1 + tolerance)) if lower_is_better else (new < old * (1 - tolerance)):
+            regressions[f"{section}.{key}"] = (old, new)
+    return regressions
+
+def main(argv=None):
+    """
+    Run a backtest from the command line
+    """
+    parser = argparse.ArgumentParser(description="Backtest fynesse price predictions on a held-out period")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--year", type=int, help="Select the held-out sales from the df_from_year data of this year")
+    source.add_argument("--db", action="store_true", help="Select the held-out sales from prices_coordinates_data")
+    parser.add_argument("--start", required=True, help="The first date of the held-out period, YYYY-MM-DD")
+    parser.add_argument("--end", required=True, help="The date after the last date of the held-out period, YYYY-MM-DD")
+    parser.add_argument("--sample", type=int, default=None, help="The number of sales sampled from the period")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the sampling")
+    parser.add_argument("--args", type=int, nargs=3, default=None, metavar=("KM", "DAYS", "PRECISION"),
+        help="The parameters of the predictions, the default parameters of predict_price when omitted")
+    parser.add_argument("--optimize", action="store_true", help="Optimize the parameters of every prediction")
+    parser.add_argument("--batch", action="store_true", help="Share one model between neighbouring sales")
+    parser.add_argument("--backend", default="statsmodels", choices=address.BACKENDS, help="The fitting backend")
+    parser.add_argument("--workers", type=int, default=None, help="The number of processes predicting sales")
+    parser.add_argument("--name", default=None, help="A name for the configuration")
+    parser.add_argument("--output", default=None, help="The path of the JSON report, printed when omitted")
+    parser.add_argument("--baseline", default=None, help="The path of a JSON report to check for regressions against")
+    args = parser.parse_args(argv)
+
+    df = held_out(args.start, args.end, year=args.year, sample=args.sample, seed=args.seed)
+    report = run(df, args=args.args, optimize=args.optimize, batch=args.batch, backend=args.backend,
+        workers=args.workers, name=args.name, start=args.start)
+    if args.output is not None:
+        write(report, args.output)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            regressions = compare(report, json.load(file))
+        for metric, (old, new) in regressions.items():
+            print(f"Regression in {metric}: {old} -> {new}")
+        if regressions:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
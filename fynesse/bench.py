@@ -0,0 +1,231 @@
+# This file contains a benchmark suite of the hot paths against synthetic data
+
+"""Time the hot paths (assess.labelled, assess.query, access.get_rows_in_bounds, address.predict_price,
+assess.df_from_year and assess.plot_barchart) against synthetic sales at several scales, with a SQLite database
+standing in for MariaDB (see synthetic). Benchmarks follow the asv convention, every time_ function is timed
+after setup, and the results are written as JSON.
+
+The synthetic data of each scale is generated once into its own directory and reused by later runs:
+    python -m fynesse.bench --directory bench --scales 10000 1000000 10000000 --output results.json
+    python -m fynesse.bench --directory bench --scales 10000 --only predict_price get_rows_in_bounds_warm
+
+The cold start of the package is timed separately, importing each module in a fresh interpreter with
+python -X importtime, and the run fails when a module takes longer than the budget:
+    python -m fynesse.bench --imports --import-budget 1.0"""
+
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+import numpy as np
+from . import access, address, assess, synthetic
+
+SCALES = (10000, 1000000, 10000000)
+YEAR = 2020
+ROW_LIMIT = 1000000 # Benchmarks of in-memory rows use at most this many, as tuples of Python objects
+QUERIES = 20 # The number of bounds queried and prices predicted in each repeat
+IMPORT_MODULES = ("fynesse", "fynesse.access", "fynesse.assess", "fynesse.address")
+IMPORT_BUDGET = 1.0 # The seconds each module may take to import in a fresh interpreter
+
+@contextmanager
+def _cwd(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+class Workspace:
+    """
+    The synthetic data of one scale, a SQLite database and a year of CSVs, and the samples used by the benchmarks
+    """
+    def __init__(self, directory, n, seed=0):
+        """
+        :param directory: The directory the data of every scale is kept in
+        :param n: The number of sales
+        :param seed: Seed of the random generator (optional)
+        """
+        self.n = n
+        self.directory = os.path.join(directory, str(n))
+        self.database = os.path.join(self.directory, "pcd.sqlite")
+        os.makedirs(self.directory, exist_ok=True)
+        marker = os.path.join(self.directory, "generated.json")
+        if not os.path.exists(marker):
+            print(f"Generating {n} synthetic sales in {self.directory}")
+            synthetic.sqlite_database(self.database, n, seed=seed, start=f"{YEAR - 2}-01-01", end=f"{YEAR + 1}-01-01")
+            synthetic.write_year_csvs(self.directory, YEAR, n, seed=seed)
+            with open(marker, "w") as file:
+                json.dump({"n": n, "seed": seed}, file)
+        synthetic.use_sqlite(self.database)
+        self.sample = synthetic.generate(min(n, ROW_LIMIT), seed=seed, start=f"{YEAR}-01-01", end=f"{YEAR + 1}-01-01")
+        self.rows = synthetic.rows(self.sample)
+        targets = self.sample.sample(n=QUERIES, random_state=0, replace=len(self.sample) < QUERIES)
+        self.targets = list(zip(targets["Latitude"], targets["Longitude"], targets["Date"].dt.date, targets["Property Type"]))
+        d, t, _ = address.DEFAULT_ARGS
+        self.bounds = [(*address.box(lat, lon, d), *address.window(date, t)) for lat, lon, date, _ in self.targets]
+
+def time_labelled(ws):
+    assess.labelled(ws.rows, address.COLUMNS)
+
+def time_query(ws):
+    assess.query("SELECT * FROM prices_coordinates_data WHERE county = 'NORFOLK'", address.COLUMNS, chunk_size=100000)
+
+def time_get_rows_in_bounds_uncached(ws):
+    for bounds in ws.bounds:
+        access.get_rows_in_bounds(*bounds, cache=False)
+
+def setup_get_rows_in_bounds_warm(ws):
+    access.invalidate_rows_cache()
+    for bounds in ws.bounds:
+        access.get_rows_in_bounds(*bounds)
+
+def time_get_rows_in_bounds_warm(ws):
+    for bounds in ws.bounds:
+        access.get_rows_in_bounds(*bounds)
+
+def setup_predict_price(ws):
+    access.invalidate_rows_cache()
+
+def time_predict_price(ws):
+    for latitude, longitude, date, property_type in ws.targets:
+        address.predict_price(latitude, longitude, date, property_type, backend="ridge")
+
+setup_predict_price_statsmodels = setup_predict_price
+
+def time_predict_price_statsmodels(ws):
+    for latitude, longitude, date, property_type in ws.targets:
+        address.predict_price(latitude, longitude, date, property_type, backend="statsmodels")
+
+def time_df_from_year_csv(ws):
+    with _cwd(ws.directory):
+        assess.df_from_year(YEAR, cache=False)
+
+def setup_df_from_year_parquet(ws):
+    with _cwd(ws.directory):
+        assess.cache_year(YEAR)
+
+def time_df_from_year_parquet(ws):
+    with _cwd(ws.directory):
+        assess.df_from_year(YEAR)
+
+def time_plot_barchart(ws):
+    import matplotlib.pyplot as plt
+    assess.plot_barchart(ws.sample, "Property Type", "Price")
+    plt.close("all")
+
+BENCHMARKS = {name[len("time_"):]: function for name, function in globals().items() if name.startswith("time_")}
+
+def run(scales=SCALES, directory="bench", repeat=3, only=None, seed=0):
+    """
+    Run the benchmarks at each scale
+    :param scales: The numbers of synthetic sales to benchmark against (optional)
+    :param directory: The directory the synthetic data is generated in and reused from (optional)
+    :param repeat: The number of times each benchmark is timed (optional)
+    :param only: The names of the benchmarks to be run, without the time_ prefix (optional, default every benchmark)
+    :param seed: Seed of the synthetic data (optional)
+    :return: list of dicts of the benchmark, scale, rows used and the min, median and max seconds taken
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    names = list(BENCHMARKS) if only is None else list(only)
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError(f"No benchmark named {name}, choose from {list(BENCHMARKS)}")
+    results = []
+    for n in scales:
+        ws = Workspace(directory, n, seed=seed)
+        for name in names:
+            setup = globals().get(f"setup_{name}")
+            times = []
+            for _ in range(repeat):
+                if setup is not None:
+                    setup(ws)
+                t0 = time.perf_counter()
+                BENCHMARKS[name](ws)
+                times.append(time.perf_counter() - t0)
+            result = {
+                "benchmark": name, "scale": n, "rows": len(ws.rows) if name in ("labelled", "plot_barchart") else n,
+                "min": min(times), "median": float(np.median(times)), "max": max(times)
+            }
+            print(f"{name} at {n} rows: {result['min']:.4f}s")
+            results.append(result)
+        access.close_pool()
+    return results
+
+def import_time(module):
+    """
+    Time the import of a module in a fresh interpreter with python -X importtime
+    :param module: The name of the module
+    :return: tuple of the seconds taken, and list of (seconds, name) of the imports that took longest themselves
+    """
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (package_dir, os.environ.get("PYTHONPATH")))))
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env)
+    if process.returncode != 0:
+        raise ValueError(f"Importing {module} failed:\n{process.stderr}")
+    total, imports = 0.0, []
+    # Lines are "import time: self [us] | cumulative | imported package", the top level import last
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((int(own) / 1e6, name.strip()))
+        if name.strip() == module:
+            total = int(cumulative) / 1e6
+    return total, sorted(imports, reverse=True)[:10]
+
+def imports(modules=IMPORT_MODULES, repeat=3, budget=IMPORT_BUDGET):
+    """
+    Time the cold start of each module, see import_time
+    :param modules: The names of the modules to be imported (optional)
+    :param repeat: The number of times each module is imported, the shortest time is reported (optional)
+    :param budget: The seconds each module may take to import (optional)
+    :return: list of dicts of the module, the min and max seconds taken, whether it is within the budget, and the
+    imports that took longest in the fastest run
+    """
+    results = []
+    for module in modules:
+        runs = [import_time(module) for _ in range(repeat)]
+        total, slowest = min(runs)
+        result = {
+            "benchmark": "import", "module": module, "min": total, "max": max(t for t, _ in runs),
+            "budget": budget, "within_budget": total <= budget,
+            "slowest": [{"module": name, "seconds": seconds} for seconds, name in slowest]
+        }
+        print(f"import {module}: {total:.4f}s{'' if result['within_budget'] else f' over the budget of {budget}s'}")
+        results.append(result)
+    return results
+
+def main(argv=None):
+    """
+    Run the benchmark suite from the command line
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the fynesse hot paths against synthetic data")
+    parser.add_argument("--directory", default="bench", help="The directory the synthetic data is kept in")
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES, help="The numbers of synthetic sales")
+    parser.add_argument("--repeat", type=int, default=3, help="The number of times each benchmark is timed")
+    parser.add_argument("--only", nargs="+", default=None, choices=list(BENCHMARKS), help="The benchmarks to be run")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument("--output", default=None, help="The path of the JSON results")
+    parser.add_argument("--imports", action="store_true", help="Time the cold start of the package instead")
+    parser.add_argument("--modules", nargs="+", default=IMPORT_MODULES, help="The modules whose imports are timed")
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET, help="The seconds each import may take")
+    args = parser.parse_args(argv)
+    if args.imports:
+        results = imports(args.modules, repeat=args.repeat, budget=args.import_budget)
+    else:
+        results = run(args.scales, args.directory, repeat=args.repeat, only=args.only, seed=args.seed)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump({"created": datetime.datetime.now().isoformat(timespec="seconds"), "results": results}, file, indent=2)
+    if args.imports and not all(result["within_budget"] for result in results):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,129 @@
 import os
-import yaml
+import threading
 
 default_file = os.path.join(os.path.dirname(__file__), "defaults.yml")
 local_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "machine.yml"))
 user_file = '_config.yml'
 
-config = {}
-
-if os.path.exists(default_file):
-    with open(default_file) as file:
-        config.update(yaml.load(file, Loader=yaml.FullLoader))
-
-if os.path.exists(local_file):
-    with open(local_file) as file:
-        config.update(yaml.load(file, Loader=yaml.FullLoader))
-
-if os.path.exists(user_file):
-    with open(user_file) as file:
-        config.update(yaml.load(file, Loader=yaml.FullLoader))
-
-if config=={}:
-    raise ValueError(
-        "No configuration file found at either "
-        + user_file
-        + " or "
-        + local_file
-        + " or "
-        + default_file
-        + "."
-    )
-
-for key, item in config.items():
-    if item is str:
-        config[key] = os.path.expandvars(item)
+def load_config(required=True):
+    """
+    Read the configuration files, later files overriding earlier ones
+    :param required: When True, raise a ValueError if no configuration file is found (optional)
+    :return: dict of the configuration
+    """
+    import yaml
+    loaded = {}
+
+    if os.path.exists(default_file):
+        with open(default_file) as file:
+            loaded.update(yaml.load(file, Loader=yaml.FullLoader))
+
+    if os.path.exists(local_file):
+        with open(local_file) as file:
+            loaded.update(yaml.load(file, Loader=yaml.FullLoader))
+
+    if os.path.exists(user_file):
+        with open(user_file) as file:
+            loaded.update(yaml.load(file, Loader=yaml.FullLoader))
+
+    if required and loaded=={}:
+        raise ValueError(
+            "No configuration file found at either "
+            + user_file
+            + " or "
+            + local_file
+            + " or "
+            + default_file
+            + "."
+        )
+
+    for key, item in loaded.items():
+        if item is str:
+            loaded[key] = os.path.expandvars(item)
+    return loaded
+
+class Config(dict):
+    """
+    The configuration mapping, read from the configuration files on first access rather than on import, so
+    importing the package does not parse YAML or fail when no configuration file exists
+    Keys set before the first access override the files, and no file is required when keys have been set
+    """
+    _loaded = False
+    _lock = threading.RLock()
+
+    def _load(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                overrides = dict(super().items())
+                super().update(load_config(required=not overrides))
+                super().update(overrides)
+                self._loaded = True
+
+    def __getitem__(self, key):
+        self._load()
+        return super().__getitem__(key)
+
+    def __delitem__(self, key):
+        self._load()
+        super().__delitem__(key)
+
+    def __contains__(self, key):
+        self._load()
+        return super().__contains__(key)
+
+    def __iter__(self):
+        self._load()
+        return super().__iter__()
+
+    def __len__(self):
+        self._load()
+        return super().__len__()
+
+    def __repr__(self):
+        self._load()
+        return super().__repr__()
+
+    def __eq__(self, other):
+        self._load()
+        return super().__eq__(other)
+
+    def get(self, key, default=None):
+        self._load()
+        return super().get(key, default)
+
+    def keys(self):
+        self._load()
+        return super().keys()
+
+    def values(self):
+        self._load()
+        return super().values()
+
+    def items(self):
+        self._load()
+        return super().items()
+
+    def setdefault(self, key, default=None):
+        self._load()
+        return super().setdefault(key, default)
+
+    def pop(self, key, *default):
+        self._load()
+        return super().pop(key, *default)
+
+    def copy(self):
+        self._load()
+        return dict(self.items())
+
+    def reload(self):
+        """
+        Read the configuration files again, dropping keys set since the first access
+        """
+        with self._lock:
+            super().clear()
+            self._loaded = False
+            self._load()
+
+config = Config()
@@ -0,0 +1,195 @@
+# This file contains code for building design matrices for the address models
+
+"""Vectorized encoding of dates, categories and geohashes into design matrices. Every function works on whole
+columns at once, so the cost of building a design matrix grows linearly in the number of rows."""
+
+import time
+import numpy as np
+import pandas as pd
+from . import instrument
+
+BASE32 = np.frombuffer(b"0123456789bcdefghjkmnpqrstuvwxyz", dtype=np.uint8)
+ORDINAL_EPOCH = 719163 # datetime.date(1970, 1, 1).toordinal()
+
+def ordinals(dates):
+    """
+    Convert dates to proleptic Gregorian ordinals (as date.toordinal()) using datetime64 arithmetic
+    :param dates: Sequence of dates (datetime objects, strings or datetime64 values)
+    :return: int64 numpy array of ordinals
+    """
+    days = np.asarray(pd.to_datetime(pd.Series(dates)).values, dtype="datetime64[D]")
+    return days.astype(np.int64) + ORDINAL_EPOCH
+
+def _quantize(values, low, high, bits):
+    """
+    Find the index of the interval each value falls in when [low, high] is bisected bits times, values on a
+    midpoint fall in the upper half as they do when pygeohash encodes a geohash
+    The intervals are bisected as pygeohash bisects them, so values within rounding of a midpoint agree with it
+    """
+    values = np.asarray(values, dtype=np.float64)
+    lows = np.full(values.shape, low, dtype=np.float64)
+    highs = np.full(values.shape, high, dtype=np.float64)
+    index = np.zeros(values.shape, dtype=np.uint64)
+    for _ in range(bits):
+        mids = (lows + highs) / 2
+        upper = values >= mids
+        index = (index << np.uint64(1)) | upper.astype(np.uint64)
+        lows = np.where(upper, mids, lows)
+        highs = np.where(upper, highs, mids)
+    return index
+
+def geohash_codes(latitudes, longitudes, precision):
+    """
+    Encode coordinates as the integers whose base 32 digits are the characters of their geohashes, sorting by these
+    integers orders coordinates along the Z-order curve
+    :param latitudes: Sequence of latitudes
+    :param longitudes: Sequence of longitudes
+    :param precision: The precision of the geohash, at most 12
+    :return: uint64 numpy array of geohash integers
+    """
+    if not 0 < precision <= 12:
+        raise ValueError(f"Geohash precision must be between 1 and 12, not {precision}")
+    n_bits = 5 * precision
+    lon_bits, lat_bits = (n_bits + 1) // 2, n_bits // 2
+    lon_q = _quantize(longitudes, -180.0, 180.0, lon_bits)
+    lat_q = _quantize(latitudes, -90.0, 90.0, lat_bits)
+
+    #Interleave the bits, starting with the most significant longitude bit
+    code = np.zeros(len(lon_q), dtype=np.uint64)
+    for i in range(n_bits):
+        if i % 2 == 0:
+            bit = (lon_q >> np.uint64(lon_bits - 1 - i // 2)) & np.uint64(1)
+        else:
+            bit = (lat_q >> np.uint64(lat_bits - 1 - i // 2)) & np.uint64(1)
+        code = (code << np.uint64(1)) | bit
+    return code
+
+@instrument.timed("design.geohashes")
+def geohashes(latitudes, longitudes, precision):
+    """
+    Encode coordinates as geohashes in bulk, equivalent to pygeohash.encode applied to each coordinate
+    :param latitudes: Sequence of latitudes
+    :param longitudes: Sequence of longitudes
+    :param precision: The precision of the geohash, at most 12
+    :return: numpy array of geohash strings
+    """
+    code = geohash_codes(latitudes, longitudes, precision)
+    shifts = np.arange(precision - 1, -1, -1, dtype=np.uint64) * np.uint64(5)
+    chars = BASE32[((code[:, None] >> shifts) & np.uint64(31)).astype(np.intp)]
+    return np.ascontiguousarray(chars).view(f"S{precision}").ravel().astype(str)
+
+def geohash(latitude, longitude, precision):
+    """
+    Encode one coordinate as a geohash, with the same bisection as geohashes so that a target and its training
+    data are always in the same cell
+    :param latitude: The latitude
+    :param longitude: The longitude
+    :param precision: The precision of the geohash, at most 12
+    :return: The geohash string
+    """
+    return str(geohashes([latitude], [longitude], precision)[0])
+
+def categorical_codes(values, categories=None):
+    """
+    Encode values as integer codes into a set of categories
+    :param values: Sequence of category values
+    :param categories: The categories to be encoded, values not among them are coded -1 (optional, default the
+    unique values in order of appearance)
+    :return: tuple of int64 numpy array of codes and numpy array of categories
+    """
+    if categories is None:
+        codes, categories = pd.factorize(pd.Series(values))
+        return codes.astype(np.int64), np.asarray(categories)
+    categories = np.asarray(categories)
+    codes = pd.Categorical(values, categories=pd.unique(categories)).codes
+    return codes.astype(np.int64), categories
+
+def one_hot(codes, n_categories, sparse=False):
+    """
+    Build the one-hot block of a column of integer codes, rows with code -1 are left empty
+    :param codes: Sequence of integer codes
+    :param n_categories: The number of categories, the width of the block
+    :param sparse: When True, return a scipy.sparse CSR matrix rather than a dense array (optional)
+    :return: The one-hot block with one row per code
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    rows = np.flatnonzero(codes >= 0)
+    if sparse:
+        from scipy import sparse as sp
+        return sp.csr_matrix(
+            (np.ones(len(rows), dtype=np.float64), (rows, codes[rows])), shape=(len(codes), n_categories)
+        )
+    block = np.zeros((len(codes), n_categories), dtype=np.float64)
+    block[rows, codes[rows]] = 1
+    return block
+
+@instrument.timed("design.design_matrix")
+def design_matrix(dates, property_types, geohash_values, encodings, property_categories=("F", "S", "D", "T", "O"), sparse=False):
+    """
+    Build the design matrix of date ordinal, property type one-hot and geohash one-hot columns
+    :param dates: Sequence of sale dates
+    :param property_types: Sequence of property type enums
+    :param geohash_values: Sequence of geohashes of the sales
+    :param encodings: The geohashes that make up the geohash one-hot block
+    :param property_categories: The property types that make up the property type one-hot block (optional)
+    :param sparse: When True, return a scipy.sparse CSR matrix rather than a dense array (optional)
+    :return: The design matrix with one row per sale
+    """
+    date_col = ordinals(dates).astype(np.float64).reshape(-1, 1)
+    pt_codes, _ = categorical_codes(property_types, property_categories)
+    gh_codes, _ = categorical_codes(geohash_values, encodings)
+    pt_block = one_hot(pt_codes, len(property_categories), sparse=sparse)
+    gh_block = one_hot(gh_codes, len(encodings), sparse=sparse)
+    if sparse:
+        from scipy import sparse as sp
+        return sp.hstack((sp.csr_matrix(date_col), pt_block, gh_block), format="csr")
+    return np.concatenate((date_col, pt_block, gh_block), axis=1)
+
+def _loop_design_matrix(df, precision):
+    """
+    Build the design matrix with per-row Python loops, as the address models did before this module
+    """
+    import pygeohash as gh
+    df["Geohash"] = df.apply(lambda x: gh.encode(x["Latitude"], x["Longitude"], precision=precision), axis=1)
+    property_type_oh = np.array([np.array([
+        1 if p == t else 0 for t in ("F", "S", "D", "T", "O")
+        ]) for p in df["Property Type"]])
+    geohash_oh = np.array([np.array([
+        1 if g == encoding else 0 for encoding in df["Geohash"].unique()
+    ]) for g in df["Geohash"]])
+    np_ord = np.vectorize(lambda x: x.toordinal())
+    return np.concatenate((np_ord(df["Date"]).reshape(-1, 1), property_type_oh, geohash_oh), axis=1)
+
+def benchmark(n=50000, precision=5, baseline_rows=5000, seed=0):
+    """
+    Time the vectorized design matrix against the per-row loops it replaces on synthetic sales
+    The loops are quadratic in the number of rows, so they are timed on at most baseline_rows rows
+    :param n: The number of rows for the vectorized build
+    :param precision: The precision of the geohash to be used (optional)
+    :param baseline_rows: The number of rows for the per-row build (optional)
+    :param seed: Seed of the random generator (optional)
+    :return: dict of the number of rows, seconds taken and rows per second for each build
+    """
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2020-01-01").toordinal()
+    df = pd.DataFrame({
+        "Latitude": 51.5 + rng.normal(0, 0.05, n),
+        "Longitude": -0.12 + rng.normal(0, 0.08, n),
+        "Date": [pd.Timestamp.fromordinal(int(o)).date() for o in start + rng.integers(0, 730, n)],
+        "Property Type": rng.choice(list("FSDTO"), n),
+    })
+    results = {}
+
+    t0 = time.perf_counter()
+    geohash_values = geohashes(df["Latitude"], df["Longitude"], precision)
+    design_matrix(df["Date"], df["Property Type"], geohash_values, pd.unique(geohash_values))
+    elapsed = time.perf_counter() - t0
+    results["vectorized"] = {"rows": n, "seconds": elapsed, "rows_per_second": n / elapsed}
+
+    m = min(n, baseline_rows)
+    t0 = time.perf_counter()
+    _loop_design_matrix(df.iloc[:m].copy(), precision)
+    elapsed = time.perf_counter() - t0
+    results["loops"] = {"rows": m, "seconds": elapsed, "rows_per_second": m / elapsed}
+    results["speedup"] = results["vectorized"]["rows_per_second"] / results["loops"]["rows_per_second"]
+    return results
@@ -0,0 +1,231 @@
+# This file contains a local spatio-temporal index of the price-coordinates data
+
+"""A columnar snapshot of prices_coordinates_data, sorted along the Z-order curve and stored as one memory-mapped
+.npy file per column. The rows are split into blocks whose latitude, longitude and date ranges are recorded, so a
+bounding box query only reads the blocks that can intersect it, without a round trip to the database.
+
+Build a snapshot with build_from_db or build_from_years, or from the command line:
+    python -m fynesse.index DIRECTORY --db
+    python -m fynesse.index DIRECTORY --years 2019 2020 2021
+and set "index_dir" in the config mapping to answer access.get_rows_in_bounds from it. access.upload_file marks the
+snapshot stale, and get_rows_in_bounds queries the database until the snapshot is built again."""
+
+import os
+import json
+import argparse
+import datetime
+import numpy as np
+import pandas as pd
+from . import access, design
+
+# Column names of the snapshot built from the df_from_year CSVs, in the order of the prices_coordinates_data table
+CSV_COLUMNS = ("postcode", "price", "date_of_transfer", "property_type", "new_build_flag", "tenure_type",
+    "locality", "town_city", "district", "county", "positional_quality_indicator",
+    "country", "latitude", "longitude", "db_id")
+ZORDER_PRECISION = 8
+META_FILE = "meta.json"
+BLOCKS_FILE = "blocks.npy"
+STALE_FILE = "stale"
+
+def _encode(values):
+    """
+    Convert a column to an array that can be memory-mapped, returning the array and the kind of the column
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values) or (len(values) > 0 and isinstance(values.iloc[0], datetime.date)):
+        return design.ordinals(values), "date"
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        return values.to_numpy(), "number"
+    strings = values.astype(object).where(values.notna(), "").astype(str).to_numpy(dtype=str)
+    return np.char.encode(strings, "utf-8"), "string"
+
+def build(columns, directory, block_size=4096):
+    """
+    Write columns of price-coordinates data as a snapshot, sorted by Z-order and then by date
+    :param columns: dict of column name to sequence of values, must include latitude, longitude and date_of_transfer
+    :param directory: The directory the snapshot is written to
+    :param block_size: The number of rows in each block (optional)
+    :return: SpatialIndex of the snapshot
+    """
+    for required in ("latitude", "longitude", "date_of_transfer"):
+        if required not in columns:
+            raise ValueError(f"Columns must include '{required}'")
+    lats = np.asarray(columns["latitude"], dtype=np.float64)
+    lons = np.asarray(columns["longitude"], dtype=np.float64)
+    ords = design.ordinals(columns["date_of_transfer"])
+    order = np.lexsort((ords, design.geohash_codes(lats, lons, ZORDER_PRECISION)))
+
+    os.makedirs(directory, exist_ok=True)
+    kinds = {}
+    for name, values in columns.items():
+        array, kinds[name] = (ords, "date") if name == "date_of_transfer" else _encode(values)
+        np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array[order]))
+
+    lats, lons, ords = lats[order], lons[order], ords[order]
+    starts = np.arange(0, len(order), block_size)
+    if len(order) > 0:
+        blocks = np.column_stack([
+            np.minimum.reduceat(lats, starts), np.maximum.reduceat(lats, starts),
+            np.minimum.reduceat(lons, starts), np.maximum.reduceat(lons, starts),
+            np.minimum.reduceat(ords, starts), np.maximum.reduceat(ords, starts)
+        ])
+    else:
+        blocks = np.empty((0, 6))
+    np.save(os.path.join(directory, BLOCKS_FILE), blocks)
+    with open(os.path.join(directory, META_FILE), "w") as file:
+        json.dump({"columns": list(columns), "kinds": kinds, "block_size": block_size, "rows": int(len(order))}, file)
+    if is_stale(directory):
+        os.remove(os.path.join(directory, STALE_FILE))
+    return SpatialIndex(directory)
+
+def mark_stale(directory):
+    """
+    Mark a snapshot as behind the database, for example after rows were uploaded
+    :param directory: The directory of the snapshot
+    """
+    if os.path.isdir(directory):
+        with open(os.path.join(directory, STALE_FILE), "w") as file:
+            file.write(datetime.datetime.now().isoformat(timespec="seconds"))
+
+def is_stale(directory):
+    """
+    :param directory: The directory of the snapshot
+    :return: True if the snapshot was marked stale since it was built
+    """
+    return os.path.exists(os.path.join(directory, STALE_FILE))
+
+def build_from_db(directory, block_size=4096, chunk_size=100000, conn=None):
+    """
+    Export prices_coordinates_data from the database into a snapshot, the whole table is held in memory to be sorted
+    :param directory: The directory the snapshot is written to
+    :param block_size: The number of rows in each block (optional)
+    :param chunk_size: The number of rows streamed from the database at once (optional)
+    :param conn: The connection object (optional)
+    :return: SpatialIndex of the snapshot
+    """
+    chunks = list(access.stream_query("SELECT * FROM prices_coordinates_data", chunk_size=chunk_size, conn=conn))
+    if len(chunks) == 0:
+        raise ValueError("No data in prices_coordinates_data")
+    df = pd.concat(chunks, ignore_index=True)
+    return build({name: df[name] for name in df.columns}, directory, block_size=block_size)
+
+def build_from_years(directory, years, block_size=4096):
+    """
+    Build a snapshot from the df_from_year CSVs of the given years
+    :param directory: The directory the snapshot is written to
+    :param years: The years of data to be included
+    :param block_size: The number of rows in each block (optional)
+    :return: SpatialIndex of the snapshot
+    """
+    from . import assess
+    df = pd.concat([assess.df_from_year(year) for year in years], ignore_index=True)
+    df["ID"] = np.arange(len(df))
+    return build({name: df[column] for name, column in zip(CSV_COLUMNS, df.columns)}, directory, block_size=block_size)
+
+class SpatialIndex:
+    """
+    Memory-mapped snapshot of price-coordinates data answering bounding box queries in process
+    """
+    def __init__(self, directory):
+        """
+        :param directory: The directory of a snapshot written by build
+        """
+        with open(os.path.join(directory, META_FILE)) as file:
+            meta = json.load(file)
+        self.directory = directory
+        self.names = meta["columns"]
+        self.kinds = meta["kinds"]
+        self.block_size = meta["block_size"]
+        self.n_rows = meta["rows"]
+        self.blocks = np.load(os.path.join(directory, BLOCKS_FILE))
+        self.columns = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in self.names}
+
+    def __len__(self):
+        return self.n_rows
+
+    def select(self, north, south, west, east, latest_date, earliest_date):
+        """
+        Find the positions of the rows strictly within the specified bounds, reading only the blocks that intersect them
+        :param north: Maximum latitude
+        :param south: Minimum latitude
+        :param west: Minimum longitude
+        :param east: Maximum longitude
+        :param latest_date: Maximum date
+        :param earliest_date: Minimum date
+        :return: int64 numpy array of row positions, in snapshot order
+        """
+        latest, earliest = latest_date.toordinal(), earliest_date.toordinal()
+        b = self.blocks
+        candidates = np.flatnonzero(
+            (b[:, 0] < north) & (b[:, 1] > south) & (b[:, 2] < east) & (b[:, 3] > west)
+            & (b[:, 4] < latest) & (b[:, 5] > earliest)
+        )
+        if len(candidates) == 0:
+            return np.empty(0, dtype=np.int64)
+        positions = np.concatenate([
+            np.arange(i * self.block_size, min((i + 1) * self.block_size, self.n_rows)) for i in candidates
+        ])
+        lats = self.columns["latitude"][positions]
+        lons = self.columns["longitude"][positions]
+        ords = self.columns["date_of_transfer"][positions]
+        return positions[access.in_bounds(lats, lons, ords, north, south, west, east, latest, earliest)]
+
+    def query(self, north, south, west, east, latest_date, earliest_date, columns=None):
+        """
+        Get the columns of the rows strictly within the specified bounds
+        Dates are returned as int64 ordinals and strings as utf-8 bytes, as they are stored
+        :param north: Maximum latitude
+        :param south: Minimum latitude
+        :param west: Minimum longitude
+        :param east: Maximum longitude
+        :param latest_date: Maximum date
+        :param earliest_date: Minimum date
+        :param columns: The names of the columns to be returned (optional, default every column)
+        :return: dict of column name to numpy array
+        """
+        positions = self.select(north, south, west, east, latest_date, earliest_date)
+        return {name: self.columns[name][positions] for name in (columns if columns is not None else self.names)}
+
+    def rows(self, north, south, west, east, latest_date, earliest_date, limit=None):
+        """
+        Get the rows strictly within the specified bounds, as access.get_rows_in_bounds returns them
+        :param north: Maximum latitude
+        :param south: Minimum latitude
+        :param west: Minimum longitude
+        :param east: Maximum longitude
+        :param latest_date: Maximum date
+        :param earliest_date: Minimum date
+        :param limit: The maximum number of rows to be returned (optional)
+        :return: tuple tuple of the rows, in the column order of the snapshot
+        """
+        positions = self.select(north, south, west, east, latest_date, earliest_date)[:limit]
+        columns = []
+        for name in self.names:
+            values = self.columns[name][positions]
+            if self.kinds[name] == "date":
+                columns.append([datetime.date.fromordinal(int(o)) for o in values])
+            elif self.kinds[name] == "string":
+                columns.append(np.char.decode(values, "utf-8").tolist())
+            else:
+                columns.append(values.tolist())
+        return tuple(zip(*columns))
+
+def main(argv=None):
+    """
+    Build a snapshot from the command line
+    """
+    parser = argparse.ArgumentParser(description="Build a local spatio-temporal index of prices_coordinates_data")
+    parser.add_argument("directory", help="The directory the snapshot is written to")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--db", action="store_true", help="Export prices_coordinates_data from the database")
+    source.add_argument("--years", type=int, nargs="+", help="Build from the pcd/pc-{year}-part{n}.csv files")
+    parser.add_argument("--block-size", type=int, default=4096, help="The number of rows in each block")
+    args = parser.parse_args(argv)
+    if args.db:
+        index = build_from_db(args.directory, block_size=args.block_size)
+    else:
+        index = build_from_years(args.directory, args.years, block_size=args.block_size)
+    print(f"Indexed {len(index)} rows in {len(index.blocks)} blocks at {args.directory}")
+
+if __name__ == "__main__":
+    main()
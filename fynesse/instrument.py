@@ -0,0 +1,316 @@
+# This file contains the timing instrumentation of access, assess and address
+
+"""Named timing spans around the stages of the package, with counts of rows, bytes and cache hits. Instrumentation
+is enabled with the "instrument" config key (or enable()), when it is disabled a span costs one function call.
+
+Every span is added to a histogram of its durations (see summary), and the spans and counts of a traced call,
+such as address.predict_price, are kept as a per-call trace dictionary (see traces):
+    instrument.enable()
+    address.predict_price(51.5, -0.12, datetime.date(2021, 6, 1), "F")
+    instrument.traces[-1]     # {"name": "address.predict_price", "seconds": ..., "spans": [...], "counts": {...}}
+    instrument.summary()      # {"spans": {"access.get_rows_in_bounds": {"count": ..., "p50": ...}}, "counts": {...}}
+
+Setting the "instrument_profile" config key (or the profile of enable) to "cprofile" or "pyinstrument" also
+profiles each traced call, the profile is kept in the "profile" entry of its trace. capture profiles any block of
+code, whether or not instrumentation is enabled."""
+
+import functools
+import io
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+BUCKETS_PER_DECADE = 10
+SMALLEST = 1e-6 # Durations are bucketed from a microsecond
+N_BUCKETS = 8 * BUCKETS_PER_DECADE + 1 # to 100 seconds
+
+_enabled = None
+_profile = None
+_local = threading.local()
+_lock = threading.Lock()
+histograms = {}
+counts = {}
+traces = deque(maxlen=100)
+
+def enabled():
+    """
+    :return: True if instrumentation is enabled, read from the "instrument" config key until enable is called
+    """
+    global _enabled, _profile, traces
+    if _enabled is None:
+        from .config import config
+        _profile = config.get("instrument_profile")
+        traces = deque(traces, maxlen=config.get("instrument_traces", 100))
+        _enabled = bool(config.get("instrument", False))
+    return _enabled
+
+def enable(flag=True, profile=None):
+    """
+    Enable or disable instrumentation, overriding the "instrument" and "instrument_profile" config keys
+    :param flag: True to enable instrumentation (optional)
+    :param profile: "cprofile" or "pyinstrument" to also profile every traced call (optional)
+    """
+    global _enabled, _profile
+    if profile not in (None, "cprofile", "pyinstrument"):
+        raise ValueError(f"Profile engine must be 'cprofile' or 'pyinstrument', not {profile}")
+    enabled()
+    _enabled = flag
+    _profile = profile
+
+def reset():
+    """
+    Remove every histogram, count and trace recorded so far
+    """
+    with _lock:
+        histograms.clear()
+        counts.clear()
+        traces.clear()
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+class Trace:
+    """
+    The spans and counts of one traced call
+    """
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.spans = []
+        self.counts = {}
+        self.profile = None
+        self.start = time.perf_counter()
+        self.seconds = None
+
+    def to_dict(self):
+        """
+        :return: dict of the name, seconds, spans (name, start offset, seconds, depth and fields) and counts
+        """
+        # Spans are recorded as they end, so are sorted back into the order they started
+        spans = sorted(self.spans, key=lambda span: span["start"])
+        trace = {"name": self.name, **self.fields, "seconds": self.seconds, "spans": spans, "counts": self.counts}
+        if self.profile is not None:
+            trace["profile"] = self.profile
+        return trace
+
+class _Span:
+    __slots__ = ("name", "fields", "trace", "start", "depth")
+
+    def __init__(self, name, fields, trace=False):
+        self.name = name
+        self.fields = fields
+        self.trace = trace
+
+    def __enter__(self):
+        stack = _stack()
+        if self.trace and getattr(_local, "trace", None) is None:
+            _local.trace = Trace(self.name, self.fields)
+            _local.profiler = _start_profile(_profile)
+        else:
+            self.trace = False
+        self.depth = len(stack)
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        _stack().pop()
+        _record(self.name, seconds)
+        trace = getattr(_local, "trace", None)
+        if trace is not None:
+            trace.spans.append({"name": self.name, "start": self.start - trace.start, "seconds": seconds,
+                "depth": self.depth, **self.fields})
+        if self.trace:
+            trace.seconds = seconds
+            trace.profile = _stop_profile(_local.profiler)
+            _local.trace = _local.profiler = None
+            with _lock:
+                traces.append(trace.to_dict())
+        return False
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+def span(name, **fields):
+    """
+    Time a block of code as a named span, used as a with statement
+    :param name: The name of the span, for example "access.get_rows_in_bounds"
+    :param fields: Values recorded with the span in traces (optional)
+    :return: Context manager
+    """
+    if not (_enabled if _enabled is not None else enabled()):
+        return _NULL_SPAN
+    return _Span(name, fields)
+
+def trace(name, **fields):
+    """
+    Time a block of code as a named span and keep its nested spans and counts as a trace in traces
+    Within another trace it is a span of that trace
+    :param name: The name of the trace
+    :param fields: Values recorded with the trace (optional)
+    :return: Context manager
+    """
+    if not (_enabled if _enabled is not None else enabled()):
+        return _NULL_SPAN
+    return _Span(name, fields, trace=True)
+
+def timed(name):
+    """
+    Decorate a function so that every call is timed as a span
+    :param name: The name of the span
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def traced(name):
+    """
+    Decorate a function so that every call is timed and kept as a trace, see trace
+    :param name: The name of the trace
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with trace(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, value=1):
+    """
+    Add to a named count, for example of the rows fetched or of cache hits, in the totals and the current trace
+    :param name: The name of the count
+    :param value: The amount added (optional)
+    """
+    if not (_enabled if _enabled is not None else enabled()):
+        return
+    with _lock:
+        counts[name] = counts.get(name, 0) + value
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.counts[name] = trace.counts.get(name, 0) + value
+
+def fetched(rows):
+    """
+    Count the rows fetched by a query and an estimate of their bytes, from the text width of the first row
+    :param rows: tuple tuple of the rows fetched
+    """
+    if not (_enabled if _enabled is not None else enabled()):
+        return
+    count("rows_fetched", len(rows))
+    if len(rows) > 0:
+        count("bytes_fetched", len(rows) * sum(len(str(value)) for value in rows[0]))
+
+def _record(name, seconds):
+    bucket = 0 if seconds <= SMALLEST else min(int(math.log10(seconds / SMALLEST) * BUCKETS_PER_DECADE) + 1, N_BUCKETS - 1)
+    with _lock:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = {"count": 0, "total": 0.0, "min": seconds, "max": seconds, "buckets": [0] * N_BUCKETS}
+        histogram["count"] += 1
+        histogram["total"] += seconds
+        histogram["min"] = min(histogram["min"], seconds)
+        histogram["max"] = max(histogram["max"], seconds)
+        histogram["buckets"][bucket] += 1
+
+def _percentile(histogram, q):
+    """
+    The upper edge of the bucket holding the qth quantile of the durations, within the shortest and longest durations
+    """
+    rank = q * histogram["count"]
+    seen = 0
+    for bucket, n in enumerate(histogram["buckets"]):
+        seen += n
+        if seen >= rank and n > 0:
+            return max(min(SMALLEST * 10 ** (bucket / BUCKETS_PER_DECADE), histogram["max"]), histogram["min"])
+    return histogram["max"]
+
+def summary():
+    """
+    Aggregate the spans recorded so far
+    :return: dict of the count, total, mean, min, p50, p90, p99 and max seconds of each span, and the total counts
+    """
+    with _lock:
+        spans = {}
+        for name, histogram in sorted(histograms.items()):
+            spans[name] = {
+                "count": histogram["count"], "total": histogram["total"],
+                "mean": histogram["total"] / histogram["count"], "min": histogram["min"],
+                "p50": _percentile(histogram, 0.5), "p90": _percentile(histogram, 0.9),
+                "p99": _percentile(histogram, 0.99), "max": histogram["max"]
+            }
+        return {"spans": spans, "counts": dict(counts)}
+
+def _start_profile(engine):
+    if engine is None:
+        return None
+    if engine == "cprofile":
+        import cProfile
+        profiler = cProfile.Profile()
+    elif engine == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError("The pyinstrument profile requires the pyinstrument package, pip install pyinstrument")
+        profiler = Profiler()
+    else:
+        raise ValueError(f"Profile engine must be 'cprofile' or 'pyinstrument', not {engine}")
+    profiler.enable() if engine == "cprofile" else profiler.start()
+    return profiler
+
+def _stop_profile(profiler, limit=30):
+    if profiler is None:
+        return None
+    profiler.stop() if hasattr(profiler, "output_text") else profiler.disable()
+    return _profile_text(profiler, limit)
+
+def _profile_text(profiler, limit=30):
+    """
+    The text of a stopped profiler, the call tree of pyinstrument or the limit slowest cumulative cProfile entries
+    """
+    if hasattr(profiler, "output_text"):
+        return profiler.output_text()
+    import pstats
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(limit)
+    return output.getvalue()
+
+@contextmanager
+def capture(engine="cprofile", path=None):
+    """
+    Profile a block of code, whether or not instrumentation is enabled
+    :param engine: "cprofile" or "pyinstrument" (optional)
+    :param path: The path the profile is written to, cProfile stats or pyinstrument HTML (optional)
+    :return: dict whose "profile" entry holds the text of the profile after the block
+    """
+    result = {}
+    profiler = _start_profile(engine)
+    try:
+        yield result
+    finally:
+        # The profiler is stopped once, then written and rendered as text, pyinstrument raises if stopped twice
+        profiler.disable() if engine == "cprofile" else profiler.stop()
+        if path is not None and engine == "cprofile":
+            profiler.dump_stats(path)
+        elif path is not None:
+            with open(path, "w") as file:
+                file.write(profiler.output_html())
+        result["profile"] = _profile_text(profiler)
@@ -0,0 +1,229 @@
+# This file contains a local store of OpenStreetMap features
+
+"""An in-memory store of points of interest loaded from an OpenStreetMap extract (.osm, .pbf or GeoJSON), so that
+access.local_features and access.count_local_features can be answered offline without an Overpass request per
+location. Features are reduced to a single point (nodes as they are, ways and polygons by their centroid) and
+indexed with a uniform grid of cells."""
+
+import os
+import xml.etree.ElementTree as ET
+import numpy as np
+import pandas as pd
+
+# The features selected by access.local_features, a key maps to True for every value or to a list of values
+TAGS = {
+    "amenity": True,
+    "buildings": ["religous"],
+    "leisure": True,
+    "shop": True,
+    "highway": ["roads"],
+    "railway": ["stations and stops"],
+    "sport": True
+    }
+
+def matches(feature_tags, tags=TAGS):
+    """
+    Check whether a feature is selected by tags
+    :param feature_tags: dict of the OSM tags of the feature
+    :param tags: dict of key to True or a list of values (optional)
+    :return: True if any key of tags is present with a selected value
+    """
+    for key, values in tags.items():
+        value = feature_tags.get(key)
+        if value is not None and (values is True or value in values):
+            return True
+    return False
+
+def _read_osm_xml(path, tags):
+    nodes = {}
+    records = []
+    for _, elem in ET.iterparse(path, events=("end",)):
+        if elem.tag == "node":
+            lat, lon = float(elem.get("lat")), float(elem.get("lon"))
+            nodes[elem.get("id")] = (lat, lon)
+            feature_tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+            if matches(feature_tags, tags):
+                records.append((lat, lon, feature_tags))
+            elem.clear()
+        elif elem.tag == "way":
+            feature_tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+            if matches(feature_tags, tags):
+                coords = [nodes[nd.get("ref")] for nd in elem.iter("nd") if nd.get("ref") in nodes]
+                if len(coords) > 0:
+                    lat, lon = np.mean(coords, axis=0)
+                    records.append((lat, lon, feature_tags))
+            elem.clear()
+        elif elem.tag == "relation":
+            elem.clear()
+    return records
+
+def _read_pbf(path, tags):
+    try:
+        import osmium
+    except ImportError:
+        raise ImportError("Reading .pbf extracts requires the osmium package, pip install osmium")
+
+    class Handler(osmium.SimpleHandler):
+        def __init__(self):
+            super().__init__()
+            self.records = []
+
+        def node(self, n):
+            feature_tags = {t.k: t.v for t in n.tags}
+            if matches(feature_tags, tags):
+                self.records.append((n.location.lat, n.location.lon, feature_tags))
+
+        def way(self, w):
+            feature_tags = {t.k: t.v for t in w.tags}
+            if matches(feature_tags, tags):
+                coords = [(nd.lat, nd.lon) for nd in w.nodes if nd.location.valid()]
+                if len(coords) > 0:
+                    lat, lon = np.mean(coords, axis=0)
+                    self.records.append((lat, lon, feature_tags))
+
+    handler = Handler()
+    handler.apply_file(path, locations=True)
+    return handler.records
+
+def _read_geojson(path, tags):
+    import geopandas as gpd
+    gdf = gpd.read_file(path)
+    points = gdf.geometry.centroid
+    columns = [key for key in tags if key in gdf]
+    records = []
+    for lat, lon, values in zip(points.y, points.x, gdf[columns].itertuples(index=False, name=None)):
+        feature_tags = {key: value for key, value in zip(columns, values) if isinstance(value, str)}
+        if matches(feature_tags, tags):
+            records.append((lat, lon, feature_tags))
+    return records
+
+class FeatureStore:
+    """
+    Points of interest held in memory and indexed by a uniform grid of cells
+    """
+    def __init__(self, latitudes, longitudes, tags, cell_size=0.01):
+        """
+        :param latitudes: Sequence of the latitudes of the features
+        :param longitudes: Sequence of the longitudes of the features
+        :param tags: dict of tag key to a sequence of the value of that tag for each feature, None where absent
+        :param cell_size: The size in degrees of the cells of the grid (optional)
+        """
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.tags = {key: np.asarray(values, dtype=object) for key, values in tags.items()}
+        self.cell_size = cell_size
+        self._codes = {}
+
+        rows = np.floor(self.latitudes / cell_size).astype(np.int64)
+        cols = np.floor(self.longitudes / cell_size).astype(np.int64)
+        self._row0 = rows.min() if len(rows) > 0 else 0
+        self._col0 = cols.min() if len(cols) > 0 else 0
+        self._n_cols = (cols.max() - self._col0 + 1) if len(cols) > 0 else 1
+        keys = (rows - self._row0) * self._n_cols + (cols - self._col0)
+        self._order = np.argsort(keys, kind="stable")
+        self._keys = keys[self._order]
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    @classmethod
+    def from_records(cls, records, tags=TAGS, cell_size=0.01):
+        """
+        Build a store from (latitude, longitude, feature tags) records
+        :param records: list of (latitude, longitude, dict of OSM tags) tuples
+        :param tags: The tag keys to be kept (optional)
+        :param cell_size: The size in degrees of the cells of the grid (optional)
+        :return: FeatureStore object
+        """
+        return cls(
+            [r[0] for r in records], [r[1] for r in records],
+            {key: [r[2].get(key) for r in records] for key in tags}, cell_size=cell_size
+        )
+
+    @classmethod
+    def from_file(cls, path, tags=TAGS, cell_size=0.01):
+        """
+        Load the features selected by tags from an OpenStreetMap extract, or a store saved with save
+        :param path: The path of a .osm/.xml, .pbf, .geojson/.json or .parquet file
+        :param tags: dict of key to True or a list of values selecting the features (optional)
+        :param cell_size: The size in degrees of the cells of the grid (optional)
+        :return: FeatureStore object
+        """
+        extension = os.path.splitext(path)[1].lower()
+        if extension == ".parquet":
+            df = pd.read_parquet(path)
+            return cls(df["latitude"], df["longitude"],
+                {key: df[key].where(df[key].notna(), None) for key in df.columns if key not in ("latitude", "longitude")},
+                cell_size=cell_size)
+        if extension in (".osm", ".xml"):
+            records = _read_osm_xml(path, tags)
+        elif extension == ".pbf":
+            records = _read_pbf(path, tags)
+        elif extension in (".geojson", ".json"):
+            records = _read_geojson(path, tags)
+        else:
+            raise ValueError(f"Cannot read OpenStreetMap features from a {extension} file")
+        return cls.from_records(records, tags=tags, cell_size=cell_size)
+
+    def save(self, path):
+        """
+        Save the store as a Parquet file that from_file can load quickly
+        :param path: The path of the .parquet file
+        """
+        df = pd.DataFrame({"latitude": self.latitudes, "longitude": self.longitudes, **self.tags})
+        df.to_parquet(path, index=False)
+
+    def codes(self, key):
+        """
+        Encode the values of a tag as integer codes
+        :param key: The tag key, for example "amenity"
+        :return: tuple of int64 numpy array of codes, -1 where the tag is absent, and numpy array of the values
+        """
+        if key not in self._codes:
+            values = self.tags[key] if key in self.tags else np.full(len(self), None, dtype=object)
+            codes, categories = pd.factorize(pd.Series(values, dtype=object), sort=True)
+            self._codes[key] = codes.astype(np.int64), np.asarray(categories, dtype=object)
+        return self._codes[key]
+
+    def select(self, north, south, west, east):
+        """
+        Find the features strictly within a bounding box, reading only the cells that intersect it
+        :param north: Maximum latitude
+        :param south: Minimum latitude
+        :param west: Minimum longitude
+        :param east: Maximum longitude
+        :return: int64 numpy array of the positions of the features
+        """
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64)
+        row_lo = int(np.floor(south / self.cell_size)) - self._row0
+        row_hi = int(np.floor(north / self.cell_size)) - self._row0
+        col_lo = max(int(np.floor(west / self.cell_size)) - self._col0, 0)
+        col_hi = min(int(np.floor(east / self.cell_size)) - self._col0, self._n_cols - 1)
+        if col_lo > col_hi:
+            return np.empty(0, dtype=np.int64)
+        slices = []
+        for row in range(max(row_lo, 0), row_hi + 1):
+            start = np.searchsorted(self._keys, row * self._n_cols + col_lo, side="left")
+            stop = np.searchsorted(self._keys, row * self._n_cols + col_hi, side="right")
+            slices.append(self._order[start:stop])
+        if len(slices) == 0:
+            return np.empty(0, dtype=np.int64)
+        positions = np.concatenate(slices)
+        lats, lons = self.latitudes[positions], self.longitudes[positions]
+        return positions[(south < lats) & (lats < north) & (west < lons) & (lons < east)]
+
+    def features(self, north, south, west, east):
+        """
+        Get the features strictly within a bounding box
+        :param north: Maximum latitude
+        :param south: Minimum latitude
+        :param west: Minimum longitude
+        :param east: Maximum longitude
+        :return: Dataframe of the latitude, longitude and tags of the features
+        """
+        positions = self.select(north, south, west, east)
+        return pd.DataFrame({
+            "latitude": self.latitudes[positions], "longitude": self.longitudes[positions],
+            **{key: values[positions] for key, values in self.tags.items()}
+        })
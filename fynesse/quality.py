@@ -0,0 +1,438 @@
+# This file contains a streaming data-quality profiler for the assess stage
+
+"""Profile price-paid data chunk by chunk in bounded memory. Every column is summarised by mergeable sketches, so
+chunks can be profiled in parallel and their profiles merged, and thirty years of data can be assessed without
+loading it:
+
+- the number of values, nulls and empty strings (the encodings of missing values),
+- a HyperLogLog sketch of the number of distinct values,
+- a relative-error quantile sketch of numbers, an absolute-error sketch of coordinates and an exact daily
+  histogram of dates, from which quantiles and Tukey outliers are read,
+- the minimum and maximum,
+- a Misra-Gries summary of the most frequent values of text columns.
+
+Profile the database or the df_from_year CSVs with profile_db and profile_years, partitioned by year across processes,
+or any chunks with profile_chunks:
+    report = quality.profile_years(range(1995, 2025), workers=8).report()"""
+
+import json
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from . import assess
+
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+OUTLIER_FENCE = 3 # Values further than this many interquartile ranges outside the quartiles are outliers
+# Columns sketched with buckets of a fixed width in degrees rather than a relative error, which at the latitudes of
+# the UK would be tens of kilometres
+COORDINATE_WIDTHS = {"Latitude": 1e-4, "Longitude": 1e-4, "latitude": 1e-4, "longitude": 1e-4}
+
+class HyperLogLog:
+    """
+    HyperLogLog sketch of the number of distinct values, with a relative error of about 1.04 / sqrt(2 ** precision)
+    """
+    def __init__(self, precision=14):
+        """
+        :param precision: The number of bits of the hash used to choose a register (optional)
+        """
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, values):
+        """
+        Add values to the sketch
+        :param values: Series or numpy array of values
+        """
+        if len(values) == 0:
+            return
+        hashes = pd.util.hash_array(np.asarray(values))
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.intp)
+        # The rank is the position of the first set bit of the 32 bits after the register bits
+        rest = ((hashes << np.uint64(self.precision)) >> np.uint64(32)).astype(np.float64)
+        with np.errstate(divide="ignore"):
+            rank = np.where(rest > 0, 32 - np.floor(np.log2(rest)), 33).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        """
+        Merge another sketch of the same precision into this one
+        :param other: HyperLogLog object
+        """
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self):
+        """
+        :return: The estimated number of distinct values added
+        """
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+class QuantileSketch:
+    """
+    Quantile sketch with logarithmic buckets, every quantile is within a relative error of accuracy of the true
+    value (as in DDSketch), or with buckets of a fixed width, every quantile within width / 2 of the true value, for
+    values with a small range such as coordinates, or dates with a bucket per day. Sketches are merged by adding the
+    counts of their buckets
+    """
+    def __init__(self, accuracy=0.01, width=None):
+        """
+        :param accuracy: The relative error of the quantiles, or None for a bucket per integer (optional)
+        :param width: The width of fixed buckets, replacing the relative error (optional)
+        """
+        if width is None and accuracy is None:
+            width = 1
+        self.accuracy = accuracy if width is None else None
+        self.width = width
+        self.gamma = (1 + accuracy) / (1 - accuracy) if width is None else None
+        self.positive = pd.Series(dtype=np.int64)
+        self.negative = pd.Series(dtype=np.int64)
+        self.zeros = 0
+        self.count = 0
+
+    def _buckets(self, values):
+        if self.gamma is None:
+            keys = np.round(values / self.width).astype(np.int64)
+        else:
+            keys = np.ceil(np.log(values) / np.log(self.gamma)).astype(np.int64)
+        keys, counts = np.unique(keys, return_counts=True)
+        return pd.Series(counts, index=keys)
+
+    def add(self, values):
+        """
+        Add values to the sketch
+        :param values: numpy array of finite numbers
+        """
+        values = np.asarray(values, dtype=np.float64)
+        self.count += len(values)
+        self.zeros += int(np.count_nonzero(values == 0))
+        self.positive = self.positive.add(self._buckets(values[values > 0]), fill_value=0).astype(np.int64)
+        self.negative = self.negative.add(self._buckets(-values[values < 0]), fill_value=0).astype(np.int64)
+
+    def merge(self, other):
+        """
+        Merge another sketch of the same accuracy into this one
+        :param other: QuantileSketch object
+        """
+        self.count += other.count
+        self.zeros += other.zeros
+        self.positive = self.positive.add(other.positive, fill_value=0).astype(np.int64)
+        self.negative = self.negative.add(other.negative, fill_value=0).astype(np.int64)
+
+    def _histogram(self):
+        """
+        The representative value and count of every bucket in ascending order of value
+        """
+        def value(keys):
+            if self.gamma is None:
+                return keys.astype(np.float64) * self.width
+            return 2 * self.gamma ** keys.astype(np.float64) / (self.gamma + 1)
+        negative = self.negative.sort_index(ascending=False)
+        positive = self.positive.sort_index()
+        values = np.concatenate((-value(negative.index.to_numpy()), [0.0], value(positive.index.to_numpy())))
+        counts = np.concatenate((negative.to_numpy(), [self.zeros], positive.to_numpy()))
+        return values, counts
+
+    def quantiles(self, qs):
+        """
+        :param qs: Sequence of quantiles between 0 and 1
+        :return: numpy array of the estimated quantiles, nan if the sketch is empty
+        """
+        if self.count == 0:
+            return np.full(len(qs), np.nan)
+        values, counts = self._histogram()
+        ranks = np.cumsum(counts)
+        positions = np.minimum(np.searchsorted(ranks, np.asarray(qs) * (self.count - 1), side="right"), len(values) - 1)
+        return values[positions]
+
+    def count_outside(self, low, high):
+        """
+        :return: tuple of the estimated number of values below low and above high
+        """
+        values, counts = self._histogram()
+        return int(counts[values < low].sum()), int(counts[values > high].sum())
+
+class FrequentValues:
+    """
+    Misra-Gries summary of the most frequent values, counts are underestimated by at most count / (capacity + 1)
+    """
+    def __init__(self, capacity=1000):
+        """
+        :param capacity: The number of values tracked (optional)
+        """
+        self.capacity = capacity
+        self.counts = pd.Series(dtype=np.int64)
+
+    def _reduce(self):
+        if len(self.counts) > self.capacity:
+            threshold = np.partition(self.counts.to_numpy(), -(self.capacity + 1))[-(self.capacity + 1)]
+            self.counts = self.counts[self.counts > threshold] - threshold
+
+    def add(self, counts):
+        """
+        Add the counts of values to the summary
+        :param counts: Series of the count of each value, as Series.value_counts returns
+        """
+        self.counts = self.counts.add(counts, fill_value=0).astype(np.int64)
+        self._reduce()
+
+    def merge(self, other):
+        """
+        Merge another summary into this one
+        :param other: FrequentValues object
+        """
+        self.counts = self.counts.add(other.counts, fill_value=0).astype(np.int64)
+        self._reduce()
+
+    def top(self, k=10):
+        """
+        :return: list of (value, count) of the k most frequent values
+        """
+        top = self.counts.sort_values(ascending=False, kind="stable").head(k)
+        return [(value, int(count)) for value, count in top.items()]
+
+class ColumnProfile:
+    """
+    Mergeable sketches of one column
+    """
+    def __init__(self, kind, accuracy=0.01, precision=14, capacity=1000, width=None):
+        """
+        :param kind: "number", "date" or "text"
+        :param accuracy: The relative error of the quantile sketch of numbers, dates are sketched exactly (optional)
+        :param width: The bucket width of the quantile sketch of numbers, for an absolute rather than a relative
+        error (optional)
+        :param precision: The precision of the HyperLogLog sketch (optional)
+        :param capacity: The number of frequent values tracked for text columns (optional)
+        """
+        self.kind = kind
+        self.count = self.nulls = self.empty = 0
+        self.minimum = self.maximum = None
+        self.distinct = HyperLogLog(precision)
+        if kind == "number":
+            self.sketch = QuantileSketch(accuracy, width)
+        else:
+            self.sketch = QuantileSketch(width=1) if kind == "date" else None
+        self.frequent = FrequentValues(capacity) if kind == "text" else None
+
+    @staticmethod
+    def kind_of(series):
+        """
+        :return: The kind of profile of a Series, "number", "date" or "text"
+        """
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return "date"
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            return "number"
+        return "text"
+
+    def add(self, series):
+        """
+        Add the values of a chunk of the column
+        :param series: Series of values
+        """
+        self.count += len(series)
+        present = series[series.notna()]
+        self.nulls += len(series) - len(present)
+        if self.kind == "text":
+            # Text is summarised by the count of each value, only the distinct values are sketched
+            counts = present.value_counts(sort=False)
+            counts = counts[counts > 0]
+            counts.index = counts.index.astype(str)
+            counts = counts.groupby(level=0).sum()
+            self.empty += int(counts[counts.index.str.strip() == ""].sum())
+            self.frequent.add(counts)
+            values = counts.index.to_numpy(dtype=object)
+        elif self.kind == "date":
+            values = present.to_numpy(dtype="datetime64[D]").astype(np.int64)
+        else:
+            values = present.to_numpy(dtype=np.float64)
+            values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        self.distinct.add(values)
+        if self.kind != "text":
+            self.sketch.add(values)
+        low, high = (values.min(), values.max()) if self.kind != "text" else (min(values), max(values))
+        self.minimum = low if self.minimum is None else min(self.minimum, low)
+        self.maximum = high if self.maximum is None else max(self.maximum, high)
+
+    def merge(self, other):
+        """
+        Merge the profile of another chunk of the same column into this one
+        :param other: ColumnProfile object
+        """
+        self.count += other.count
+        self.nulls += other.nulls
+        self.empty += other.empty
+        self.distinct.merge(other.distinct)
+        if self.sketch is not None:
+            self.sketch.merge(other.sketch)
+        if self.frequent is not None:
+            self.frequent.merge(other.frequent)
+        for value in (other.minimum, other.maximum):
+            if value is not None:
+                self.minimum = value if self.minimum is None else min(self.minimum, value)
+                self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def _format(self, value):
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return None
+        if self.kind == "date":
+            return str(np.datetime64(int(round(value)), "D"))
+        if self.kind == "number":
+            return float(value)
+        return value
+
+    def report(self, top=10):
+        """
+        :param top: The number of frequent values reported for text columns (optional)
+        :return: dict summarising the column
+        """
+        report = {"kind": self.kind, "count": self.count, "nulls": self.nulls}
+        if self.kind == "text":
+            report["empty"] = self.empty
+        report["distinct"] = self.distinct.estimate()
+        report["min"], report["max"] = self._format(self.minimum), self._format(self.maximum)
+        if self.kind != "text":
+            quantiles = self.sketch.quantiles(QUANTILES)
+            report["quantiles"] = {f"p{round(q * 100)}": self._format(value) for q, value in zip(QUANTILES, quantiles)}
+            q1, q3 = self.sketch.quantiles((0.25, 0.75))
+            low, high = q1 - OUTLIER_FENCE * (q3 - q1), q3 + OUTLIER_FENCE * (q3 - q1)
+            below, above = self.sketch.count_outside(low, high) if self.sketch.count else (0, 0)
+            report["outliers"] = {"below": below, "above": above, "fences": [self._format(low), self._format(high)]}
+        else:
+            report["top"] = [[str(value), count] for value, count in self.frequent.top(top)]
+        return report
+
+class Profile:
+    """
+    Mergeable profile of every column of a dataset
+    """
+    def __init__(self, widths=None, **kwargs):
+        """
+        :param widths: dict of column to the bucket width of its quantile sketch (optional, default COORDINATE_WIDTHS)
+        :param kwargs: The sketch settings passed to each ColumnProfile (optional)
+        """
+        self.columns = {}
+        self.rows = 0
+        self.widths = widths if widths is not None else COORDINATE_WIDTHS
+        self.settings = kwargs
+
+    def add(self, df):
+        """
+        Add a chunk of the dataset
+        :param df: Dataframe of the chunk
+        :return: This profile
+        """
+        self.rows += len(df)
+        for column in df.columns:
+            if column not in self.columns:
+                self.columns[column] = ColumnProfile(ColumnProfile.kind_of(df[column]),
+                    width=self.widths.get(column), **self.settings)
+            self.columns[column].add(df[column])
+        return self
+
+    def merge(self, other):
+        """
+        Merge the profile of other chunks into this one
+        :param other: Profile object
+        :return: This profile
+        """
+        self.rows += other.rows
+        for column, profile in other.columns.items():
+            if column in self.columns:
+                self.columns[column].merge(profile)
+            else:
+                self.columns[column] = profile
+        return self
+
+    def report(self, top=10):
+        """
+        :param top: The number of frequent values reported for text columns (optional)
+        :return: dict of the number of rows and the report of each column
+        """
+        return {"rows": self.rows, "columns": {column: profile.report(top) for column, profile in self.columns.items()}}
+
+    def write(self, path, top=10):
+        """
+        Write the report as JSON
+        :param path: The path of the JSON file
+        :param top: The number of frequent values reported for text columns (optional)
+        """
+        with open(path, "w") as file:
+            json.dump(self.report(top), file, indent=2)
+
+def profile_chunks(chunks, **kwargs):
+    """
+    Profile a dataset chunk by chunk, only one chunk is held in memory at once
+    :param chunks: Iterable of Dataframes
+    :param kwargs: The sketch settings passed to each ColumnProfile (optional)
+    :return: Profile object
+    """
+    profile = Profile(**kwargs)
+    for chunk in chunks:
+        profile.add(chunk)
+    return profile
+
+def profile_partitions(partitions, chunks, workers=1, **kwargs):
+    """
+    Profile partitions of a dataset in parallel processes, each reading its own chunks, and merge their profiles
+    :param partitions: Sequence of the partitions, for example years
+    :param chunks: Function of a partition returning an iterable of its Dataframe chunks, defined at module level
+    :param workers: The number of processes profiling partitions in parallel (optional)
+    :param kwargs: The sketch settings passed to each ColumnProfile (optional)
+    :return: Profile object
+    """
+    profile = Profile(**kwargs)
+    if workers <= 1:
+        for partition in partitions:
+            profile.merge(profile_chunks(chunks(partition), **kwargs))
+        return profile
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_profile_partition, chunks, partition, kwargs) for partition in partitions]
+        for future in futures:
+            profile.merge(future.result())
+    return profile
+
+def _profile_partition(chunks, partition, settings):
+    return profile_chunks(chunks(partition), **settings)
+
+def profile_query(query, columns, chunk_size=100000, **kwargs):
+    """
+    Profile the data selected by a database query, streamed in chunks
+    :param query: The database query to be performed to select the data
+    :param columns: The columns to be selected in the query
+    :param chunk_size: The number of rows in each chunk (optional)
+    :return: Profile object
+    """
+    return profile_chunks(assess.query_chunks(query, columns, chunk_size), **kwargs)
+
+def _db_year_chunks(year, chunk_size=100000):
+    from . import address
+    return assess.query_chunks(
+        "SELECT * FROM prices_coordinates_data WHERE "
+        f"date_of_transfer >= CAST('{year}-01-01' as date) AND date_of_transfer < CAST('{year + 1}-01-01' as date)",
+        address.COLUMNS, chunk_size
+    )
+
+def profile_db(years, workers=1, **kwargs):
+    """
+    Profile prices_coordinates_data year by year, each process streaming the years it profiles over its own connection
+    :param years: The years of data to be profiled
+    :param workers: The number of processes profiling years in parallel (optional)
+    :return: Profile object
+    """
+    return profile_partitions(list(years), _db_year_chunks, workers=workers, **kwargs)
+
+def profile_years(years, workers=1, **kwargs):
+    """
+    Profile the df_from_year CSVs of several years, each parsed in chunks
+    :param years: The years of data to be profiled
+    :param workers: The number of processes profiling years in parallel (optional)
+    :return: Profile object
+    """
+    return profile_partitions(list(years), assess.year_csv_chunks, workers=workers, **kwargs)
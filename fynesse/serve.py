@@ -0,0 +1,200 @@
+# This file contains an asyncio service serving address.predict_price to concurrent requests
+
+"""Serve price predictions to concurrent requests. Database queries run on a thread pool and model fitting on a
+process pool, so the I/O of one request overlaps the fitting of another, and concurrent requests for the same
+neighbourhood share a single fetch.
+
+Requests and responses are JSON objects, one per line, over TCP:
+    {"id": 1, "latitude": 52.2, "longitude": 0.12, "date": "2021-06-01", "property_type": "F"}
+    {"id": 1, "price": 412345.6, "r2": 0.41, "error": null}
+a {"stats": true} request is answered with the latency percentiles and throughput of the service.
+
+Start it with fynesse-serve --port 8765, or python -m fynesse.serve --port 8765."""
+
+import argparse
+import asyncio
+import datetime
+import json
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from . import access, address
+
+def fit_and_predict(h, rows, latitude, longitude, date, property_type, backend):
+    """
+    Fit a model on fetched rows and predict the price of a sale, run in a worker process
+    :return: tuple of predicted price, r squared, and an error message or None
+    """
+    df = address.training_frame(rows, h)
+    price, r2, results = address.predict_from_data(h, df, latitude, longitude, date, property_type, backend=backend)
+    return float(price), float(r2), results if isinstance(results, str) else None
+
+class PredictionService:
+    """
+    Asynchronous price predictions with coalesced fetches and latency statistics
+    """
+    def __init__(self, args=None, backend="ridge", io_workers=8, fit_workers=None, fit_executor=None,
+            latency_window=10000):
+        """
+        :param args: The parameters to be used for price predictions (optional)
+        :param backend: The fitting backend to be used, one of address.BACKENDS (optional)
+        :param io_workers: The number of threads running database queries (optional)
+        :param fit_workers: The number of processes fitting models (optional, default the number of cores)
+        :param fit_executor: Executor fitting models, replacing the process pool, for example a thread pool in
+        tests (optional)
+        :param latency_window: The number of most recent requests whose latencies are kept for stats (optional)
+        """
+        self.args = args if args is not None else address.DEFAULT_ARGS
+        self.backend = backend
+        self.io_executor = ThreadPoolExecutor(max_workers=io_workers)
+        self.fit_executor = fit_executor if fit_executor is not None else ProcessPoolExecutor(max_workers=fit_workers)
+        self._inflight = {}
+        self.latencies = deque(maxlen=latency_window)
+        self.requests = 0
+        self.fetches = 0
+        self.coalesced = 0
+        self.started = time.perf_counter()
+
+    async def fetch(self, north, south, west, east, latest_date, earliest_date):
+        """
+        Fetch the rows within bounds on the thread pool, waiting for a fetch of the same neighbourhood (the same
+        snapped bounds, see access.snap_bounds) already in flight rather than querying again
+        :return: tuple tuple of the rows that satisfy the given bounds
+        """
+        loop = asyncio.get_running_loop()
+        bounds = (north, south, west, east, latest_date, earliest_date)
+        key = access.snap_bounds(*bounds)
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            await inflight
+            # The neighbourhood is now in the rows cache, so this is answered in memory
+            return await loop.run_in_executor(self.io_executor, access.get_rows_in_bounds, *bounds)
+        self.fetches += 1
+        future = loop.run_in_executor(self.io_executor, access.get_rows_in_bounds, *bounds)
+        self._inflight[key] = future
+        try:
+            return await future
+        finally:
+            del self._inflight[key]
+
+    async def predict(self, latitude, longitude, date, property_type):
+        """
+        Price prediction for UK housing, see address.predict_price_parameterized
+        :param latitude: Latitude of the property
+        :param longitude: Longitude of the property
+        :param date: The date of the property sale (datetime object)
+        :param property_type: The property type enum of the property (F, S, D, T, O)
+        :return: tuple of predicted price, r squared, and an error message or None
+        """
+        t0 = time.perf_counter()
+        d, t, h = self.args
+        rows = await self.fetch(*address.box(latitude, longitude, d), *address.window(date, t))
+        result = await asyncio.get_running_loop().run_in_executor(
+            self.fit_executor, fit_and_predict, h, rows, latitude, longitude, date, property_type, self.backend
+        )
+        self.latencies.append(time.perf_counter() - t0)
+        self.requests += 1
+        return result
+
+    def stats(self):
+        """
+        Latency and throughput of the predictions served so far, the latencies over the last latency_window requests
+        :return: dict of the number of requests, p50 and p99 latency in ms, requests per second, fetches and
+        coalesced fetches
+        """
+        latencies = np.array(self.latencies)
+        return {
+            "requests": self.requests,
+            "p50_ms": float(np.percentile(latencies, 50) * 1000) if len(latencies) else None,
+            "p99_ms": float(np.percentile(latencies, 99) * 1000) if len(latencies) else None,
+            "throughput": self.requests / (time.perf_counter() - self.started),
+            "fetches": self.fetches, "coalesced": self.coalesced
+        }
+
+    async def handle(self, request):
+        """
+        Answer one JSON request
+        :param request: dict of the request
+        :return: dict of the response
+        """
+        if request.get("stats"):
+            return {"id": request.get("id"), **self.stats()}
+        try:
+            price, r2, error = await self.predict(
+                float(request["latitude"]), float(request["longitude"]),
+                datetime.date.fromisoformat(request["date"]), request["property_type"]
+            )
+        except Exception as e:
+            return {"id": request.get("id"), "price": None, "r2": None, "error": str(e)}
+        return {
+            "id": request.get("id"), "price": None if np.isnan(price) else price,
+            "r2": r2 if np.isfinite(r2) else None, "error": error
+        }
+
+    async def _connection(self, reader, writer):
+        lock = asyncio.Lock()
+        tasks = set()
+
+        async def answer(line):
+            try:
+                response = await self.handle(json.loads(line))
+            except json.JSONDecodeError as e:
+                response = {"id": None, "error": f"Invalid request: {e}"}
+            async with lock:
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.strip():
+                task = asyncio.ensure_future(answer(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        """
+        Serve JSON line requests over TCP until cancelled
+        :param host: The host to listen on (optional)
+        :param port: The port to listen on (optional)
+        """
+        server = await asyncio.start_server(self._connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        """
+        Shut down the thread and process pools
+        """
+        self.io_executor.shutdown()
+        self.fit_executor.shutdown()
+
+def main(argv=None):
+    """
+    Run the prediction service from the command line
+    """
+    parser = argparse.ArgumentParser(description="Serve fynesse price predictions")
+    parser.add_argument("--host", default="127.0.0.1", help="The host to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="The port to listen on")
+    parser.add_argument("--io-workers", type=int, default=8, help="The number of threads running database queries")
+    parser.add_argument("--fit-workers", type=int, default=None, help="The number of processes fitting models")
+    parser.add_argument("--backend", default="ridge", choices=address.BACKENDS, help="The fitting backend")
+    args = parser.parse_args(argv)
+    service = PredictionService(backend=args.backend, io_workers=args.io_workers, fit_workers=args.fit_workers)
+    print(f"Serving predictions on {args.host}:{args.port}")
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(service.stats()))
+        service.close()
+
+if __name__ == "__main__":
+    main()
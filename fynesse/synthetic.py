@@ -0,0 +1,236 @@
+# This file contains a generator of synthetic price-paid data and a SQLite stand-in for the database
+
+"""Realistic synthetic UK price-paid sales, so the hot paths can be exercised without the real dataset or a live
+MariaDB server. Sales are clustered around towns and neighbourhoods within them, postcodes follow the location of
+the sale, and prices are log-normal around a town level with property type, neighbourhood and yearly effects.
+
+The sales can be written as the pcd/pc-{year}-part{n}.csv files read by assess.df_from_year, or loaded into a SQLite
+database whose connections stand in for pymysql connections through access.use_pool:
+    synthetic.sqlite_database("pcd.sqlite", 1000000)
+    synthetic.use_sqlite("pcd.sqlite")
+    address.predict_price(51.5, -0.12, datetime.date(2021, 6, 1), "F")"""
+
+import os
+import re
+import sqlite3
+import numpy as np
+import pandas as pd
+from . import access, address, assess, design
+
+# Town, district, county, postcode area, latitude, longitude, share of sales, spread in degrees, log median price
+TOWNS = (
+    ("LONDON", "CITY OF WESTMINSTER", "GREATER LONDON", "SW", 51.507, -0.128, 0.22, 0.12, 13.1),
+    ("BIRMINGHAM", "BIRMINGHAM", "WEST MIDLANDS", "B", 52.486, -1.890, 0.07, 0.06, 12.2),
+    ("MANCHESTER", "MANCHESTER", "GREATER MANCHESTER", "M", 53.480, -2.242, 0.07, 0.06, 12.2),
+    ("LEEDS", "LEEDS", "WEST YORKSHIRE", "LS", 53.800, -1.549, 0.06, 0.05, 12.1),
+    ("LIVERPOOL", "LIVERPOOL", "MERSEYSIDE", "L", 53.408, -2.991, 0.05, 0.05, 11.9),
+    ("BRISTOL", "CITY OF BRISTOL", "CITY OF BRISTOL", "BS", 51.454, -2.588, 0.05, 0.05, 12.6),
+    ("SHEFFIELD", "SHEFFIELD", "SOUTH YORKSHIRE", "S", 53.381, -1.470, 0.04, 0.05, 12.0),
+    ("NEWCASTLE UPON TYNE", "NEWCASTLE UPON TYNE", "TYNE AND WEAR", "NE", 54.978, -1.617, 0.04, 0.04, 11.9),
+    ("NOTTINGHAM", "NOTTINGHAM", "NOTTINGHAMSHIRE", "NG", 52.954, -1.158, 0.04, 0.04, 12.0),
+    ("LEICESTER", "LEICESTER", "LEICESTERSHIRE", "LE", 52.637, -1.140, 0.04, 0.04, 12.1),
+    ("CARDIFF", "CARDIFF", "CARDIFF", "CF", 51.481, -3.179, 0.04, 0.04, 12.1),
+    ("CAMBRIDGE", "CAMBRIDGE", "CAMBRIDGESHIRE", "CB", 52.205, 0.119, 0.03, 0.03, 12.9),
+    ("OXFORD", "OXFORD", "OXFORDSHIRE", "OX", 51.752, -1.258, 0.03, 0.03, 12.9),
+    ("BRIGHTON", "BRIGHTON AND HOVE", "BRIGHTON AND HOVE", "BN", 50.822, -0.137, 0.03, 0.03, 12.8),
+    ("NORWICH", "NORWICH", "NORFOLK", "NR", 52.630, 1.297, 0.03, 0.03, 12.3),
+    ("EXETER", "EXETER", "DEVON", "EX", 50.718, -3.534, 0.03, 0.03, 12.5),
+    ("YORK", "YORK", "YORK", "YO", 53.960, -1.087, 0.03, 0.03, 12.4),
+    ("SOUTHAMPTON", "SOUTHAMPTON", "SOUTHAMPTON", "SO", 50.909, -1.404, 0.03, 0.03, 12.4),
+    ("PLYMOUTH", "PLYMOUTH", "PLYMOUTH", "PL", 50.376, -4.143, 0.03, 0.03, 12.1),
+    ("KINGSTON UPON HULL", "CITY OF KINGSTON UPON HULL", "CITY OF KINGSTON UPON HULL", "HU", 53.745, -0.337, 0.03, 0.03, 11.7),
+)
+PROPERTY_TYPE_SHARES = (0.20, 0.28, 0.22, 0.28, 0.02) # F, S, D, T, O as in address.PROPERTY_TYPES
+PROPERTY_TYPE_EFFECTS = (-0.25, 0.0, 0.35, -0.1, 0.1)
+NEIGHBOURHOODS = 50 # per town
+YEARLY_GROWTH = 0.04
+NOISE = 0.3
+UNIT_LETTERS = np.array(list("ABDEFGHJLNPQRSTUWXYZ"))
+
+def generate(n, seed=0, start="2015-01-01", end="2023-01-01", first_id=0):
+    """
+    Generate synthetic price-paid sales
+    :param n: The number of sales
+    :param seed: Seed of the random generator (optional)
+    :param start: The earliest date of the sales (optional)
+    :param end: The date after the latest date of the sales (optional)
+    :param first_id: The ID of the first sale, the others are numbered consecutively (optional)
+    :return: Dataframe of the sales labelled with address.COLUMNS, with the dtypes of assess.SCHEMA
+    """
+    rng = np.random.default_rng(seed)
+    towns = pd.DataFrame(list(TOWNS), columns=("town", "district", "county", "area", "lat", "lon", "share", "spread", "level"))
+    # The neighbourhoods are the same for every seed, so chunks generated with different seeds share them
+    layout = np.random.default_rng(len(TOWNS))
+    hood_offsets = layout.normal(0, 1, (len(TOWNS), NEIGHBOURHOODS, 2)) * towns["spread"].to_numpy()[:, None, None]
+    hood_effects = layout.normal(0, 0.2, (len(TOWNS), NEIGHBOURHOODS))
+
+    town = rng.choice(len(TOWNS), n, p=towns["share"] / towns["share"].sum())
+    hood = rng.integers(0, NEIGHBOURHOODS, n)
+    spread = towns["spread"].to_numpy()[town] / 5
+    lats = towns["lat"].to_numpy()[town] + hood_offsets[town, hood, 0] + rng.normal(0, 1, n) * spread
+    lons = towns["lon"].to_numpy()[town] + hood_offsets[town, hood, 1] * 1.6 + rng.normal(0, 1, n) * spread * 1.6
+
+    first, last = pd.Timestamp(start), pd.Timestamp(end)
+    days = rng.integers(0, (last - first).days, n)
+    dates = first.to_datetime64().astype("datetime64[D]") + days
+    property_type = rng.choice(len(address.PROPERTY_TYPES), n, p=PROPERTY_TYPE_SHARES)
+    log_price = (towns["level"].to_numpy()[town] + hood_effects[town, hood]
+        + np.asarray(PROPERTY_TYPE_EFFECTS)[property_type] + YEARLY_GROWTH * days / 365.25 + rng.normal(0, NOISE, n))
+    prices = np.round(np.exp(log_price), -2).astype(np.int64)
+
+    # Postcodes are named after the geohash cell of the sale, so nearby sales share postcode districts
+    cells = design.geohash_codes(lats, lons, 6)
+    district = (cells >> np.uint64(10)) % np.uint64(40) + np.uint64(1)
+    sector = (cells >> np.uint64(5)) % np.uint64(10)
+    unit = cells % np.uint64(len(UNIT_LETTERS) ** 2)
+    postcodes = (towns["area"].to_numpy()[town] + district.astype(str) + " " + sector.astype(str)
+        + UNIT_LETTERS[(unit // np.uint64(len(UNIT_LETTERS))).astype(np.intp)]
+        + UNIT_LETTERS[(unit % np.uint64(len(UNIT_LETTERS))).astype(np.intp)])
+
+    df = pd.DataFrame({
+        "Postcode": postcodes,
+        "Price": prices,
+        "Date": dates.astype("datetime64[ns]"),
+        "Property Type": np.asarray(address.PROPERTY_TYPES)[property_type],
+        "New Build Flag": np.where(rng.random(n) < 0.1, "Y", "N"),
+        "Tenure Type": np.where(property_type == 0, "L", np.where(rng.random(n) < 0.05, "L", "F")),
+        "Locality": "",
+        "Town/City": towns["town"].to_numpy()[town],
+        "District": towns["district"].to_numpy()[town],
+        "County": towns["county"].to_numpy()[town],
+        "Positional Quality Indicator": 1,
+        "Country": "England",
+        "Latitude": np.round(lats, 6),
+        "Longitude": np.round(lons, 6),
+        "ID": np.arange(first_id, first_id + n, dtype=np.int64)
+    })
+    return df.astype({column: dtype for column, dtype in assess.SCHEMA.items() if dtype == "category"})
+
+def chunks(n, chunk_size=1000000, seed=0, **kwargs):
+    """
+    Generate synthetic sales in chunks, so that tens of millions of sales need not be held in memory at once
+    :param n: The total number of sales
+    :param chunk_size: The number of sales in each chunk (optional)
+    :param seed: Seed of the random generator, each chunk is generated with its own seed derived from it (optional)
+    :return: Generator of dataframes, see generate
+    """
+    for i, first in enumerate(range(0, n, chunk_size)):
+        yield generate(min(chunk_size, n - first), seed=(seed, i), first_id=first, **kwargs)
+
+def write_year_csvs(directory, year, n, seed=0):
+    """
+    Write a year of synthetic sales as the two CSV parts that assess.df_from_year reads
+    :param directory: The directory containing the pcd folder the CSVs are written to
+    :param year: The year of the sales
+    :param n: The number of sales
+    :param seed: Seed of the random generator (optional)
+    :return: list of the paths of the CSVs
+    """
+    os.makedirs(os.path.join(directory, "pcd"), exist_ok=True)
+    paths = [os.path.join(directory, "pcd", f"pc-{year}-part{part}.csv") for part in (1, 2)]
+    half = (n + 1) // 2
+    for path, (first, size) in zip(paths, ((0, half), (half, n - half))):
+        with open(path, "w") as file:
+            for chunk in chunks(size, seed=(seed, year, first), start=f"{year}-01-01", end=f"{year + 1}-01-01"):
+                chunk = chunk[list(assess.YEAR_COLUMNS)].copy()
+                chunk["Date"] = chunk["Date"].dt.strftime("%Y-%m-%d 00:00")
+                chunk.to_csv(file, header=False, index=False)
+    return paths
+
+def rows(df):
+    """
+    Convert sales to rows in the column order of prices_coordinates_data, with dates as ISO strings
+    :param df: Dataframe of sales, see generate
+    :return: list of tuples
+    """
+    columns = [df[column].astype(object) for column in address.COLUMNS]
+    columns[2] = df["Date"].dt.strftime("%Y-%m-%d")
+    return list(zip(*(column.tolist() for column in columns)))
+
+class SQLiteCursor:
+    """
+    SQLite cursor accepting the MariaDB dialect of the queries built by access
+    """
+    CAST_DATE = re.compile(r"CAST\(('[^']*')\s+as\s+date\)", re.IGNORECASE)
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, args=None):
+        query = self.CAST_DATE.sub(r"\1", query)
+        if args is not None:
+            query = query.replace("%s", "?")
+            return self._cursor.execute(query, args)
+        return self._cursor.execute(query)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+class SQLiteConnection:
+    """
+    SQLite connection standing in for a pymysql connection, dates declared as date are read as datetime.date
+    """
+    def __init__(self, path):
+        """
+        :param path: The path of the SQLite database, see sqlite_database
+        """
+        self._conn = sqlite3.connect(path, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+
+    def cursor(self, cursor_class=None):
+        # Streaming and buffered cursors are the same in SQLite
+        return SQLiteCursor(self._conn.cursor())
+
+    def ping(self, reconnect=False):
+        self._conn.execute("SELECT 1")
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    @property
+    def server_status(self):
+        # The SERVER_STATUS_IN_TRANS flag of the pymysql server status
+        return access.SERVER_STATUS_IN_TRANS if self._conn.in_transaction else 0
+
+    def close(self):
+        self._conn.close()
+
+def sqlite_database(path, n, seed=0, chunk_size=1000000, **kwargs):
+    """
+    Create a SQLite database holding a prices_coordinates_data table of synthetic sales
+    :param path: The path of the SQLite database, an existing table in it is replaced
+    :param n: The number of sales
+    :param seed: Seed of the random generator (optional)
+    :param chunk_size: The number of sales generated and inserted at once (optional)
+    :return: The path of the database
+    """
+    from .index import CSV_COLUMNS
+    conn = sqlite3.connect(path)
+    conn.execute("DROP TABLE IF EXISTS prices_coordinates_data")
+    declared = {"price": "INTEGER", "date_of_transfer": "date", "positional_quality_indicator": "INTEGER",
+        "latitude": "REAL", "longitude": "REAL", "db_id": "INTEGER PRIMARY KEY"}
+    conn.execute("CREATE TABLE prices_coordinates_data ("
+        + ", ".join(f"{column} {declared.get(column, 'TEXT')}" for column in CSV_COLUMNS) + ")")
+    insert = f"INSERT INTO prices_coordinates_data VALUES ({', '.join('?' * len(CSV_COLUMNS))})"
+    for chunk in chunks(n, chunk_size=chunk_size, seed=seed, **kwargs):
+        conn.executemany(insert, rows(chunk))
+        conn.commit()
+    conn.execute("CREATE INDEX prices_coordinates_location ON prices_coordinates_data (latitude, longitude)")
+    conn.execute("CREATE INDEX prices_coordinates_date ON prices_coordinates_data (date_of_transfer)")
+    conn.commit()
+    conn.close()
+    return path
+
+def use_sqlite(path, size=5):
+    """
+    Answer the queries of access from a SQLite database rather than the MariaDB server of access.config
+    :param path: The path of the SQLite database, see sqlite_database
+    :param size: The maximum number of connections open at once (optional)
+    """
+    access.use_pool(access.ConnectionPool(lambda: SQLiteConnection(path), size=size))
+    access.invalidate_rows_cache()
@@ -0,0 +1,66 @@
+import json
+import re
+import threading
+from fynesse import access
+
+class LoadConnection:
+    """
+    Stands in for a database connection, recording the files loaded and failing to load the files in failing
+    """
+    loaded = []
+    failing = set()
+    lock = threading.Lock()
+
+    def cursor(self):
+        return self
+
+    def execute(self, query):
+        path = re.search(r"LOAD DATA LOCAL INFILE '([^']*)'", query).group(1)
+        if path in self.failing:
+            raise ConnectionError(f"lost connection loading {path}")
+        with self.lock:
+            self.loaded.append(path)
+        with open(path) as file:
+            return sum(1 for _ in file)
+
+    def commit(self):
+        pass
+
+    def ping(self, reconnect=False):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+def test_rerun_uploads_only_the_chunks_not_done(tmp_path, monkeypatch):
+    monkeypatch.setattr(access, "upload_listeners", [])
+    monkeypatch.setattr(access, "invalidate_index", lambda: None)
+    monkeypatch.setattr(LoadConnection, "loaded", [])
+    access.use_pool(access.ConnectionPool(LoadConnection, size=2))
+    filename = tmp_path / "pp-2020.csv"
+    filename.write_text("".join(f"{i},sale\n" for i in range(1000)))
+    manifest = str(tmp_path / "manifest.json")
+    chunks = access.split_file(str(filename), 1000, str(tmp_path / "chunks"))
+    assert len(chunks) > 4
+
+    # The upload fails part way through the series of chunks
+    monkeypatch.setattr(LoadConnection, "failing", set(chunks[2:4]))
+    first = access.bulk_upload([str(filename)], "pp_data", manifest=manifest, workers=2, chunk_bytes=1000,
+        chunk_dir=str(tmp_path / "chunks"))
+    assert [first[chunk]["status"] for chunk in chunks[2:4]] == ["failed", "failed"]
+    assert sorted(LoadConnection.loaded) == sorted(set(chunks) - set(chunks[2:4]))
+    with open(manifest) as file:
+        assert json.load(file)[chunks[2]]["status"] == "failed"
+
+    # The rerun loads the failed chunks only, and every line is loaded once
+    monkeypatch.setattr(LoadConnection, "failing", set())
+    monkeypatch.setattr(LoadConnection, "loaded", [])
+    second = access.bulk_upload([str(filename)], "pp_data", manifest=manifest, workers=2, chunk_bytes=1000,
+        chunk_dir=str(tmp_path / "chunks"))
+    assert sorted(LoadConnection.loaded) == sorted(chunks[2:4])
+    assert all(record["status"] == "done" for record in second.values())
+    assert sum(record["rows"] for record in second.values()) == 1000
+    access.close_pool()
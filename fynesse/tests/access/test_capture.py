@@ -0,0 +1,40 @@
+import sys
+import types
+import pstats
+from fynesse import instrument
+
+class FakeProfiler:
+    """
+    Stands in for pyinstrument.Profiler, which raises when stopped twice
+    """
+    def __init__(self):
+        self.running = False
+
+    def start(self):
+        self.running = True
+
+    def stop(self):
+        if not self.running:
+            raise RuntimeError("This profiler is not currently running")
+        self.running = False
+
+    def output_text(self):
+        return "call tree"
+
+    def output_html(self):
+        return "<html>call tree</html>"
+
+def test_capture_writes_cprofile_stats(tmp_path):
+    path = str(tmp_path / "profile.prof")
+    with instrument.capture("cprofile", path=path) as result:
+        sum(range(1000))
+    assert "function calls" in result["profile"]
+    assert pstats.Stats(path).total_calls > 0
+
+def test_capture_stops_pyinstrument_once(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyinstrument", types.SimpleNamespace(Profiler=FakeProfiler))
+    path = tmp_path / "profile.html"
+    with instrument.capture("pyinstrument", path=str(path)) as result:
+        sum(range(1000))
+    assert result["profile"] == "call tree"
+    assert path.read_text() == "<html>call tree</html>"
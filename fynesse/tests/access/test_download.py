@@ -0,0 +1,73 @@
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from fynesse import access
+
+DATA = bytes(range(256)) * 1000
+
+class Handler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.headers.get("Range"))
+        start = 0
+        if self.headers.get("Range"):
+            start = int(self.headers["Range"][len("bytes="):].rstrip("-"))
+            if start >= len(DATA):
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(DATA) - start))
+        self.end_headers()
+        self.wfile.write(DATA[start:])
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def url():
+    Handler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/data.bin"
+    server.shutdown()
+    server.server_close()
+
+def _read(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+def test_download_with_checksum(tmp_path, url):
+    path = access.download_url(str(tmp_path), "data.bin", url, checksum=hashlib.sha256(DATA).hexdigest())
+    assert _read(path) == DATA
+    assert not os.path.exists(path + ".part")
+
+def test_download_resumes_part_file(tmp_path, url):
+    (tmp_path / "data.bin.part").write_bytes(DATA[:1000])
+    path = access.download_url(str(tmp_path), "data.bin", url)
+    assert Handler.requests == ["bytes=1000-"]
+    assert _read(path) == DATA
+
+def test_complete_part_file_is_moved_into_place_on_416(tmp_path, url):
+    (tmp_path / "data.bin.part").write_bytes(DATA)
+    path = access.download_url(str(tmp_path), "data.bin", url, checksum="sha256:" + hashlib.sha256(DATA).hexdigest())
+    assert Handler.requests == [f"bytes={len(DATA)}-"]
+    assert _read(path) == DATA
+
+def test_checksum_mismatch_removes_part_file(tmp_path, url):
+    with pytest.raises(ValueError):
+        access.download_url(str(tmp_path), "data.bin", url, checksum="0" * 64)
+    assert not os.path.exists(tmp_path / "data.bin.part")
+    assert not os.path.exists(tmp_path / "data.bin")
+
+def test_matching_file_is_not_downloaded_again(tmp_path, url):
+    (tmp_path / "data.bin").write_bytes(DATA)
+    access.download_url(str(tmp_path), "data.bin", url, checksum=hashlib.sha256(DATA).hexdigest())
+    assert Handler.requests == []
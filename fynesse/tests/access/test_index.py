@@ -0,0 +1,46 @@
+import datetime
+import numpy as np
+from fynesse import access, index
+
+class FakeCursor:
+    def execute(self, query):
+        return 0
+
+class FakeConnection:
+    def cursor(self):
+        return FakeCursor()
+
+    def commit(self):
+        pass
+
+def _columns(n=100):
+    rng = np.random.default_rng(0)
+    return {
+        "latitude": rng.uniform(51.4, 51.6, n), "longitude": rng.uniform(-0.2, 0.0, n),
+        "date_of_transfer": [datetime.date(2020, 1, 1) + datetime.timedelta(days=int(d)) for d in rng.integers(0, 365, n)],
+        "price": rng.integers(100000, 900000, n)
+    }
+
+def test_upload_marks_index_stale_until_rebuilt(tmp_path, monkeypatch):
+    directory = str(tmp_path / "index")
+    index.build(_columns(), directory, block_size=16)
+    monkeypatch.setitem(access.config, "index_dir", directory)
+    assert access.get_index() is not None
+
+    access.upload_file("sales.csv", "prices_coordinates_data", conn=FakeConnection())
+    assert index.is_stale(directory)
+    assert access.get_index() is None
+
+    index.build(_columns(), directory, block_size=16)
+    assert not index.is_stale(directory)
+    assert access.get_index() is not None
+
+def test_failing_listener_does_not_fail_committed_upload(tmp_path, monkeypatch):
+    monkeypatch.setitem(access.config, "index_dir", str(tmp_path / "index"))
+    called = []
+    def failing(filename, table):
+        raise RuntimeError("listener failed")
+    monkeypatch.setattr(access, "upload_listeners", [failing, lambda filename, table: called.append(filename)])
+
+    assert access.upload_file("sales.csv", "prices_coordinates_data", conn=FakeConnection()) == 0
+    assert called == ["sales.csv"]
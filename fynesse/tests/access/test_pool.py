@@ -0,0 +1,88 @@
+import threading
+import time
+import pytest
+from fynesse import access
+
+class FakeConnection:
+    def __init__(self, broken=False):
+        self.broken = broken
+        self.closed = False
+        self.pings = self.rollbacks = 0
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+        if self.broken:
+            raise ConnectionError("gone")
+
+    def rollback(self):
+        self.rollbacks += 1
+        if self.broken:
+            raise ConnectionError("gone")
+
+    def close(self):
+        self.closed = True
+
+def test_pool_reuses_released_connections():
+    pool = access.ConnectionPool(FakeConnection, size=2)
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+
+def test_exhausted_pool_times_out():
+    pool = access.ConnectionPool(FakeConnection, size=1, timeout=0.05)
+    pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+
+def test_discarded_connection_wakes_a_waiter():
+    # Without a timeout a waiter must be woken when a checked out connection is discarded on release
+    pool = access.ConnectionPool(FakeConnection, size=1)
+    conn = pool.acquire()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()), daemon=True)
+    waiter.start()
+    time.sleep(0.05)
+    conn.broken = True
+    pool.release(conn)
+    waiter.join(timeout=2)
+    assert not waiter.is_alive()
+    assert conn.closed and acquired[0] is not conn
+
+def test_unhealthy_idle_connection_is_replaced():
+    pool = access.ConnectionPool(FakeConnection, size=1, ping_after=0)
+    conn = pool.acquire()
+    pool.release(conn)
+    conn.broken = True
+    fresh = pool.acquire()
+    assert fresh is not conn and conn.closed
+
+def test_failed_connect_frees_its_slot():
+    calls = []
+    def connect():
+        calls.append(1)
+        return None if len(calls) == 1 else FakeConnection()
+    pool = access.ConnectionPool(connect, size=1, timeout=0.05)
+    with pytest.raises(ConnectionError):
+        pool.acquire()
+    assert isinstance(pool.acquire(), FakeConnection)
+
+def test_recently_used_connection_is_not_pinged():
+    pool = access.ConnectionPool(FakeConnection, size=1, ping_after=60)
+    conn = pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn and conn.pings == 0
+    pool.release(conn)
+    pool.ping_after = 0
+    time.sleep(0.01)
+    assert pool.acquire() is conn and conn.pings == 1
+
+def test_connection_is_rolled_back_only_in_a_transaction():
+    pool = access.ConnectionPool(FakeConnection, size=1)
+    conn = pool.acquire()
+    conn.server_status = 0
+    pool.release(conn)
+    assert conn.rollbacks == 0
+    conn = pool.acquire()
+    conn.server_status = access.SERVER_STATUS_IN_TRANS
+    pool.release(conn)
+    assert conn.rollbacks == 1
@@ -0,0 +1,46 @@
+import datetime
+from fynesse import access
+
+LONDON = (51.56, 51.46, -0.2, -0.05, datetime.date(2020, 9, 1), datetime.date(2020, 6, 1))
+
+def _ids(rows):
+    return sorted(row[0] for row in rows)
+
+def test_cached_rows_match_uncached_rows(database):
+    access.invalidate_rows_cache()
+    uncached = access.get_rows_in_bounds(*LONDON, cache=False)
+    assert len(uncached) > 0
+    assert _ids(access.get_rows_in_bounds(*LONDON)) == _ids(uncached)
+    # The second call is answered by the cache
+    assert _ids(access.get_rows_in_bounds(*LONDON)) == _ids(uncached)
+
+def test_snapped_fetch_is_not_cut_short_by_the_limit(database, monkeypatch):
+    access.invalidate_rows_cache()
+    uncached = access.get_rows_in_bounds(*LONDON, cache=False)
+    # The snapped bounds hold more rows than the limit, the bounds themselves do not
+    monkeypatch.setattr(access, "BOUNDS_LIMIT", len(uncached))
+    assert _ids(access.get_rows_in_bounds(*LONDON)) == _ids(uncached)
+
+def test_rows_fetched_before_an_invalidate_are_not_cached(database):
+    rows_cache = access.get_rows_cache()
+    rows_cache.invalidate()
+    key = access.snap_bounds(*LONDON)
+    generation = rows_cache.generation
+    rows = access.get_rows_in_bounds(*LONDON, cache=False)
+    stale = [(0, datetime.date(2020, 7, 1), 51.5, -0.1)]
+    # An upload finishes between the fetch and the put
+    rows_cache.invalidate()
+    rows_cache.put(key, stale, ["db_id", "date_of_transfer", "latitude", "longitude"], generation)
+    assert rows_cache.get(key) is None
+    assert _ids(access.get_rows_in_bounds(*LONDON)) == _ids(rows)
+
+def test_cache_is_bounded_in_bytes():
+    columns = ["db_id", "date_of_transfer", "latitude", "longitude"]
+    rows_cache = access.RowsCache(max_bytes=10 * 2**20)
+    for i in range(10):
+        rows = [(j, datetime.date(2020, 1, 1), 51.5, -0.1) for j in range(10000)]
+        rows_cache.put(i, rows, columns)
+    stats = rows_cache.stats()
+    assert 0 < stats["bytes"] <= rows_cache.max_bytes
+    assert stats["evictions"] > 0
+    assert rows_cache.get(9) is not None and rows_cache.get(0) is None
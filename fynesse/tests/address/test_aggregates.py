@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fynesse import address, design, synthetic
+
+@pytest.fixture(scope="module")
+def sales():
+    return synthetic.generate(20000, seed=0, start="2020-01-01", end="2021-01-01")
+
+def _expected(sales, sale, precision, months, property_type=None):
+    cells = design.geohashes(sales["Latitude"], sales["Longitude"], precision)
+    month = np.asarray(sales["Date"].values, dtype="datetime64[M]")
+    last = np.datetime64(sale.Date, "M")
+    mask = (cells == design.geohash(sale.Latitude, sale.Longitude, precision)) & (month <= last) & (month > last - months)
+    if property_type is not None:
+        mask &= sales["Property Type"].values == property_type
+    return sales["Price"][mask].astype(np.float64)
+
+@pytest.mark.parametrize("precision,property_type", [(3, None), (4, "F"), (5, None), (7, "D")])
+def test_stats_match_the_sales(sales, precision, property_type):
+    aggregates = address.CellAggregates()
+    aggregates.add(sales)
+    for _, sale in sales.head(20).iterrows():
+        prices = _expected(sales, sale, precision, 6, property_type)
+        stats = aggregates.stats(sale.Latitude, sale.Longitude, sale.Date, property_type, precision=precision, months=6)
+        assert stats["count"] == len(prices)
+        if len(prices):
+            assert stats["mean"] == pytest.approx(prices.mean())
+            assert stats["std"] == pytest.approx(prices.std(ddof=0), rel=1e-6, abs=1e-3)
+            # The median is estimated within a bin of the histogram
+            assert abs(np.log10(stats["median"]) - np.log10(prices.median())) <= 2 * 5 / address.CellAggregates.BINS
+
+def test_incremental_adds_match_one_add(sales, tmp_path):
+    whole, parts = address.CellAggregates(), address.CellAggregates()
+    whole.add(sales)
+    for chunk in np.array_split(np.arange(len(sales)), 7):
+        parts.add(sales.iloc[chunk])
+    pd.testing.assert_frame_equal(parts.table, whole.table)
+    assert np.all(np.diff(whole.keys) > 0)
+
+    path = str(tmp_path / "aggregates.parquet")
+    whole.save(path)
+    loaded = address.CellAggregates.load(path)
+    pd.testing.assert_frame_equal(loaded.table, whole.table)
+    loaded.add(sales.head(10))
+    assert loaded.counts.sum() == whole.counts.sum() + 10 * len(address.CellAggregates.PRECISIONS)
+
+def test_stats_of_an_empty_cell(sales):
+    aggregates = address.CellAggregates()
+    assert aggregates.stats(51.5, -0.12, pd.Timestamp("2020-06-01"))["count"] == 0
+    aggregates.add(sales)
+    with pytest.raises(ValueError):
+        aggregates.stats(51.5, -0.12, pd.Timestamp("2020-06-01"), precision=2)
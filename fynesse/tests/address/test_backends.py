@@ -0,0 +1,31 @@
+import datetime
+import numpy as np
+from fynesse import address, synthetic
+
+def test_ridge_matches_statsmodels():
+    df = synthetic.generate(2000, seed=1, start="2020-01-01", end="2021-01-01")
+    df = df[df["Town/City"] == "LONDON"].reset_index(drop=True)
+    train = address.training_frame(synthetic.rows(df), 5)
+    targets = df.sample(20, random_state=0)
+    predictions = {}
+    for backend in address.BACKENDS:
+        predictions[backend] = np.array([
+            address.predict_from_data(5, train, row.Latitude, row.Longitude, row.Date.date(), row["Property Type"],
+                backend=backend)[:2]
+            for _, row in targets.iterrows()
+        ])
+    np.testing.assert_allclose(predictions["ridge"], predictions["statsmodels"], rtol=1e-6)
+
+def _degenerate_fits(train):
+    return {
+        backend: address.predict_from_data(5, train, 51.5, -0.12, datetime.date(2020, 6, 1), "F", backend=backend)[1]
+        for backend in address.BACKENDS
+    }
+
+def test_constant_and_single_row_frames_have_undefined_r2():
+    df = synthetic.generate(2000, seed=1, start="2020-01-01", end="2021-01-01")
+    df = df[df["Town/City"] == "LONDON"].reset_index(drop=True)
+    constant = df.head(50).assign(Price=250000)
+    for frame in (constant, df.head(1)):
+        rs = _degenerate_fits(address.training_frame(synthetic.rows(frame), 5))
+        assert rs == {"statsmodels": -float('inf'), "ridge": -float('inf')}
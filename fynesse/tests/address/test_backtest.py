@@ -0,0 +1,22 @@
+import datetime
+import warnings
+from fynesse import address, backtest
+
+def test_training_rows_exclude_held_out_period(database):
+    df = backtest.held_out("2020-10-01", "2020-11-01", sample=200)
+    start = datetime.date(2020, 10, 1)
+    rows = address.rows_in_bounds(90, -90, -180, 180, datetime.date(2021, 1, 1), datetime.date(2020, 1, 1),
+        holdout=(start, frozenset(df["ID"])))
+    dates = [row[address.COLUMNS.index("Date")] for row in rows]
+    ids = {row[address.ID] for row in rows}
+    assert len(rows) > 0
+    assert max(dates) < start
+    assert not ids & set(df["ID"])
+
+def test_backtest_does_not_predict_from_held_out_sales(database):
+    df = backtest.held_out("2020-10-01", "2020-11-01", sample=200)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        report = backtest.run(df, args=(5, 180, 5), backend="ridge", batch=True, start="2020-10-01")
+    assert report["training"] == {"before": "2020-10-01", "held_out_ids": 200}
+    assert report["accuracy"]["median_ape"] > 0.01
@@ -0,0 +1,24 @@
+import numpy as np
+import pygeohash as gh
+from fynesse import design
+
+# Points on the midpoints of the bisection, where an encoder that rounds down disagrees with pygeohash
+BOUNDARY_POINTS = [(0.0, 0.0), (45.0, 90.0), (22.5, -45.0), (-45.0, 0.0), (0.0, -90.0), (90.0, 180.0), (-90.0, -180.0)]
+
+def test_geohashes_match_pygeohash_on_boundaries():
+    latitudes, longitudes = zip(*BOUNDARY_POINTS)
+    for precision in (1, 5, 12):
+        expected = [gh.encode(lat, lon, precision=precision) for lat, lon in BOUNDARY_POINTS]
+        assert list(design.geohashes(latitudes, longitudes, precision)) == expected
+
+def test_geohashes_match_pygeohash_on_grid():
+    # Multiples of the cell size at precision 5 lie on a cell edge at every coarser bisection
+    rng = np.random.default_rng(0)
+    latitudes = np.round(rng.uniform(-90, 90, 2000) / (180 / 2 ** 12)) * (180 / 2 ** 12)
+    longitudes = np.round(rng.uniform(-180, 180, 2000) / (360 / 2 ** 13)) * (360 / 2 ** 13)
+    expected = [gh.encode(float(lat), float(lon), precision=5) for lat, lon in zip(latitudes, longitudes)]
+    assert list(design.geohashes(latitudes, longitudes, 5)) == expected
+
+def test_geohash_of_target_matches_training_cell():
+    for lat, lon in BOUNDARY_POINTS:
+        assert design.geohash(lat, lon, 6) == design.geohashes([lat], [lon], 6)[0]
@@ -0,0 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+from fynesse import address, synthetic
+
+ARGS = (5, 180, 5)
+
+@pytest.mark.parametrize("chunksize", [None, 1, 3, 100])
+def test_chunked_predictions_match_sequential(database, chunksize, capsys):
+    sales = synthetic.generate(20000, seed=0, start="2020-01-01", end="2021-01-01")
+    sales = sales[sales["Town/City"] == "LONDON"].head(7).reset_index(drop=True)
+    sales.loc[2, "Date"] = None
+
+    expected = [address.predict_rows(ARGS, False, "ridge", [row])[0][0]
+        for row in zip(sales["Latitude"], sales["Longitude"], sales["Date"], sales["Property Type"])]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        prices, rs = address.price_predictions(sales, args=ARGS, backend="ridge", executor=executor,
+            chunksize=chunksize, progress=True)
+
+    np.testing.assert_allclose(prices, [p for p, _, _ in expected])
+    np.testing.assert_allclose(rs, [r for _, r, _ in expected])
+    output = capsys.readouterr().out
+    assert "Prediction of row 2 failed" in output
+    assert "Predicted 7/7 sales" in output
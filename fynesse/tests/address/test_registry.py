@@ -0,0 +1,120 @@
+import sqlite3
+import threading
+import time
+import pytest
+import datetime
+from fynesse import access, address, assess, design, synthetic
+
+ARGS = (5, 180, 5)
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    path = synthetic.sqlite_database(str(tmp_path / "pcd.sqlite"), 5000, seed=0, start="2020-01-01", end="2021-01-01")
+    synthetic.use_sqlite(path)
+    monkeypatch.setattr(access, "upload_listeners", [])
+    yield path
+    access.close_pool()
+    access.invalidate_rows_cache()
+
+def _new_sales(path, n=5):
+    """
+    Copies of the sales of the first rows of the table, with new IDs, so they fall within the cells of those sales
+    """
+    df = synthetic.generate(5000, seed=0, start="2020-01-01", end="2021-01-01").head(n).copy()
+    with sqlite3.connect(path) as conn:
+        df["ID"] = conn.execute("SELECT MAX(db_id) FROM prices_coordinates_data").fetchone()[0] + 1 + df.index
+    return df
+
+def _insert(path, df):
+    with sqlite3.connect(path) as conn:
+        conn.executemany(f"INSERT INTO prices_coordinates_data VALUES ({', '.join('?' * 15)})", synthetic.rows(df))
+    access.invalidate_rows_cache()
+
+class UploadConnection:
+    """
+    Stands in for the connection of access.upload_file, inserting sales rather than loading a file
+    """
+    def __init__(self, path, df):
+        self.path = path
+        self.df = df
+
+    def cursor(self):
+        return self
+
+    def execute(self, query):
+        _insert(self.path, self.df)
+        return len(self.df)
+
+    def commit(self):
+        pass
+
+def _key(registry, sale):
+    return registry.key(sale.Latitude, sale.Longitude, sale.Date.date())
+
+def test_update_skips_sales_a_cell_fetched_when_built(database):
+    registry = address.ModelRegistry(ARGS)
+    registry.watch()
+    new = _new_sales(database)
+    key = _key(registry, new.iloc[0])
+    before = registry.get(key)["stats"].n
+
+    # The upload commits, then another cell is built before the upload listener updates the registry
+    _insert(database, new)
+    other = address.ModelRegistry(ARGS)
+    fresh = registry.entries[key] = other.get(key)
+    fresh_n = fresh["stats"].n
+    assert fresh_n > before
+
+    registry.update_from_table()
+    assert fresh["stats"].n == fresh_n
+    assert registry.update_from_table() == 0
+
+def test_watched_registry_follows_uploads(database):
+    registry = address.ModelRegistry(ARGS)
+    registry.watch()
+    new = _new_sales(database)
+    key = _key(registry, new.iloc[0])
+    entry = registry.get(key)
+    before = entry["stats"].n
+    inside = access.in_bounds(new["Latitude"].values, new["Longitude"].values, design.ordinals(new["Date"]),
+        *entry["bounds"])
+
+    access.upload_file("sales.csv", "prices_coordinates_data", conn=UploadConnection(database, new))
+    assert inside.any()
+    assert entry["stats"].n == before + inside.sum()
+    assert entry["high_water"] == new["ID"][inside].max()
+    assert registry.staleness().loc[key, "rows"] == before + inside.sum()
+
+def test_update_from_csv_adds_sales_within_bounds(database, tmp_path):
+    registry = address.ModelRegistry(ARGS)
+    new = _new_sales(database)
+    entry = registry.get(_key(registry, new.iloc[0]))
+    before = entry["stats"].n
+    path = tmp_path / "sales.csv"
+    new[list(assess.YEAR_COLUMNS)].to_csv(path, header=False, index=False)
+    assert registry.update_from_csv(str(path)) == 1
+    assert entry["stats"].n > before
+
+def test_concurrent_gets_fetch_a_cell_once(database, monkeypatch):
+    registry = address.ModelRegistry(ARGS)
+    sale = _new_sales(database).iloc[0]
+    fetches = []
+    training_data = address.training_data
+    def slow_training_data(*args):
+        fetches.append(args)
+        time.sleep(0.1)
+        return training_data(*args)
+    monkeypatch.setattr(address, "training_data", slow_training_data)
+
+    registered = registry.get(_key(registry, sale))
+    other = registry.key(53.4, -2.2, datetime.date(2020, 6, 1))
+    threads = [threading.Thread(target=registry.get, args=(other,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    # A registered cell is served while another cell is fetched
+    t0 = time.perf_counter()
+    assert registry.get(_key(registry, sale)) is registered
+    assert time.perf_counter() - t0 < 0.05
+    for thread in threads:
+        thread.join()
+    assert len(fetches) == 2
@@ -0,0 +1,62 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+from fynesse import access, address, serve, synthetic
+
+ARGS = (5, 180, 5)
+
+def test_service_answers_requests_like_predict_price(database):
+    sales = synthetic.generate(20000, seed=0, start="2020-01-01", end="2021-01-01")
+    sales = sales[sales["Town/City"] == "LONDON"].head(10)
+    requests = [
+        {"id": i, "latitude": float(row.Latitude), "longitude": float(row.Longitude),
+            "date": str(row.Date.date()), "property_type": row["Property Type"]}
+        for i, (_, row) in enumerate(sales.iterrows())
+    ]
+
+    async def run():
+        service = serve.PredictionService(args=ARGS, fit_executor=ThreadPoolExecutor(max_workers=2))
+        server = await asyncio.start_server(service._connection, "127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.sockets[0].getsockname()[1])
+        for request in requests:
+            writer.write((json.dumps(request) + "\n").encode())
+        writer.write(b'{"id": "bad", "latitude": "x"}\n')
+        await writer.drain()
+        responses = [json.loads(await reader.readline()) for _ in range(len(requests) + 1)]
+        writer.write(b'{"stats": true}\n')
+        await writer.drain()
+        stats = json.loads(await reader.readline())
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        service.close()
+        return responses, stats
+
+    access.invalidate_rows_cache()
+    responses, stats = asyncio.run(run())
+    by_id = {response["id"]: response for response in responses}
+    assert by_id["bad"]["error"] is not None
+    assert stats["requests"] == len(requests)
+    assert any(response["price"] is not None for response in responses)
+    for request in requests:
+        price, r2, _ = address.predict_price_parameterized(ARGS, request["latitude"], request["longitude"],
+            np.datetime64(request["date"]).astype(object), request["property_type"], backend="ridge")
+        response = by_id[request["id"]]
+        if np.isnan(price):
+            assert response["price"] is None
+        else:
+            assert response["price"] == pytest.approx(price)
+
+def test_latencies_are_bounded(database):
+    async def run():
+        service = serve.PredictionService(args=ARGS, fit_executor=ThreadPoolExecutor(max_workers=2), latency_window=3)
+        for day in range(1, 8):
+            await service.predict(51.5, -0.12, np.datetime64(f"2020-06-0{day}").astype(object), "F")
+        service.close()
+        return service
+
+    service = asyncio.run(run())
+    assert len(service.latencies) == 3
+    assert service.stats()["requests"] == 7
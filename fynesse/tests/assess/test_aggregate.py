@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+from fynesse import assess
+
+STATISTICS = ("count", "mean", "std", "min", "max", "median", "p90")
+
+def test_group_statistics_of_no_values():
+    groups, results = assess.group_statistics([], [], STATISTICS, n_groups=3)
+    assert len(groups) == 0
+    assert all(len(results[statistic]) == 0 for statistic in STATISTICS)
+
+def test_aggregate_of_categorical_frame_filtered_to_no_rows():
+    df = pd.DataFrame({"Property Type": pd.Categorical(["F", "S", "D"]), "Price": [1.0, 2.0, 3.0]})
+    table = assess.aggregate(df[df["Price"] > 10], "Property Type", "Price", STATISTICS)
+    assert len(table) == 0
+    assert list(table.columns) == list(STATISTICS)
+
+def test_aggregate_matches_pandas():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"Group": rng.choice(list("abcd"), 1000), "Price": rng.lognormal(12, 1, 1000)})
+    table = assess.aggregate(df, "Group", "Price", ("count", "mean", "median", "min", "max"))
+    expected = df.groupby("Group", sort=False)["Price"].agg(["count", "mean", "median", "min", "max"])
+    pd.testing.assert_frame_equal(table, expected, check_dtype=False, check_names=False)
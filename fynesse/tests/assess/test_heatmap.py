@@ -0,0 +1,21 @@
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import geopandas as gpd
+import pytest
+from shapely.geometry import box
+from fynesse import assess, synthetic
+
+@pytest.fixture
+def boundary(monkeypatch):
+    monkeypatch.setattr(assess, "_uk_boundary", gpd.GeoDataFrame(geometry=[box(-8, 49, 2, 59)], crs="EPSG:4326"))
+    yield
+    plt.close("all")
+
+@pytest.mark.parametrize("col", ["Price", "Property Type"])
+def test_points_mode_plots_numeric_and_categorical_columns(boundary, col):
+    df = synthetic.generate(500, seed=0, start="2020-01-01", end="2021-01-01")
+    assess.plot_gdf_col_heatmap(df, col)
+    ax = plt.gca()
+    if col == "Property Type":
+        assert ax.get_legend() is not None
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fynesse import quality, synthetic
+
+@pytest.fixture(scope="module")
+def sales():
+    return synthetic.generate(20000, seed=0, start="2020-01-01", end="2021-01-01")
+
+def test_hyperloglog_estimates_and_merges():
+    values = np.arange(200000)
+    first, second, whole = quality.HyperLogLog(), quality.HyperLogLog(), quality.HyperLogLog()
+    first.add(values[:120000])
+    second.add(values[80000:])
+    whole.add(values)
+    assert whole.estimate() == pytest.approx(len(values), rel=0.03)
+    first.merge(second)
+    assert first.estimate() == whole.estimate()
+
+def test_relative_sketch_quantiles_are_within_accuracy_and_merge():
+    rng = np.random.default_rng(0)
+    values = np.concatenate((rng.lognormal(12, 1, 50000), -rng.lognormal(3, 1, 1000), np.zeros(100)))
+    first, second = quality.QuantileSketch(0.01), quality.QuantileSketch(0.01)
+    first.add(values[:30000])
+    second.add(values[30000:])
+    first.merge(second)
+    qs = np.array([0.05, 0.5, 0.95])
+    expected = np.quantile(values, qs, method="lower")
+    np.testing.assert_allclose(first.quantiles(qs), expected, rtol=0.02)
+
+def test_width_sketch_quantiles_are_within_width():
+    rng = np.random.default_rng(0)
+    values = rng.uniform(49.9, 58.7, 50000)
+    sketch = quality.QuantileSketch(width=1e-4)
+    sketch.add(values)
+    np.testing.assert_allclose(sketch.quantiles([0.25, 0.5, 0.75]), np.quantile(values, [0.25, 0.5, 0.75]), atol=1e-3)
+
+def test_frequent_values_find_the_heavy_hitters_and_merge():
+    rng = np.random.default_rng(0)
+    values = pd.Series(np.concatenate((np.repeat(["a", "b", "c"], [5000, 3000, 2000]), rng.integers(0, 10000, 20000).astype(str))))
+    first, second = quality.FrequentValues(capacity=50), quality.FrequentValues(capacity=50)
+    first.add(values[:15000].value_counts())
+    second.add(values[15000:].value_counts())
+    first.merge(second)
+    top = dict(first.top(3))
+    assert list(top) == ["a", "b", "c"]
+    for value, count in top.items():
+        assert (values == value).sum() - len(values) / 51 * 2 <= count <= (values == value).sum()
+
+def test_coordinate_quantiles_have_an_absolute_error(sales):
+    report = quality.profile_chunks(sales.iloc[i:i + 5000] for i in range(0, len(sales), 5000)).report()
+    for column in ("Latitude", "Longitude"):
+        assert report["columns"][column]["quantiles"]["p50"] == pytest.approx(sales[column].median(), abs=1e-3)
+    assert report["columns"]["Price"]["quantiles"]["p50"] == pytest.approx(sales["Price"].median(), rel=0.02)
+    assert report["columns"]["Date"]["min"] == str(sales["Date"].min().date())
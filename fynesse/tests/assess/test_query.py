@@ -0,0 +1,19 @@
+import warnings
+import pytest
+from fynesse import access, assess
+
+SQL = "SELECT price, date_of_transfer FROM prices_coordinates_data"
+
+def test_capped_query_warns_when_it_truncates(database, monkeypatch):
+    monkeypatch.setattr(access, "QUERY_LIMIT", 100)
+    with pytest.warns(UserWarning, match="truncated"):
+        df = assess.query(SQL, ["Price", "Date"])
+    assert len(df) == 100
+    streamed = assess.query(SQL, ["Price", "Date"], chunk_size=5000)
+    assert len(streamed) > 100
+
+def test_capped_query_is_silent_when_every_row_fits(database):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        df = assess.query(SQL + " LIMIT 10", ["Price", "Date"])
+    assert len(df) == 10
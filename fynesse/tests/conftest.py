@@ -0,0 +1,15 @@
+import pytest
+from fynesse import access, synthetic
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    """
+    A SQLite stand-in of prices_coordinates_data holding 20000 synthetic sales of 2020, answering the queries of
+    access for the tests of a module
+    """
+    path = synthetic.sqlite_database(str(tmp_path_factory.mktemp("db") / "pcd.sqlite"), 20000, seed=0,
+        start="2020-01-01", end="2021-01-01")
+    synthetic.use_sqlite(path)
+    yield path
+    access.close_pool()
+    access.invalidate_rows_cache()
@@ -27,7 +27,7 @@ VERSION = "0.1.0"
 
 # What packages are required for this module to be executed?
 REQUIRED = [
-    "pandas", "numpy", "jupyter", "matplotlib", 
+    "pandas", "numpy", "jupyter", "matplotlib", "pyarrow", "scipy",
 ]
 
 # What packages are optional?
@@ -115,9 +115,10 @@ setup(
     # If your package is a single module, use this instead of "packages":
     # py_modules=["mypackage"],
 
-    # entry_points={
-    #     "console_scripts": ["mycli=mymodule:cli"],
-    # },
+    entry_points={
+        "console_scripts": ["fynesse-index=fynesse.index:main", "fynesse-serve=fynesse.serve:main",
+            "fynesse-backtest=fynesse.backtest:main", "fynesse-bench=fynesse.bench:main"],
+    },
     install_requires=REQUIRED,
     extras_require=EXTRAS,
     include_package_data=True,